@@ -0,0 +1,137 @@
+import json
+
+from shared.opcodes import SENSOR_DATA, SYSINFO_DATA, UPDATE_SYSINFO
+from shared.routes import ESP, HOST, PICO, PRIVATE
+from shared.sysInfoSync import compressSysInfo
+from shared.utils import getHash
+
+
+# name, cpu threads, drives, network interfaces, gpus
+SHAPES = [
+    ('4t', 4, 1, 1, 0),
+    ('16t', 16, 4, 2, 1),
+    ('64t', 64, 12, 4, 3),
+]
+
+
+def makeSysInfo(threads: int, drives: int, nics: int, gpus: int) -> dict:
+    return {
+        'name': 'BENCH-HOST',
+        'os': 'Windows 10',
+        'arch': 'AMD64',
+        'cpuName': 'AMD Ryzen Threadripper PRO 5995WX 64-Cores',
+        'cpuCores': max(1, threads // 2),
+        'cpuThreads': threads,
+        'ramTotal': 65_419,
+        'drives': [{'name': f'Samsung SSD 980 PRO 2TB [{i}]'} for i in range(drives)],
+        'networkInterfaces': [{'name': f'Intel(R) Ethernet Controller I225-V #{i}'} for i in range(nics)],
+        'gpus': [{'name': f'NVIDIA GeForce RTX 3090 [{i}]', 'vram': 24_576.0} for i in range(gpus)]
+    }
+
+
+def makeSensors(sysInfo: dict) -> list:
+    # same order as driver/sensors.mapReg and shared/sensors.parseSensors
+    values = [0, 100, 0, 100.0, 1_234, 65.5, 54.25, 17.5, 1_799.9, 12_345]
+    values += [(i * 7.3) % 100 for i in range(sysInfo['cpuThreads'])]
+
+    for i in range(len(sysInfo['drives'])):
+        values += [i * 1.5, i * 0.25]
+
+    for i in range(len(sysInfo['drives'])):
+        values += [38 + i, 97, False, False, 23_456 + i, 34_567 + i]
+
+    for i in range(len(sysInfo['networkInterfaces'])):
+        values += [i * 12.5, i * 150.75]
+
+    for i in range(len(sysInfo['gpus'])):
+        values += [12.0 + i, 1_024.0 * (i + 1), 45.0 + i]
+
+    return values
+
+
+def makeSensorPacket(sysInfo: dict, values: list) -> list:
+    return [SENSOR_DATA, HOST, PICO, 1_234, PRIVATE, getHash(sysInfo)] + values
+
+
+def makeCorpus() -> list:
+    corpus = []
+
+    for name, threads, drives, nics, gpus in SHAPES:
+        sysInfo = makeSysInfo(threads, drives, nics, gpus)
+        values = makeSensors(sysInfo)
+
+        corpus.append((name, sysInfo, values, makeSensorPacket(sysInfo, values)))
+
+    return corpus
+
+
+def makeSysInfoPacket(sysInfo: dict) -> list:
+    return [SYSINFO_DATA, PICO, ESP, 1_234, PRIVATE, json.dumps(sysInfo)]
+
+
+def makeUpdateSysInfoPacket(sysInfo: dict) -> list:
+    return [UPDATE_SYSINFO, PICO, ESP, 1_234, PRIVATE, getHash(sysInfo)]
+
+
+def makeSysInfoCorpus() -> list:
+    # compressed is None where zlib can only decompress (micropython builds without deflate compression)
+    corpus = []
+
+    for name, threads, drives, nics, gpus in SHAPES:
+        sysInfo = makeSysInfo(threads, drives, nics, gpus)
+
+        try:
+            compressed = compressSysInfo(sysInfo)
+        except Exception:
+            compressed = None
+
+        corpus.append((name, sysInfo, compressed, makeSysInfoPacket(sysInfo), makeUpdateSysInfoPacket(sysInfo)))
+
+    return corpus
+
+
+def makeHWiNFOSnapshot(sysInfo: dict) -> tuple:
+    # (sensors, gpus) as driver/sensors reads them from the HWiNFO registry values and GPUtil,
+    # padded with the unmapped sensors a real HWiNFO install reports as well
+    threads = sysInfo['cpuThreads']
+    sensors = {
+        'System: BENCH-HOST': {
+            'Physical Memory Used': '12345',
+            'Memory Clock': '1799.9',
+            'Bus Clock': '100.0',
+        },
+        'CPU [#0]: AMD Ryzen': {f'Core {i // 2} T{i % 2} Usage': f'{(i * 7.3) % 100:.1f}' for i in range(threads)},
+    }
+
+    sensors['CPU [#0]: AMD Ryzen'].update({
+        'Total CPU Usage': '17.5',
+        'CPU (Tctl/Tdie)': '54.25',
+        'CPU Package Power': '65.5',
+    })
+
+    for i, drive in enumerate(sysInfo['drives']):
+        sensors[f'S.M.A.R.T.: {drive["name"]}'] = {
+            'Drive Temperature': f'{38 + i}',
+            'Drive Remaining Life': '97',
+            'Drive Warning': 'No',
+            'Drive Failure': 'No',
+            'Total Host Reads': f'{23_456 + i}',
+            'Total Host Writes': f'{34_567 + i}',
+        }
+        sensors[f'Drive: {drive["name"]}'] = {'Read Rate': f'{i * 1.5}', 'Write Rate': f'{i * 0.25}'}
+
+    for i, nic in enumerate(sysInfo['networkInterfaces']):
+        sensors[f'Network: {nic["name"]}'] = {'Current UP rate': f'{i * 12.5}', 'Current DL rate': f'{i * 150.75}'}
+
+    for i in range(threads * 2):
+        sensors[f'Unmapped [#{i}]'] = {f'Value {j}': f'{j * 0.5}' for j in range(6)}
+
+    gpus = [{
+        'name': gpu['name'],
+        'vram': gpu['vram'],
+        'usage': 12.0 + i,
+        'memUsed': 1_024.0 * (i + 1),
+        'temp': 45.0 + i,
+    } for i, gpu in enumerate(sysInfo['gpus'])]
+
+    return sensors, gpus
@@ -0,0 +1,239 @@
+# Benchmarks for the protocol code shared by the host driver, the Pico and the ESP.
+#
+#   python benchmarks/protocol.py [-o out.json] [-t seconds] [-micropython[=binary]]
+#   python benchmarks/protocol.py -compare old.json new.json
+#
+# Run from the repository root. The same script runs on the micropython unix port,
+# -micropython runs it there as well and stores the results under 'micropython'.
+import gc
+import json
+import sys
+import time
+
+sys.path.insert(0, '.')
+
+from benchmarks.corpus import makeCorpus, makeSysInfoCorpus  # noqa: E402
+from shared.packets import WIRE_V1, WIRE_V2, PacketView, packData, packPacket, unpackData  # noqa: E402
+from shared.sensors import parseSensors  # noqa: E402
+from shared.sysInfoSync import compressSysInfo, sysInfoChunks  # noqa: E402
+from shared.routes import ESP, PICO  # noqa: E402
+from shared.types import Packet  # noqa: E402
+from shared.utils import getHash  # noqa: E402
+
+
+MICROPYTHON = sys.implementation.name == 'micropython'
+
+if MICROPYTHON:
+    def ticks() -> int:
+        return time.ticks_us()
+
+    def elapsed(start: int) -> int:
+        return time.ticks_diff(time.ticks_us(), start)
+else:
+    import tracemalloc
+
+    def ticks() -> int:
+        return time.perf_counter_ns() // 1_000
+
+    def elapsed(start: int) -> int:
+        return time.perf_counter_ns() // 1_000 - start
+
+
+def measureAlloc(fn) -> int:
+    # micropython counts every allocated byte, CPython reports the peak of a single call
+    if MICROPYTHON:
+        gc.collect()
+        gc.disable()
+        before = gc.mem_alloc()
+        fn()
+        after = gc.mem_alloc()
+        gc.enable()
+
+        return after - before
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return peak - base
+
+
+def measure(fn, duration: float) -> dict:
+    fn()  # warm up caches
+
+    iterations = 0
+    start = ticks()
+    limit = int(duration * 1_000_000)
+
+    while True:
+        for _ in range(10):
+            fn()
+
+        iterations += 10
+        us = elapsed(start)
+
+        if us >= limit:
+            break
+
+    return {
+        'ops_per_sec': round(iterations * 1_000_000 / us, 1),
+        'us_per_op': round(us / iterations, 3),
+        'alloc_bytes': measureAlloc(fn),
+    }
+
+
+def packChunks(compressed: bytes, sysHash: bytes) -> list:
+    raws = []
+
+    for uniq, chunk in enumerate(sysInfoChunks(PICO, ESP, sysHash, compressed)):
+        chunk.uniq = uniq
+        raws.append(packPacket(chunk, WIRE_V2))
+
+    return raws
+
+
+def makeCases() -> list:
+    cases = []
+
+    for name, sysInfo, values, packet in makeCorpus():
+        obj = Packet(packet[0], packet[1], packet[2], packet[3], packet[4], list(packet[5:]))
+        legacy = packData(list(packet), WIRE_V1)
+        v2 = packData(list(packet), WIRE_V2)
+
+        cases += [
+            (f'packData/v1/{name}', lambda p=packet: packData(p, WIRE_V1), len(legacy)),
+            (f'packData/v2/{name}', lambda p=packet: packData(p, WIRE_V2), len(v2)),
+            (f'unpackData/v1/{name}', lambda r=legacy: unpackData(r), len(legacy)),
+            (f'unpackData/v2/{name}', lambda r=v2: unpackData(r), len(v2)),
+            (f'PacketView/v1/{name}', lambda r=legacy: PacketView(r).data, len(legacy)),
+            (f'PacketView/v2/{name}', lambda r=v2: PacketView(r)[5], len(v2)),
+            # routing only reads the header, forwarding copies the frame without decoding it
+            (f'PacketView/route/v2/{name}', lambda r=v2: PacketView(r).destination, len(v2)),
+            (f'PacketView/forward/v2/{name}', lambda r=v2: packPacket(PacketView(r), WIRE_V2), len(v2)),
+            (f'packPacket/v2/{name}', lambda p=obj: packPacket(p, WIRE_V2), len(v2)),
+            (f'parseSensors/{name}', lambda v=values, s=sysInfo: parseSensors(v, s), None),
+            (f'getHash/{name}', lambda s=sysInfo: getHash(s), None),
+        ]
+
+    for name, sysInfo, compressed, packet, update in makeSysInfoCorpus():
+        raw = packData(list(packet), WIRE_V2)
+        updateRaw = packData(list(update), WIRE_V2)
+
+        cases += [
+            (f'packData/sysInfo/{name}', lambda p=packet: packData(p, WIRE_V2), len(raw)),
+            (f'unpackData/sysInfo/{name}', lambda r=raw: unpackData(r), len(raw)),
+            (f'packData/updateSysInfo/{name}', lambda p=update: packData(p, WIRE_V2), len(updateRaw)),
+            (f'unpackData/updateSysInfo/{name}', lambda r=updateRaw: unpackData(r), len(updateRaw)),
+        ]
+
+        if compressed is None:
+            continue
+
+        # every chunk of a compressed transfer, frame_bytes is the size of all of them together
+        chunks = packChunks(compressed, update[5])
+
+        cases += [
+            (f'compressSysInfo/{name}', lambda s=sysInfo: compressSysInfo(s), len(compressed)),
+            (f'packChunks/sysInfo/{name}',
+             lambda c=compressed, h=update[5]: packChunks(c, h),
+             sum([len(c) for c in chunks])),
+            (f'unpackChunks/sysInfo/{name}', lambda c=chunks: [unpackData(r) for r in c], sum([len(c) for c in chunks])),
+        ]
+
+    return cases
+
+
+def run(duration: float, only=None) -> dict:
+    results = {}
+
+    for name, fn, size in makeCases():
+        if only is not None and only not in name:
+            continue
+
+        result = measure(fn, duration)
+
+        if size is not None:
+            result['frame_bytes'] = size
+
+        results[name] = result
+        print(f'{name:28} {result["ops_per_sec"]:>12} ops/s {result["alloc_bytes"]:>8} B', file=sys.stderr)
+
+    return results
+
+
+def runMicroPython(binary: str, duration: float, only=None) -> dict:
+    import os
+    import subprocess
+
+    env = dict(os.environ, MICROPYPATH='.:' + os.environ.get('MICROPYPATH', '.frozen'))
+    args = [binary, 'benchmarks/protocol.py', '-t', str(duration)]
+
+    if only is not None:
+        args += ['-k', only]
+
+    out = subprocess.run(args, stdout=subprocess.PIPE, env=env, check=True)
+    return json.loads(out.stdout)['results']
+
+
+def compare(old: str, new: str):
+    with open(old, 'r', encoding='utf-8') as file:
+        before = json.load(file)
+    with open(new, 'r', encoding='utf-8') as file:
+        after = json.load(file)
+
+    for section in ('results', 'micropython'):
+        if section not in before or section not in after:
+            continue
+
+        print(f'[{section}]')
+
+        for name, result in after[section].items():
+            if name not in before[section]:
+                print(f'{name:28} new')
+                continue
+
+            ratio = result['ops_per_sec'] / before[section][name]['ops_per_sec']
+            alloc = result['alloc_bytes'] - before[section][name]['alloc_bytes']
+            print(f'{name:28} {ratio:>7.2f}x {alloc:>+8} B')
+
+
+def argValue(flag: str, default=None):
+    if flag in sys.argv:
+        return sys.argv[sys.argv.index(flag) + 1]
+
+    return default
+
+
+def main():
+    if '-compare' in sys.argv:
+        i = sys.argv.index('-compare')
+        compare(sys.argv[i + 1], sys.argv[i + 2])
+        return
+
+    duration = float(argValue('-t', '0.5'))
+    only = argValue('-k')
+
+    report = {
+        'implementation': sys.implementation.name,
+        'version': sys.version,
+        'results': run(duration, only),
+    }
+
+    for arg in sys.argv:
+        if arg.startswith('-micropython'):
+            binary = arg.split('=', 1)[1] if '=' in arg else 'micropython'
+            report['micropython'] = runMicroPython(binary, duration, only)
+
+    out = argValue('-o')
+
+    if out is None:
+        print(json.dumps(report))
+    else:
+        with open(out, 'w', encoding='utf-8') as file:
+            file.write(json.dumps(report, indent=2))
+
+
+main()
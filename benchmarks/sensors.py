@@ -0,0 +1,176 @@
+# Benchmarks for reading and mapping host sensors in driver/sensors.py, CPython only.
+#
+#   python benchmarks/sensors.py [-o out.json] [-t seconds] [-k filter]
+#
+# Run from the repository root. Every shape is checked against the legacy flatten + mapReg
+# mapping before it is timed, a mismatch stops the run.
+import json
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, '.')
+
+from benchmarks.corpus import SHAPES, makeHWiNFOSnapshot, makeSysInfo  # noqa: E402
+from driver.sensors import DictSource, SensorReader, aliases, getFromAlias, mapSnapshot  # noqa: E402
+from shared.utils import parseType  # noqa: E402
+
+
+def legacyFlatten(s: dict) -> dict:
+    fs = {}
+
+    for _, v in s.items():
+        fs.update(v)
+
+    return fs
+
+
+def legacyMapReg(s: dict, gpus: list) -> dict:
+    # mapReg as it was before snapshots, only GPUtil.getGPUs() is replaced by the corpus GPUs
+    fs = legacyFlatten(s)
+
+    cpuUsageMatcher = re.compile(r'^Core \d+.+Usage$')
+    driveMatcher = re.compile(r'^Drive: .+$')
+    smartMatcher = re.compile(r'^S\.M\.A\.R\.T\.: .+$')
+    networkMatcher = re.compile(r'^Network: .+$')
+
+    cpuUsage = {}
+
+    for k, v in fs.items():
+        if cpuUsageMatcher.match(k):
+            cpuUsage[f'cpu{len(cpuUsage):02}_usage'] = parseType(v)
+
+    drives = {}
+    smart = {}
+    network = {}
+
+    for k, v in s.items():
+        if driveMatcher.match(k):
+            drives[f'drive{len(drives) // 2}_read'] = getFromAlias(v, '_drive_read')
+            drives[f'drive{len(drives) // 2}_write'] = getFromAlias(v, '_drive_write')
+        elif smartMatcher.match(k):
+            smart[f'smart{len(smart) // 6}_temp'] = getFromAlias(v, '_smart_temp')
+            smart[f'smart{len(smart) // 6}_life'] = getFromAlias(v, '_smart_life')
+            smart[f'smart{len(smart) // 6}_warning'] = getFromAlias(v, '_smart_warning')
+            smart[f'smart{len(smart) // 6}_failure'] = getFromAlias(v, '_smart_failure')
+            smart[f'smart{len(smart) // 6}_reads'] = getFromAlias(v, '_smart_reads')
+            smart[f'smart{len(smart) // 6}_writes'] = getFromAlias(v, '_smart_writes')
+        elif networkMatcher.match(k):
+            network[f'net{len(network) // 2}_up'] = getFromAlias(v, '_net_up')
+            network[f'net{len(network) // 2}_dl'] = getFromAlias(v, '_net_dl')
+
+    gpu = {}
+
+    for g in gpus:
+        gpu[f'gpu{len(gpu) // 3}_usage'] = g['usage']
+        gpu[f'gpu{len(gpu) // 3}_mem_used'] = g['memUsed']
+        gpu[f'gpu{len(gpu) // 3}_temp'] = g['temp']
+
+    l = {k: getFromAlias(fs, k) for k in sorted(aliases) if not k.startswith('_')}
+
+    l.update(cpuUsage)
+    l.update(drives)
+    l.update(smart)
+    l.update(network)
+    l.update(gpu)
+
+    return l
+
+
+def measure(fn, duration: float) -> dict:
+    fn()  # warm up caches
+
+    iterations = 0
+    start = time.perf_counter_ns()
+    limit = int(duration * 1_000_000_000)
+
+    while True:
+        for _ in range(10):
+            fn()
+
+        iterations += 10
+        ns = time.perf_counter_ns() - start
+
+        if ns >= limit:
+            break
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'ops_per_sec': round(iterations * 1_000_000_000 / ns, 1),
+        'us_per_op': round(ns / iterations / 1_000, 3),
+        'alloc_bytes': peak - base,
+    }
+
+
+def check(name: str, sensors: dict, gpus: list) -> None:
+    expected = legacyMapReg(sensors, gpus)
+    actual = mapSnapshot(SensorReader(DictSource(sensors, gpus)).snapshot())
+
+    # the values are sent in order, so the key order has to match as well
+    if list(actual.items()) != list(expected.items()):
+        raise AssertionError(f'{name}: mapSnapshot differs from the legacy mapReg')
+
+
+def makeCases() -> list:
+    cases = []
+
+    for name, threads, drives, nics, gpuCount in SHAPES:
+        sensors, gpus = makeHWiNFOSnapshot(makeSysInfo(threads, drives, nics, gpuCount))
+        check(name, sensors, gpus)
+
+        # ttl 0 reads and indexes the source on every call, like one sampling tick
+        fresh = SensorReader(DictSource(sensors, gpus), ttl=0)
+        shared = SensorReader(DictSource(sensors, gpus))
+
+        cases += [
+            (f'mapReg/legacy/{name}', lambda s=sensors, g=gpus: legacyMapReg(s, g)),
+            (f'mapSnapshot/tick/{name}', lambda r=fresh: mapSnapshot(r.snapshot())),
+            (f'mapSnapshot/shared/{name}', lambda r=shared: mapSnapshot(r.snapshot())),
+        ]
+
+    return cases
+
+
+def run(duration: float, only=None) -> dict:
+    results = {}
+
+    for name, fn in makeCases():
+        if only is not None and only not in name:
+            continue
+
+        result = results[name] = measure(fn, duration)
+        print(f'{name:28} {result["ops_per_sec"]:>12} ops/s {result["alloc_bytes"]:>8} B', file=sys.stderr)
+
+    return results
+
+
+def argValue(flag: str, default=None):
+    if flag in sys.argv:
+        return sys.argv[sys.argv.index(flag) + 1]
+
+    return default
+
+
+def main():
+    report = {
+        'implementation': sys.implementation.name,
+        'version': sys.version,
+        'results': run(float(argValue('-t', '0.5')), argValue('-k')),
+    }
+
+    out = argValue('-o')
+
+    if out is None:
+        print(json.dumps(report))
+    else:
+        with open(out, 'w', encoding='utf-8') as file:
+            file.write(json.dumps(report, indent=2))
+
+
+main()
@@ -1,14 +1,19 @@
-import json
 import time
-import winreg
 import serial.tools.list_ports
 import serial
 from driver.sensors import getSensors, getSysInfo
-from shared.baseClient import genericRXHandler
-from shared.opcodes import ENCODER_LEFT, ENCODER_PRESSED, ENCODER_RIGHT, GET_SENSORS, GET_SYSINFO, PING, PONG, SENSOR_DATA, SYSINFO_DATA, SYSINFO_OK, UPDATE_SYSINFO
+from shared.baseClient import NEW_UNIQ, genericRXHandler
+from shared.dispatch import Dispatcher, unsupported
+from shared.opcodes import ENCODER_LEFT, ENCODER_PRESSED, ENCODER_RIGHT, ERR_INVALID_DATA, GET_SENSORS, GET_SENSORS_DELTA, GET_STATS, GET_SYSINFO, OK, PING, PONG, SENSOR_DATA, SENSOR_DELTA_DATA, STATS_DATA, SYSINFO_OK, UPDATE_SYSINFO
+from shared.packets import getPlanCacheStats
 from shared.uart import UART as UartBase
-from shared.utils import getHash, getUniq, timeDivider
+from shared.utils import getHash
 from shared.routes import HOST, PICO, PRIVATE
+from shared.scheduler import Scheduler
+from shared.sensors import SENSOR_QUANTIZED, SensorDeltaEncoder, quantizeSensors, sensorRequestValid
+from shared.stats import packStats
+from shared.sysInfoSync import ChunkSender, compressSysInfo, sysInfoChunks
+from shared.types import Packet
 
 import win32api
 import win32con
@@ -31,28 +36,34 @@ def findCOMPort():
             return port.device
 
 
-reg = winreg.ConnectRegistry(None, winreg.HKEY_CURRENT_USER)
-key = winreg.OpenKey(reg, 'SOFTWARE\\HWiNFO64\\VSB')
+handlers = Dispatcher()
 
 
 class State:
     def __init__(self) -> None:
         self.sysInfo = getSysInfo()
         self.hash = getHash(self.sysInfo)
+        self.sysInfoCompressed = compressSysInfo(self.sysInfo)
+        self.sysInfoSender = None
 
         self.sensors = getSensors()
         self.sensorsTimestamp = time.time_ns()
+        self.sensorDelta = SensorDeltaEncoder()
 
         self.uartHost = UartHost(self)
 
     def getSensors(self):
-        # if time.time_ns() > self.sensorsTimestamp + 1_000_000_000:
-        #     self.sensors = getSensors()
-        #     self.sensorsTimestamp = time.time_ns()
-
-        # return self.sensors
+        # registry snapshots are shared per sampling tick by driver.sensors
         return getSensors()
 
+    def getSensorValues(self, flags: int) -> list:
+        values = list(self.getSensors().values())
+
+        if flags & SENSOR_QUANTIZED:
+            quantizeSensors(values, self.sysInfo)
+
+        return values
+
 
 class UartHost(UartBase):
     def __init__(self, state: State) -> None:
@@ -61,8 +72,8 @@ class UartHost(UartBase):
 
         super().__init__(uart)
 
-    def route(self, packet: list) -> bool:
-        if packet[2] == HOST:
+    def route(self, packet: Packet) -> bool:
+        if packet.destination == HOST:
             return False
 
         self.state.uartHost.writePacket(packet)
@@ -75,58 +86,119 @@ class UartHost(UartBase):
         if self.route(packet):
             return
 
-        if packet[0] == GET_SYSINFO:
-            if packet[5][0] == self.state.hash:
-                self.writePacket([
-                    SYSINFO_OK,
-                    packet[2],
-                    packet[1],
-                    packet[3],
-                    PRIVATE
-                ])
-            else:
-                self.writePacket([
-                    SYSINFO_DATA,
-                    packet[2],
-                    packet[1],
-                    packet[3],
-                    PRIVATE,
-                    json.dumps(self.state.sysInfo)
-                ])
-        elif packet[0] == GET_SENSORS:
-            self.writePacket([
-                SENSOR_DATA,
-                packet[2],
-                packet[1],
-                packet[3],
-                PRIVATE,
-                self.state.hash,
-                *self.state.getSensors().values(),
-            ])
-        elif packet[0] == PING:
-            if packet[5][0] == self.state.hash:
-                self.writePacket([
-                    PONG,
-                    packet[2],
-                    packet[1],
-                    packet[3],
-                    PRIVATE
-                ])
-            else:
-                self.writePacket([
-                    UPDATE_SYSINFO,
-                    packet[2],
-                    packet[1],
-                    packet[3],
-                    PRIVATE
-                ])
-
-        elif packet[0] == ENCODER_LEFT:
-            press(0xAF)
-        elif packet[0] == ENCODER_RIGHT:
-            press(0xAE)
-        elif packet[0] == ENCODER_PRESSED:
-            press(0xAD)
+        self.handleRequest(packet, self.handlePacket)
+
+    def handlePacket(self, packet):
+        if not handlers.dispatch(self, packet):
+            reply = unsupported(packet)
+
+            if reply is not None:
+                self.writePacket(reply)
+
+    @handlers.on(OK)
+    def onOk(self, packet):
+        pass  # acknowledgement, already matched to its request
+
+    @handlers.on(GET_SYSINFO)
+    def onGetSysInfo(self, packet):
+        if packet.data[0] == self.state.hash:
+            self.writePacket(Packet(
+                SYSINFO_OK,
+                packet.destination,
+                packet.origin,
+                packet.uniq,
+                PRIVATE
+            ))
+        else:
+            if self.state.sysInfoSender is not None:
+                self.state.sysInfoSender.cancel()
+
+            self.state.sysInfoSender = ChunkSender(
+                lambda chunk: self.writePacket(chunk, important=True),
+                sysInfoChunks(packet.destination, packet.origin, self.state.hash, self.state.sysInfoCompressed)
+            )
+
+    def refuseSensors(self, packet) -> bool:
+        if sensorRequestValid(packet.data):
+            return False
+
+        # the Pico falls back to plain values
+        print('Scale table mismatch, refusing quantized sensor request')
+        self.writePacket(Packet(ERR_INVALID_DATA, packet.destination, packet.origin, packet.uniq, packet.channel))
+        return True
+
+    @handlers.on(GET_SENSORS)
+    def onGetSensors(self, packet):
+        if self.refuseSensors(packet):
+            return
+
+        self.writePacket(Packet(
+            SENSOR_DATA,
+            packet.destination,
+            packet.origin,
+            packet.uniq,
+            PRIVATE,
+            [self.state.hash, *self.state.getSensorValues(packet.data[0] if len(packet.data) > 0 else 0)]
+        ))
+
+    @handlers.on(GET_SENSORS_DELTA)
+    def onGetSensorsDelta(self, packet):
+        if self.refuseSensors(packet):
+            return
+
+        self.writePacket(Packet(
+            SENSOR_DELTA_DATA,
+            packet.destination,
+            packet.origin,
+            packet.uniq,
+            PRIVATE,
+            [self.state.hash, *self.state.sensorDelta.encode(
+                self.state.getSensorValues(packet.data[0] if len(packet.data) > 0 else 0),
+                packet.data[2] if len(packet.data) > 2 else None
+            )]
+        ))
+
+    @handlers.on(PING)
+    def onPing(self, packet):
+        if packet.data[0] == self.state.hash:
+            self.writePacket(Packet(
+                PONG,
+                packet.destination,
+                packet.origin,
+                packet.uniq,
+                PRIVATE
+            ))
+        else:
+            self.writePacket(Packet(
+                UPDATE_SYSINFO,
+                packet.destination,
+                packet.origin,
+                packet.uniq,
+                PRIVATE
+            ))
+
+    @handlers.on(GET_STATS)
+    def onGetStats(self, packet):
+        self.writePacket(Packet(
+            STATS_DATA,
+            packet.destination,
+            packet.origin,
+            packet.uniq,
+            PRIVATE,
+            [packStats({'pico': self.linkStats()}, {'plans': getPlanCacheStats(), 'handlers': handlers.stats()})]
+        ))
+
+    @handlers.on(ENCODER_LEFT)
+    def onEncoderLeft(self, packet):
+        press(0xAF)
+
+    @handlers.on(ENCODER_RIGHT)
+    def onEncoderRight(self, packet):
+        press(0xAE)
+
+    @handlers.on(ENCODER_PRESSED)
+    def onEncoderPressed(self, packet):
+        press(0xAD)
 
 
 def waitForConnection():
@@ -176,23 +248,23 @@ def reconnectSerial(client: UartHost):
 
 def main():
     LOOP_TIME = 1  # ms
-    LOOP_COUNTER = 0
 
     state = State()
-    state.uartHost.writePacket([UPDATE_SYSINFO, HOST, PICO, getUniq(), PRIVATE, state.hash])
+    state.uartHost.writePacket(Packet(UPDATE_SYSINFO, HOST, PICO, NEW_UNIQ, PRIVATE, [state.hash]))
 
-    try:
-        uartHost = state.uartHost
+    uartHost = state.uartHost
 
+    scheduler = Scheduler()
+    # tasks sharing a period run in this order
+    scheduler.every('rx', LOOP_TIME, uartHost.checkRX)
+    scheduler.every('requests', 50, uartHost.checkRequests)
+    scheduler.every('tx', LOOP_TIME, uartHost.checkTX)
+
+    try:
         while True:
             try:
-                uartHost.checkRX()
-
-                if timeDivider(LOOP_COUNTER, LOOP_TIME, 50):
-                    uartHost.checkRequests()
-
-                LOOP_COUNTER = (LOOP_COUNTER + 1) % 2_147_483_648
-                time.sleep(LOOP_TIME / 1000)
+                scheduler.runPending()
+                scheduler.sleep()
             except serial.SerialException as e:
                 print(f'Adapter disconnected: {e}')
                 reconnectSerial(uartHost)
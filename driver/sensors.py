@@ -1,54 +1,210 @@
-
+import json
 import platform
 import re
 import time
 
-import cpuinfo
-import GPUtil
-import psutil
 from shared.utils import loadJSON, parseType
 
 system = platform.system()
 aliases = loadJSON('./shared/sensorAliases.json')
+scalarAliases = sorted(k for k in aliases if not k.startswith('_'))
+
+SNAPSHOT_TTL = 500_000_000  # ns, snapshots younger than this are shared instead of read again
+LAYOUT_TTL = 10_000_000_000  # ns, sensor and label names are read again at least this often
+
+DRIVE_PREFIX = 'Drive: '
+SMART_PREFIX = 'S.M.A.R.T.: '
+NETWORK_PREFIX = 'Network: '
+
+cpuUsageMatcher = re.compile(r'^Core \d+.+Usage$')
 
 
 # do Gates specific things
 if system == 'Windows':
     import winreg
 
-    reg = winreg.ConnectRegistry(None, winreg.HKEY_CURRENT_USER)
-    key = winreg.OpenKey(reg, 'SOFTWARE\\HWiNFO64\\VSB')
+    import GPUtil
 
 
-def getDrives():
-    if system == 'Windows':
-        d = readReg()
-        r = re.compile(r'^Drive: (.+)$', re.MULTILINE)
-
-        return [
-            {
-                'name': sensor,
-            } for sensor in r.findall('\n'.join(d.keys()))
-        ]
-    elif system == 'Linux':
+class SensorSnapshot:
+    # one read of a sensor source, indexed once for every consumer
+    def __init__(self, sensors: dict, gpus: list = None):
+        # sensor -> {label: raw value}, in source order
+        self.sensors = sensors
+        # [{'name', 'vram', 'usage', 'memUsed', 'temp'}] of the same tick
+        self.gpus = gpus or []
+        # label -> raw value over all sensors, later sensors win like the old flatten
+        self.labels = {}
+        # prefix -> [(name without prefix, {label: raw value})]
+        self.groups = {DRIVE_PREFIX: [], SMART_PREFIX: [], NETWORK_PREFIX: []}
+
+        for sensor, values in sensors.items():
+            self.labels.update(values)
+
+            for prefix, group in self.groups.items():
+                if sensor.startswith(prefix) and len(sensor) > len(prefix):
+                    group.append((sensor[len(prefix):], values))
+
+    def group(self, prefix: str) -> list:
+        return self.groups[prefix]
+
+
+class SensorSource:
+    # interface of everything sensors can be read from
+    def read(self) -> dict:
+        # {sensor: {label: raw value}} of a single sampling tick
         raise NotImplementedError()
 
+    def readGPUs(self) -> list:
+        # [{'name', 'vram', 'usage', 'memUsed', 'temp'}] of the same tick
+        return []
 
-def getNetworkInterfaces():
-    if system == 'Windows':
-        d = readReg()
-        r = re.compile(r'^Network: (.+)$', re.MULTILINE)
-
-        return [
-            {
-                'name': sensor,
-            } for sensor in r.findall('\n'.join(d.keys()))
-        ]
-    elif system == 'Linux':
+
+class RegistrySource(SensorSource):
+    # HWiNFO shared values, every sensor is stored as Sensor, Label, Value, ValueRaw, Color
+    VALUES_PER_SENSOR = 5
+
+    def __init__(self, path: str = 'SOFTWARE\\HWiNFO64\\VSB', layoutTTL: int = LAYOUT_TTL):
+        reg = winreg.ConnectRegistry(None, winreg.HKEY_CURRENT_USER)
+        self.key = winreg.OpenKey(reg, path)
+        self.layoutTTL = layoutTTL
+        # [(sensor, label)] by sensor index, only ValueRaw changes between ticks
+        self.layout = []
+        self.layoutTimestamp = 0
+
+    def readLayout(self, count: int) -> None:
+        key = self.key
+        layout = []
+
+        for base in range(0, count * self.VALUES_PER_SENSOR, self.VALUES_PER_SENSOR):
+            layout.append((winreg.EnumValue(key, base)[1], winreg.EnumValue(key, base + 1)[1]))
+
+        self.layout = layout
+        self.layoutTimestamp = time.monotonic_ns()
+
+    def read(self) -> dict:
+        key = self.key
+        # the value count is known up front, no probing past the last sensor
+        count = winreg.QueryInfoKey(key)[1] // self.VALUES_PER_SENSOR
+
+        if count != len(self.layout) or time.monotonic_ns() - self.layoutTimestamp >= self.layoutTTL:
+            self.readLayout(count)
+
+        sensors = {}
+        base = 3
+
+        for sensor, label in self.layout:
+            try:
+                value = winreg.EnumValue(key, base)[1]
+            except OSError:
+                # HWiNFO removed sensors since the count was read, take the layout again next tick
+                self.layout = []
+                break
+
+            base += self.VALUES_PER_SENSOR
+            values = sensors.get(sensor)
+
+            if values is None:
+                values = sensors[sensor] = {}
+
+            values[label] = value
+
+        return sensors
+
+    def readGPUs(self) -> list:
+        return [{
+            'name': g.name,
+            'vram': g.memoryTotal,
+            'usage': g.load * 100,
+            'memUsed': g.memoryUsed,
+            'temp': g.temperature
+        } for g in GPUtil.getGPUs()]
+
+
+class DictSource(SensorSource):
+    # stand-in for tests and benchmarks on systems without HWiNFO, see benchmarks/sensors.py
+    def __init__(self, sensors: dict, gpus: list = None):
+        self.sensors = sensors
+        self.gpus = gpus or []
+
+    def read(self) -> dict:
+        return self.sensors
+
+    def readGPUs(self) -> list:
+        return self.gpus
+
+
+class FileSource(SensorSource):
+    # JSON dump of a snapshot, see dumpSnapshot, read again on every tick so it can be edited live
+    def __init__(self, path: str):
+        self.path = path
+        self.gpus = []
+
+    def read(self) -> dict:
+        with open(self.path, 'r', encoding='utf-8') as file:
+            dump = json.load(file)
+
+        self.gpus = dump['gpus']
+        return dump['sensors']
+
+    def readGPUs(self) -> list:
+        # read() runs first on every tick
+        return self.gpus
+
+
+class SensorReader:
+    # hands out one snapshot per sampling tick no matter how many consumers ask
+    def __init__(self, source: SensorSource, ttl: int = SNAPSHOT_TTL):
+        self.source = source
+        self.ttl = ttl
+        self.cached = None
+        self.timestamp = 0
+
+    def snapshot(self) -> SensorSnapshot:
+        now = time.monotonic_ns()
+
+        if self.cached is None or now - self.timestamp >= self.ttl:
+            self.cached = SensorSnapshot(self.source.read(), self.source.readGPUs())
+            self.timestamp = now
+
+        return self.cached
+
+
+reader = SensorReader(RegistrySource()) if system == 'Windows' else None
+
+
+def setSource(source: SensorSource, ttl: int = SNAPSHOT_TTL) -> None:
+    global reader
+    reader = SensorReader(source, ttl)
+
+
+def getSnapshot() -> SensorSnapshot:
+    if reader is None:
+        # look wherever Torvalds keeps his sensors, or setSource() a stand-in
         raise NotImplementedError()
 
+    return reader.snapshot()
+
+
+def dumpSnapshot(path: str) -> None:
+    with open(path, 'w', encoding='utf-8') as file:
+        snapshot = getSnapshot()
+        json.dump({'sensors': snapshot.sensors, 'gpus': snapshot.gpus}, file, indent=2)
+
+
+def getDrives():
+    return [{'name': name} for name, _ in getSnapshot().group(DRIVE_PREFIX)]
+
+
+def getNetworkInterfaces():
+    return [{'name': name} for name, _ in getSnapshot().group(NETWORK_PREFIX)]
+
 
 def getSysInfo() -> dict:
+    # only needed once per start, keeps the module importable without them
+    import cpuinfo
+    import psutil
+
     uname = platform.uname()
 
     trace = cpuinfo.Trace(True, True)
@@ -57,7 +213,6 @@ def getSysInfo() -> dict:
     brand = cpuid.get_processor_brand(max_extension_support)
 
     memory = psutil.virtual_memory()
-    gpu = GPUtil.getGPUs()
 
     return {
         # system
@@ -82,21 +237,12 @@ def getSysInfo() -> dict:
 
         # GPU
         'gpus': [{
-            'name': g.name,
-            'vram': g.memoryTotal
-        } for g in gpu]
+            'name': g['name'],
+            'vram': g['vram']
+        } for g in getSnapshot().gpus]
     }
 
 
-def flatten(s: dict) -> dict:
-    fs = {}
-
-    for _, v in s.items():
-        fs.update(v)
-
-    return fs
-
-
 def getFromAlias(v: dict, a: str):
     for aa in aliases[a]:
         vv = v.get(aa, -1)
@@ -107,17 +253,11 @@ def getFromAlias(v: dict, a: str):
     return -1
 
 
-def mapReg(s: dict):
-    fs = flatten(s)
-
-    cpuUsageMatcher = re.compile(r'^Core \d+.+Usage$')
-    driveMatcher = re.compile(r'^Drive: .+$')
-    smartMatcher = re.compile(r'^S\.M\.A\.R\.T\.: .+$')
-    networkMatcher = re.compile(r'^Network: .+$')
-
+def mapSnapshot(snapshot: SensorSnapshot) -> dict:
+    labels = snapshot.labels
     cpuUsage = {}
 
-    for k, v in fs.items():
+    for k, v in labels.items():
         if cpuUsageMatcher.match(k):
             cpuUsage[f'cpu{len(cpuUsage):02}_usage'] = parseType(v)
 
@@ -125,37 +265,30 @@ def mapReg(s: dict):
     smart = {}
     network = {}
 
-    for k, v in s.items():
-        if driveMatcher.match(k):
-            drives[f'drive{len(drives) // 2}_read'] = getFromAlias(v,
-                                                                   '_drive_read')
-            drives[f'drive{len(drives) // 2}_write'] = getFromAlias(v,
-                                                                    '_drive_write')
-        elif smartMatcher.match(k):
-            smart[f'smart{len(smart) // 6}_temp'] = getFromAlias(v,
-                                                                 '_smart_temp')
-            smart[f'smart{len(smart) // 6}_life'] = getFromAlias(v,
-                                                                 '_smart_life')
-            smart[f'smart{len(smart) // 6}_warning'] = getFromAlias(v,
-                                                                    '_smart_warning')
-            smart[f'smart{len(smart) // 6}_failure'] = getFromAlias(v,
-                                                                    '_smart_failure')
-            smart[f'smart{len(smart) // 6}_reads'] = getFromAlias(v,
-                                                                  '_smart_reads')
-            smart[f'smart{len(smart) // 6}_writes'] = getFromAlias(v,
-                                                                   '_smart_writes')
-        elif networkMatcher.match(k):
-            network[f'net{len(network) // 2}_up'] = getFromAlias(v, '_net_up')
-            network[f'net{len(network) // 2}_dl'] = getFromAlias(v, '_net_dl')
+    for i, (_, v) in enumerate(snapshot.group(DRIVE_PREFIX)):
+        drives[f'drive{i}_read'] = getFromAlias(v, '_drive_read')
+        drives[f'drive{i}_write'] = getFromAlias(v, '_drive_write')
+
+    for i, (_, v) in enumerate(snapshot.group(SMART_PREFIX)):
+        smart[f'smart{i}_temp'] = getFromAlias(v, '_smart_temp')
+        smart[f'smart{i}_life'] = getFromAlias(v, '_smart_life')
+        smart[f'smart{i}_warning'] = getFromAlias(v, '_smart_warning')
+        smart[f'smart{i}_failure'] = getFromAlias(v, '_smart_failure')
+        smart[f'smart{i}_reads'] = getFromAlias(v, '_smart_reads')
+        smart[f'smart{i}_writes'] = getFromAlias(v, '_smart_writes')
+
+    for i, (_, v) in enumerate(snapshot.group(NETWORK_PREFIX)):
+        network[f'net{i}_up'] = getFromAlias(v, '_net_up')
+        network[f'net{i}_dl'] = getFromAlias(v, '_net_dl')
 
     gpu = {}
 
-    for g in GPUtil.getGPUs():
-        gpu[f'gpu{len(gpu) // 3}_usage'] = g.load * 100
-        gpu[f'gpu{len(gpu) // 3}_mem_used'] = g.memoryUsed
-        gpu[f'gpu{len(gpu) // 3}_temp'] = g.temperature
+    for i, g in enumerate(snapshot.gpus):
+        gpu[f'gpu{i}_usage'] = g['usage']
+        gpu[f'gpu{i}_mem_used'] = g['memUsed']
+        gpu[f'gpu{i}_temp'] = g['temp']
 
-    l = {k: getFromAlias(fs, k) for k in sorted(aliases) if not k.startswith('_')}
+    l = {k: getFromAlias(labels, k) for k in scalarAliases}
 
     l.update(cpuUsage)
     l.update(drives)
@@ -166,31 +299,5 @@ def mapReg(s: dict):
     return l
 
 
-def readReg():
-    r = {}
-
-    for n in range(1024):
-        try:
-            _, sensor, _ = winreg.EnumValue(key, (n * 5) + 0)
-            _, label, _ = winreg.EnumValue(key, (n * 5) + 1)
-            _, value, _ = winreg.EnumValue(key, (n * 5) + 3)
-
-            if not sensor in r:
-                r[sensor] = dict()
-
-            r[sensor][label] = value
-
-        except:
-            break
-
-    return r
-
-
 def getSensors() -> dict:
-    if system == 'Windows':
-        return mapReg(readReg())
-    elif system == 'Linux':
-        # look wherever Torvalds keeps his sensors
-        raise NotImplementedError()
-    else:
-        raise NotImplementedError()
+    return mapSnapshot(getSnapshot())
@@ -1,21 +1,30 @@
+import gc
 import json
 
 import ubinascii
 from machine import UART, unique_id
-from shared.baseClient import genericRXHandler
+from shared.baseClient import NEW_UNIQ, genericRXHandler
+from shared.dispatch import Dispatcher, unsupported
 from shared.mqtt import MQTT as MQTTBase
-from shared.opcodes import (GET_MQTT_STATUS, GET_SYSINFO, GET_WIFI,
-                            MQTT_STATUS_DATA, PING, PONG, REGISTER, REGISTERED,
-                            REGISTRATION_DATA, SYSINFO_DATA, SYSINFO_OK,
-                            UPDATE_SYSINFO, WIFI_DATA)
-from shared.packets import unpackData
+from shared.opcodes import (GET_MQTT_STATUS, GET_STATS, GET_SYSINFO, GET_WIFI,
+                            MQTT_STATUS_DATA, OK, PING, PONG, REGISTER, REGISTERED,
+                            REGISTRATION_DATA, STATS_DATA, SYSINFO_CHUNK, SYSINFO_DATA,
+                            SYSINFO_OK, UPDATE_SYSINFO, WIFI_DATA)
+from shared.packets import getPlanCacheStats
 from shared.routes import COMM, ESP, PICO, PRIVATE, PUBLIC
+from shared.scheduler import Scheduler
+from shared.stats import packStats
+from shared.sysInfoSync import ChunkReceiver
 from shared.uart import UART as UartBase
-from shared.utils import getHash, getUniq, loadJSON
+from shared.types import Packet, Request
+from shared.utils import getHash, loadJSON
 from wifi_init import wlan
 from umqtt.simple import MQTTClient
 
 
+handlers = Dispatcher()
+
+
 def getSignalPower():
     if not wlan.isconnected():
         return 0
@@ -47,6 +56,7 @@ class State:
 
         self.sysInfo = {}
         self.hash = getHash(self.sysInfo)
+        self.sysInfoReceiver = ChunkReceiver()
 
         self.settings = loadJSON('settings.json')
 
@@ -56,100 +66,162 @@ class State:
         self.uartPico = UartPico(self)
         self.mqttComm = MQTTComm(self)
 
-        self.commPingUniq = None
-        self.picoPingUniq = None
+        # periodic jobs, registered by main()
+        self.scheduler = Scheduler()
 
     def registerComm(self):
         if not self.commRegistered:
             print('Registering to comm')
-            self.route([REGISTRATION_DATA, ESP, COMM, getUniq(), PUBLIC, self.clientID, json.dumps(self.sysInfo)])
+            self.route(Packet(REGISTRATION_DATA, ESP, COMM, NEW_UNIQ, PUBLIC, [self.clientID, json.dumps(self.sysInfo)]))
 
     def connectPico(self):
-        if not self.picoConnected:
+        if not self.picoConnected and not self.sysInfoReceiver.busy():
             print('Connecting to pico')
-            self.route([GET_SYSINFO, ESP, PICO, getUniq(), PRIVATE, self.hash])
+            self.route(Packet(GET_SYSINFO, ESP, PICO, NEW_UNIQ, PRIVATE, [self.hash]))
 
     def pingComm(self):
-        if self.commPingUniq is None:
-            uniq = getUniq()
-            self.commPingUniq = uniq
-            self.route([PING, ESP, COMM, uniq, PRIVATE], important=True)
+        if self.mqttComm.inFlight(PING) == 0:
+            self.request(Packet(PING, ESP, COMM, NEW_UNIQ, PRIVATE))
 
     def pingPico(self):
-        if self.picoPingUniq is None:
-            uniq = getUniq()
-            self.picoPingUniq = uniq
-            self.route([PING, ESP, PICO, uniq, PRIVATE], important=True)
+        if self.uartPico.inFlight(PING) == 0:
+            self.request(Packet(PING, ESP, PICO, NEW_UNIQ, PRIVATE))
+
+    def answerSysInfo(self, packet) -> None:
+        # commander requests for the Pico sysInfo, answered from the copy synced in chunks,
+        # a single SYSINFO_DATA frame of a large host does not fit the Pico UART
+        if len(packet.data) > 0 and packet.data[0] == self.hash:
+            self.route(Packet(SYSINFO_OK, packet.destination, packet.origin, packet.uniq, PRIVATE))
+        else:
+            self.route(Packet(SYSINFO_DATA, packet.destination, packet.origin, packet.uniq, PRIVATE,
+                              [json.dumps(self.sysInfo)]))
+
+    def applySysInfo(self, sysInfo: dict):
+        self.sysInfo = sysInfo
+        self.hash = getHash(self.sysInfo)
+        print('Synced sysInfo file')
+        self.uartPico.stateConnected()
+        self.route(Packet(UPDATE_SYSINFO, ESP, COMM, NEW_UNIQ, PRIVATE, [self.hash]), important=True)
 
-    def route(self, packet: list, important=False) -> bool:
-        if packet[2] == ESP:
+    def route(self, packet: Packet, important=False) -> bool:
+        if packet.destination == ESP:
             return False
 
-        if packet[2] == COMM:
+        if packet.destination == COMM:
             self.mqttComm.writePacket(packet, important)
         else:
             self.uartPico.writePacket(packet, important)
 
         return True
 
+    def request(self, packet: Packet):
+        if packet.destination == COMM:
+            return self.mqttComm.writePacket(packet, True)
+
+        return self.uartPico.writePacket(packet, True)
+
     def handleRX(self, packet: list):
         print(packet)
 
-        if packet[0] == PING:
-            self.route([PONG, packet[2], packet[1], packet[3], packet[4]])
-        elif packet[0] == PONG:
-            print('Received pong')
-
-            if packet[1] == COMM:
-                self.commPingUniq = None
-            elif packet[1] == PICO:
-                self.picoPingUniq = None
-
-            print('Processed pong')
-        elif packet[0] == GET_WIFI:
-            print('Reading WiFi power...')
-            power = translateSignalPower(getSignalPower())
-            print('WiFi power:', power)
-
-            self.route([
-                WIFI_DATA,
-                packet[2],
-                packet[1],
-                packet[3],
-                PRIVATE,
-                power
-            ])
-
-            print('Sent WiFi power')
-        elif packet[0] == GET_MQTT_STATUS:
-            self.route([
-                MQTT_STATUS_DATA,
-                packet[2],
-                packet[1],
-                packet[3],
-                PRIVATE,
-                self.commRegistered
-            ])
-        elif packet[0] == REGISTER:
-            self.mqttComm.regegister()
-        elif packet[0] == REGISTERED:
-            print('Registered to comm')
-            self.mqttComm.stateRegistered()
-
-        elif packet[0] == UPDATE_SYSINFO:
-            if packet[5][0] != self.hash:
-                self.uartPico.updateSysInfo()
-            else:
-                print('Valid sysInfo')
-        elif packet[0] == SYSINFO_DATA:
-            self.sysInfo = json.loads(packet[5][0])
-            self.hash = getHash(self.sysInfo)
-            print('Synced sysInfo file')
-            self.uartPico.stateConnected()
-            self.route([UPDATE_SYSINFO, ESP, COMM, getUniq(), PRIVATE, self.hash], important=True)
-        elif packet[0] == SYSINFO_OK:
+        if not handlers.dispatch(self, packet):
+            reply = unsupported(packet)
+
+            if reply is not None:
+                self.route(reply)
+
+    @handlers.on(PING)
+    def onPing(self, packet: list):
+        self.route(Packet(PONG, packet.destination, packet.origin, packet.uniq, packet.channel))
+
+    @handlers.on(PONG)
+    def onPong(self, packet: list):
+        print('Received pong')
+
+    @handlers.on(OK)
+    def onOk(self, packet: list):
+        pass  # acknowledgement, already matched to its request
+
+    @handlers.on(GET_WIFI)
+    def onGetWiFi(self, packet: list):
+        print('Reading WiFi power...')
+        power = translateSignalPower(getSignalPower())
+        print('WiFi power:', power)
+
+        self.route(Packet(
+            WIFI_DATA,
+            packet.destination,
+            packet.origin,
+            packet.uniq,
+            PRIVATE,
+            [power]
+        ))
+
+        print('Sent WiFi power')
+
+    @handlers.on(GET_MQTT_STATUS)
+    def onGetMQTTStatus(self, packet: list):
+        self.route(Packet(
+            MQTT_STATUS_DATA,
+            packet.destination,
+            packet.origin,
+            packet.uniq,
+            PRIVATE,
+            [self.commRegistered]
+        ))
+
+    @handlers.on(GET_STATS)
+    def onGetStats(self, packet: list):
+        self.route(Packet(
+            STATS_DATA,
+            packet.destination,
+            packet.origin,
+            packet.uniq,
+            PRIVATE,
+            [packStats({
+                'pico': self.uartPico.linkStats(),
+                'mqtt': self.mqttComm.linkStats(),
+            }, {
+                'loop': self.scheduler.stats(),
+                'plans': getPlanCacheStats(),
+                'handlers': handlers.stats(),
+                'memFree': gc.mem_free()
+            })]
+        ))
+
+    @handlers.on(REGISTER)
+    def onRegister(self, packet: list):
+        self.mqttComm.regegister()
+
+    @handlers.on(REGISTERED)
+    def onRegistered(self, packet: list):
+        print('Registered to comm')
+        self.mqttComm.stateRegistered()
+
+    @handlers.on(UPDATE_SYSINFO)
+    def onUpdateSysInfo(self, packet: list):
+        if packet.data[0] != self.hash:
+            self.uartPico.updateSysInfo()
+        else:
             print('Valid sysInfo')
-            self.uartPico.stateConnected()
+
+    @handlers.on(SYSINFO_DATA)
+    def onSysInfoData(self, packet: list):
+        self.applySysInfo(json.loads(packet.data[0]))
+
+    @handlers.on(SYSINFO_CHUNK)
+    def onSysInfoChunk(self, packet: list):
+        self.route(Packet(OK, packet.destination, packet.origin, packet.uniq, packet.channel))
+
+        if self.sysInfoReceiver.write(packet.data[0], packet.data[1], packet.data[2], packet.data[3]):
+            sysInfo = self.sysInfoReceiver.finish()
+
+            if sysInfo is not None:
+                self.applySysInfo(sysInfo)
+
+    @handlers.on(SYSINFO_OK)
+    def onSysInfoOk(self, packet: list):
+        print('Valid sysInfo')
+        self.uartPico.stateConnected()
 
 
 class UartPico(UartBase):
@@ -164,27 +236,21 @@ class UartPico(UartBase):
         if self.state.route(packet):
             return
 
-        if self.requests.get(packet[3]) is not None:
-            self.requests.pop(packet[3])
-
-        self.state.handleRX(packet)
+        self.handleRequest(packet, self.state.handleRX)
 
     def updateSysInfo(self):
         self.state.picoConnected = False
-        self.state.picoPingUniq = None
         self.state.connectPico()
 
     def stateConnected(self):
         self.state.picoConnected = True
-        self.state.picoPingUniq = None
 
-    def handleFailedRequest(self, request: list) -> None:
+    def handleFailedRequest(self, request: Request) -> None:
         if not self.state.picoConnected:
             return
 
         super().handleFailedRequest(request)
 
-        self.state.picoPingUniq = None
         self.updateSysInfo()
 
 
@@ -202,33 +268,29 @@ class MQTTComm(MQTTBase):
         super().__init__(mqtt)
 
     def handleRX(self, topic, msg: bytes):
-        try:
-            packet = unpackData(msg)
+        self.handleFrame(msg)
 
-            if self.state.route(packet):
-                return
+    @genericRXHandler
+    def handleFrame(self, packet):
+        if packet.opcode == GET_SYSINFO and packet.destination == PICO and self.state.picoConnected:
+            self.state.answerSysInfo(packet)
+            return
 
-            if self.requests.get(packet[3]) is not None:
-                self.requests.pop(packet[3])
+        if self.state.route(packet):
+            return
 
-            self.state.handleRX(packet)
-        except Exception as e:
-            print(e)
-            print('[MQTT RX] Corrupted packet:', msg)
+        self.handleRequest(packet, self.state.handleRX)
 
     def regegister(self):
         self.state.commRegistered = False
-        self.state.commPingUniq = None
 
     def stateRegistered(self):
         self.state.commRegistered = True
-        self.state.commPingUniq = None
 
-    def handleFailedRequest(self, request: list) -> None:
+    def handleFailedRequest(self, request: Request) -> None:
         if not self.state.commRegistered:
             return
 
         super().handleFailedRequest(request)
 
-        self.state.commPingUniq = None
         self.regegister()
@@ -3,6 +3,7 @@ from ssd1306 import SSD1306_I2C
 import framebuf
 from machine import I2C, Pin, Timer
 import bmpParser as bmp
+from shared.sensors import SensorFrame
 
 
 SCREEN_ACTIVE = False
@@ -11,7 +12,7 @@ COUNTER = 0
 
 WIFI_SIGNAL = 0
 MQTT_STATUS = 0
-SENSORS = {}
+SENSORS = None
 
 SENSOR_OFFSET = 0
 
@@ -89,7 +90,7 @@ def updateMQTTStatus(status: int):
     MQTT_STATUS = status % len(graphics.get('mqtt'))
 
 
-def updateSensors(sensors: dict):
+def updateSensors(sensors: SensorFrame):
     global SENSORS
     SENSORS = sensors
 
@@ -182,37 +183,45 @@ def drawBar(val: int, minn: int, maxx: int, x: int, y: int, width: int, height:
         display.fill_rect(x, y + (height - val), width, val, color)
 
 
+def sensorText(value) -> str:
+    # sensor values are numbers, except readings the legacy format carried as text
+    if isinstance(value, (int, float)):
+        return f'{value:.0f}'
+
+    return str(value)
+
+
 def drawSensors():
     global SENSOR_OFFSET
 
-    if SENSORS == {}:
+    if SENSORS is None:
         return
 
     pages = 2
 
     if SENSOR_OFFSET % pages == 1:
-        cpus = len(SENSORS['cpus'])
+        cpus = SENSORS.layout.cpuCount
         barWidth = int(120 / cpus)
 
         horizCenter(f'{cpus} CPUs', 0, 1)
-        horizCenter(f'Total: {SENSORS.get("cpu_usage", -1):.0f}%', 10, 1)
+        horizCenter(f'Total: {sensorText(SENSORS.get("cpu_usage"))}%', 10, 1)
 
-        for i, v in enumerate(SENSORS['cpus']):
-            drawBar(v, 0, 100, i * barWidth, 20, barWidth, 44, 3, 1)
+        for i in range(cpus):
+            drawBar(SENSORS.cpu(i), 0, 100, i * barWidth, 20, barWidth, 44, 3, 1)
 
     elif SENSOR_OFFSET % pages == 0:
-        display.text(f'CPU: {SENSORS.get("cpu_usage", -1)}%', 0, 0, 1)
-        display.text(f'CPU: {SENSORS.get("cpu_temp", -1)}C', 0, 9, 1)
-        display.text(f'CPU: {SENSORS.get("cpu_power", -1)}W', 0, 18, 1)
-        display.text(f'RAM: {SENSORS.get("ram_used", -1)}MB', 0, 27, 1)
-        display.text(f'RAM: {SENSORS.get("ram_freq", -1)}MHz', 0, 36, 1)
-
-        if (SENSORS['gpus'] != 0):
-            display.text(f'GPU: {SENSORS["gpus"][0].get("usage", -1)}%', 0, 45, 1)
-            display.text(f'GPU: {SENSORS["gpus"][0].get("temp", -1)}C', 0, 54, 1)
+        display.text(f'CPU: {sensorText(SENSORS.get("cpu_usage"))}%', 0, 0, 1)
+        display.text(f'CPU: {sensorText(SENSORS.get("cpu_temp"))}C', 0, 9, 1)
+        display.text(f'CPU: {sensorText(SENSORS.get("cpu_power"))}W', 0, 18, 1)
+        display.text(f'RAM: {sensorText(SENSORS.get("ram_used"))}MB', 0, 27, 1)
+        display.text(f'RAM: {sensorText(SENSORS.get("ram_freq"))}MHz', 0, 36, 1)
+
+        if SENSORS.layout.gpuCount > 0:
+            display.text(f'GPU: {sensorText(SENSORS.gpu(0, "usage"))}%', 0, 45, 1)
+            display.text(f'GPU: {sensorText(SENSORS.gpu(0, "temp"))}C', 0, 54, 1)
         else:
-            display.text(f'FAN: {SENSORS.get("cpu_fan", -1)}RPM'.format(), 0, 45, 1)
-            display.text(f'BATT: {SENSORS.get("batt_level", -1)}%'.format(), 0, 54, 1)
+            display.text(f'FAN: {sensorText(SENSORS.get("cpu_fan"))}RPM', 0, 45, 1)
+            display.text(f'BATT: {sensorText(SENSORS.get("batt_level"))}%', 0, 54, 1)
 
 
 def stateWorking():
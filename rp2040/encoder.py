@@ -0,0 +1,105 @@
+import time
+
+import micropython
+from machine import Pin
+from micropython import const
+
+
+EVENT_LEFT = const(1)
+EVENT_RIGHT = const(2)
+EVENT_PRESSED = const(3)
+
+EVENT_BUFFER_SIZE = const(32)  # power of two
+STEPS_PER_DETENT = const(4)  # quadrature transitions per click of the knob
+PRESS_DEBOUNCE = const(300)  # ms
+
+# indexed by previous AB state << 2 | current AB state, invalid (bounced) transitions count as no step
+QUADRATURE_TABLE = bytes([0, 1, 255, 0, 255, 0, 0, 1, 1, 0, 0, 255, 0, 255, 1, 0])
+
+
+class QuadratureEncoder:
+    # edge IRQs only run the state machine and push events into a preallocated ring,
+    # drain() delivers them to onEvent(event) outside of interrupt context via micropython.schedule
+    def __init__(self, pinA: Pin, pinB: Pin, button: Pin, onEvent):
+        self.pinA = pinA
+        self.pinB = pinB
+        self.onEvent = onEvent
+
+        self.state = (pinA.value() << 1) | pinB.value()
+        self.steps = 0
+
+        self.events = bytearray(EVENT_BUFFER_SIZE)
+        self.head = 0  # written by the IRQ
+        self.tail = 0  # written by drain()
+        self.dropped = 0
+        self.pending = False
+        self.lastPress = time.ticks_add(time.ticks_ms(), -PRESS_DEBOUNCE)
+
+        # bound methods allocate, so they are created once here instead of in the IRQ
+        self.drainRef = self.drain
+
+        pinA.irq(trigger=Pin.IRQ_RISING | Pin.IRQ_FALLING, handler=self.onEdge, hard=True)
+        pinB.irq(trigger=Pin.IRQ_RISING | Pin.IRQ_FALLING, handler=self.onEdge, hard=True)
+        button.irq(trigger=Pin.IRQ_FALLING, handler=self.onPress, hard=True)
+
+    def onEdge(self, _):
+        state = (self.pinA.value() << 1) | self.pinB.value()
+        step = QUADRATURE_TABLE[(self.state << 2) | state]
+        self.state = state
+
+        if step == 0:
+            return
+
+        if step == 1:
+            self.steps += 1
+
+            if self.steps >= STEPS_PER_DETENT:
+                self.steps = 0
+                self.push(EVENT_RIGHT)
+        else:
+            self.steps -= 1
+
+            if self.steps <= -STEPS_PER_DETENT:
+                self.steps = 0
+                self.push(EVENT_LEFT)
+
+    def onPress(self, _):
+        self.push(EVENT_PRESSED)
+
+    def push(self, event: int):
+        head = self.head
+        nextHead = (head + 1) & (EVENT_BUFFER_SIZE - 1)
+
+        if nextHead == self.tail:
+            self.dropped += 1
+            return
+
+        self.events[head] = event
+        self.head = nextHead
+
+        if not self.pending:
+            self.pending = True
+
+            try:
+                micropython.schedule(self.drainRef, None)
+            except RuntimeError:
+                # schedule queue full, the next event retries
+                self.pending = False
+
+    def drain(self, _):
+        self.pending = False
+
+        while self.tail != self.head:
+            event = self.events[self.tail]
+            self.tail = (self.tail + 1) & (EVENT_BUFFER_SIZE - 1)
+
+            if event == EVENT_PRESSED:
+                # the button bounces, presses are filtered here instead of in the IRQ
+                now = time.ticks_ms()
+
+                if time.ticks_diff(now, self.lastPress) < PRESS_DEBOUNCE:
+                    continue
+
+                self.lastPress = now
+
+            self.onEvent(event)
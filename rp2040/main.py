@@ -1,23 +1,31 @@
+import gc
 import json
-import math
 import time
 
 import displayRoutine as display
+from encoder import EVENT_LEFT, EVENT_PRESSED, EVENT_RIGHT, QuadratureEncoder
 
-from machine import PWM, UART, Pin, Timer, ADC
+from machine import PWM, UART, Pin, ADC
 from micropython import const
-from shared.baseClient import genericRXHandler
-from shared.debouncer import debounce
+from shared.baseClient import NEW_UNIQ, genericRXHandler
+from shared.dispatch import Dispatcher, unsupported
 from shared.opcodes import (
-    AMBIENT_TEMP_DATA, COMM_POWER, COMM_RESET, ENCODER_LEFT, ENCODER_PRESSED, ENCODER_RIGHT, GET_AMBIENT_TEMP,
-    GET_HDD_ACTIVITY, GET_MQTT_STATUS, GET_POWER_STATUS, GET_SENSORS, GET_SYSINFO, GET_WIFI, HDD_ACTIVITY_DATA,
-    MQTT_STATUS_DATA, OK, PING, PONG, POWER_STATUS_DATA, SENSOR_DATA, SYSINFO_DATA, SYSINFO_OK, TEST_DATA,
+    AMBIENT_TEMP_DATA, COMM_POWER, COMM_RESET, ERR_INVALID_DATA, GET_AMBIENT_TEMP, GET_HDD_ACTIVITY,
+    GET_MQTT_STATUS, GET_POWER_STATUS, GET_SENSOR_HISTORY, GET_SENSORS, GET_SENSORS_DELTA, GET_STATS, GET_SYSINFO,
+    GET_WIFI, HDD_ACTIVITY_DATA, MQTT_STATUS_DATA, OK, PING, PONG, POWER_STATUS_DATA, SENSOR_DATA,
+    SENSOR_DELTA_DATA, SENSOR_HISTORY_DATA, STATS_DATA, SYSINFO_CHUNK, SYSINFO_DATA, SYSINFO_OK, TEST_DATA,
     UPDATE_SYSINFO, WIFI_DATA)
+from shared.packets import getPlanCacheStats
 from shared.routes import ESP, HOST, PICO, PRIVATE
-from shared.sensors import parseSensors
+from shared.scheduler import Scheduler
+from shared.sensorHistory import SensorHistory
+from shared.sensors import SensorDeltaDecoder, parseSensors, sensorRequest
+from shared.stats import packStats
+from shared.sysInfoSync import (SYSINFO_FILE, ChunkReceiver, ChunkSender, fileSize, loadSysInfo, removeSysInfo,
+                               sysInfoChunks)
 from shared.uart import UART as UartBase
-from shared.utils import (getHash, getUniq, loadJSON, saveJSON, time_ns,
-                          timeDivider)
+from shared.types import Packet, Request
+from shared.utils import getHash, loadJSON, saveJSON
 
 
 picoLED = Pin(25, Pin.OUT)
@@ -29,11 +37,23 @@ buzzer = PWM(Pin(18))
 nextButton = Pin(19, Pin.IN, Pin.PULL_UP)
 tempSensor = ADC(4)
 
+SENSOR_DELTA = True  # request delta encoded sensor data from the host
+SENSOR_QUANTIZE = True  # request fixed point sensor values from the host
+SENSOR_REQUESTS = 1  # sensor requests allowed in flight at once
+
+handlers = Dispatcher()
+
 
 class State:
     def __init__(self) -> None:
-        self.sysInfo = loadJSON('sysInfo.json')
+        self.sysInfo = loadSysInfo()
+
+        if self.sysInfo == {}:
+            self.sysInfo = loadJSON('sysInfo.json')
+
         self.hash = getHash(self.sysInfo)
+        self.sysInfoReceiver = ChunkReceiver()
+        self.sysInfoSender = None
 
         self.hostConnected = False
         self.espConnected = False
@@ -43,155 +63,289 @@ class State:
 
         self.HDDActivity = HDDActivityRecorder()
 
-        self.hostSensorsRequestUniq = None
-        self.espMQTTStatusRequestUniq = None
+        self.sensorDelta = SensorDeltaDecoder()
+        # cleared when the host refuses quantized requests, its scale table differs from ours
+        self.sensorQuantize = SENSOR_QUANTIZE
+        # rolling aggregates of the scalar sensors, rebuilt when the sensor layout changes
+        self.sensorHistory = None
+
+        # periodic jobs, registered by main()
+        self.scheduler = Scheduler()
 
     def fetchSensors(self):
-        if self.hostSensorsRequestUniq is None:
-            uniq = getUniq()
-            self.hostSensorsRequestUniq = uniq
-            self.route([GET_SENSORS, PICO, HOST, uniq, PRIVATE], important=True)
+        opcode = GET_SENSORS_DELTA if SENSOR_DELTA else GET_SENSORS
+
+        if self.uartHost.inFlight(opcode) >= SENSOR_REQUESTS:
+            return
+
+        data = sensorRequest(self.sensorQuantize)
+        # plain values whenever our own scale table did not load
+        self.sensorQuantize = data[0] != 0
+
+        if SENSOR_DELTA:
+            request = self.request(Packet(GET_SENSORS_DELTA, PICO, HOST, NEW_UNIQ, PRIVATE, data + self.sensorDelta.request()))
+        else:
+            request = self.request(Packet(GET_SENSORS, PICO, HOST, NEW_UNIQ, PRIVATE, data))
+
+        request.then(self.onSensorsReply)
+
+    def onSensorsReply(self, request, packet):
+        if packet.opcode == ERR_INVALID_DATA and self.sensorQuantize:
+            print('Host scale table differs, requesting plain sensor values')
+            self.sensorQuantize = False
+
+    def updateSensors(self, frame):
+        if self.sensorHistory is None or self.sensorHistory.layout is not frame.layout:
+            self.sensorHistory = SensorHistory(frame.layout)
+
+        self.sensorHistory.record(frame)
+        display.updateSensors(frame)
 
     def fetchMQTTStatus(self):
         if self.espConnected:
-            if self.espMQTTStatusRequestUniq is None:
-                uniq = getUniq()
-                self.espMQTTStatusRequestUniq = uniq
-                self.route([GET_MQTT_STATUS, PICO, ESP, uniq, PRIVATE], important=True)
+            if self.uartESP.inFlight(GET_MQTT_STATUS) == 0:
+                self.request(Packet(GET_MQTT_STATUS, PICO, ESP, NEW_UNIQ, PRIVATE))
         else:
-            self.route([GET_MQTT_STATUS, PICO, ESP, getUniq(), PRIVATE], important=False)
+            self.route(Packet(GET_MQTT_STATUS, PICO, ESP, NEW_UNIQ, PRIVATE), important=False)
 
     def fetchWiFiSignal(self):
-        self.route([GET_WIFI, PICO, ESP, getUniq(), PRIVATE], important=True)
+        self.route(Packet(GET_WIFI, PICO, ESP, NEW_UNIQ, PRIVATE), important=True)
 
     def connectHost(self):
-        if not self.hostConnected:
+        if not self.hostConnected and not self.sysInfoReceiver.busy():
             print('Connecting to host')
-            self.route([GET_SYSINFO, PICO, HOST, getUniq(), PRIVATE, self.hash])
+            self.route(Packet(GET_SYSINFO, PICO, HOST, NEW_UNIQ, PRIVATE, [self.hash]))
 
-    def route(self, packet: list, important=False) -> bool:
-        if packet[2] == PICO:
+    def applySysInfo(self, sysInfo: dict):
+        self.sysInfo = sysInfo
+        self.hash = getHash(self.sysInfo)
+        print('Synced sysInfo file')
+        self.uartHost.stateConnected()
+        self.route(Packet(UPDATE_SYSINFO, PICO, ESP, NEW_UNIQ, PRIVATE, [self.hash]), important=True)
+
+    def route(self, packet: Packet, important=False) -> bool:
+        if packet.destination == PICO:
             return False
 
-        if packet[2] == HOST:
+        if packet.destination == HOST:
             self.uartHost.writePacket(packet, important)
         else:
             self.uartESP.writePacket(packet, important)
 
         return True
 
+    def request(self, packet: Packet):
+        if packet.destination == HOST:
+            return self.uartHost.writePacket(packet, True)
+
+        return self.uartESP.writePacket(packet, True)
+
     def handleRX(self, packet):
-        if packet[0] == TEST_DATA:
-            print('Test data:', packet[5])
-        elif packet[0] == PING:
-            self.route([PONG, packet[2], packet[1], packet[3], packet[4]])
-        elif packet[0] == UPDATE_SYSINFO:
-            if packet[5][0] != self.hash:
-                self.uartHost.updateSysInfo()
-            else:
-                print('Valid sysInfo')
-        elif packet[0] == SYSINFO_DATA:
-            self.sysInfo = json.loads(packet[5][0])
-            saveJSON('sysInfo.json', self.sysInfo)
-            self.hash = getHash(self.sysInfo)
-            print('Synced sysInfo file')
-            self.uartHost.stateConnected()
-            self.route([UPDATE_SYSINFO, PICO, ESP, getUniq(), PRIVATE, self.hash], important=True)
-        elif packet[0] == SYSINFO_OK:
+        if not handlers.dispatch(self, packet):
+            reply = unsupported(packet)
+
+            if reply is not None:
+                self.route(reply)
+
+    @handlers.on(TEST_DATA)
+    def onTestData(self, packet):
+        print('Test data:', packet.data)
+
+    @handlers.on(PING)
+    def onPing(self, packet):
+        self.route(Packet(PONG, packet.destination, packet.origin, packet.uniq, packet.channel))
+
+    @handlers.on(OK)
+    def onOk(self, packet):
+        pass  # acknowledgement, already matched to its request
+
+    @handlers.on(UPDATE_SYSINFO)
+    def onUpdateSysInfo(self, packet):
+        if packet.data[0] != self.hash:
+            self.uartHost.updateSysInfo()
+        else:
             print('Valid sysInfo')
-            self.uartHost.stateConnected()
-        elif packet[0] == SENSOR_DATA:
-            self.hostSensorsRequestUniq = None
-            if packet[5].pop(0) != self.hash:
-                print('Invalid sysInfo hash, resyncing')
-                self.uartHost.updateSysInfo()
-            else:
-                # print(parseSensors(packet[5], self.sysInfo))
-                display.updateSensors(parseSensors(packet[5], self.sysInfo))
-        elif packet[0] == WIFI_DATA:
-            display.updateWiFiSignal(packet[5][0])
-        elif packet[0] == MQTT_STATUS_DATA:
-            self.uartESP.stateWorking()
-            self.espMQTTStatusRequestUniq = None
-            display.updateMQTTStatus(packet[5][0])
-        elif packet[0] == COMM_POWER:
-            powerSwitch.low()
-            time.sleep_ms(100)
-            powerSwitch.high()
-
-            self.route([
-                OK,
-                packet[2],
-                packet[1],
-                packet[3],
-                packet[4]
-            ])
-        elif packet[0] == COMM_RESET:
-            resetSwitch.low()
-            time.sleep_ms(200)
-            resetSwitch.high()
-
-            self.route([
-                OK,
-                packet[2],
-                packet[1],
-                packet[3],
-                packet[4]
-            ])
-
-        elif packet[0] == GET_SYSINFO:
-            if len(packet[5]) > 0 and packet[5][0] == self.hash:
-                self.route([
-                    SYSINFO_OK,
-                    packet[2],
-                    packet[1],
-                    packet[3],
-                    PRIVATE
-                ])
+
+    @handlers.on(SYSINFO_DATA)
+    def onSysInfoData(self, packet):
+        sysInfo = json.loads(packet.data[0])
+        saveJSON('sysInfo.json', sysInfo)
+        removeSysInfo()
+        self.applySysInfo(sysInfo)
+
+    @handlers.on(SYSINFO_CHUNK)
+    def onSysInfoChunk(self, packet):
+        self.route(Packet(OK, packet.destination, packet.origin, packet.uniq, packet.channel))
+
+        if self.sysInfoReceiver.write(packet.data[0], packet.data[1], packet.data[2], packet.data[3]):
+            sysInfo = self.sysInfoReceiver.finish()
+
+            if sysInfo is not None:
+                self.applySysInfo(sysInfo)
+
+    @handlers.on(SYSINFO_OK)
+    def onSysInfoOk(self, packet):
+        print('Valid sysInfo')
+        self.uartHost.stateConnected()
+
+    @handlers.on(SENSOR_DATA)
+    def onSensorData(self, packet):
+        if packet.data[0] != self.hash:
+            print('Invalid sysInfo hash, resyncing')
+            self.uartHost.updateSysInfo()
+        else:
+            self.updateSensors(parseSensors(packet.data, self.sysInfo, self.sensorQuantize, 1))
+
+    @handlers.on(SENSOR_DELTA_DATA)
+    def onSensorDeltaData(self, packet):
+        if packet.data[0] != self.hash:
+            print('Invalid sysInfo hash, resyncing')
+            self.uartHost.updateSysInfo()
+        else:
+            values = self.sensorDelta.decode(packet.data[1], packet.data[2], packet.data[3:])
+
+            if values is None:
+                print('Sensor delta sequence gap, resyncing')
             else:
-                self.route([
-                    SYSINFO_DATA,
-                    packet[2],
-                    packet[1],
-                    packet[3],
-                    PRIVATE,
-                    json.dumps(self.sysInfo)
-                ])
-
-        elif packet[0] == GET_POWER_STATUS:
-            self.route([
-                POWER_STATUS_DATA,
-                packet[2],
-                packet[1],
-                packet[3],
-                PRIVATE,
-                powerLED.value()
-            ])
-
-        elif packet[0] == GET_HDD_ACTIVITY:
-            self.route([
-                HDD_ACTIVITY_DATA,
-                packet[2],
-                packet[1],
-                packet[3],
-                PRIVATE,
-                self.HDDActivity.activity
-            ])
-
-        elif packet[0] == GET_AMBIENT_TEMP:
-            self.route([
-                AMBIENT_TEMP_DATA,
-                packet[2],
-                packet[1],
-                packet[3],
+                self.updateSensors(parseSensors(values, self.sysInfo, self.sensorQuantize))
+
+    @handlers.on(WIFI_DATA)
+    def onWiFiData(self, packet):
+        display.updateWiFiSignal(packet.data[0])
+
+    @handlers.on(MQTT_STATUS_DATA)
+    def onMQTTStatusData(self, packet):
+        self.uartESP.stateWorking()
+        display.updateMQTTStatus(packet.data[0])
+
+    @handlers.on(COMM_POWER)
+    def onCommPower(self, packet):
+        powerSwitch.low()
+        time.sleep_ms(100)
+        powerSwitch.high()
+
+        self.route(Packet(
+            OK,
+            packet.destination,
+            packet.origin,
+            packet.uniq,
+            packet.channel
+        ))
+
+    @handlers.on(COMM_RESET)
+    def onCommReset(self, packet):
+        resetSwitch.low()
+        time.sleep_ms(200)
+        resetSwitch.high()
+
+        self.route(Packet(
+            OK,
+            packet.destination,
+            packet.origin,
+            packet.uniq,
+            packet.channel
+        ))
+
+    @handlers.on(GET_SYSINFO)
+    def onGetSysInfo(self, packet):
+        if len(packet.data) > 0 and packet.data[0] == self.hash:
+            self.route(Packet(
+                SYSINFO_OK,
+                packet.destination,
+                packet.origin,
+                packet.uniq,
+                PRIVATE
+            ))
+        elif packet.origin == ESP and fileSize(SYSINFO_FILE) > 0:
+            # only the ESP reassembles chunks, it answers the commander from its copy once synced
+            if self.sysInfoSender is not None:
+                self.sysInfoSender.cancel()
+
+            self.sysInfoSender = ChunkSender(self.request, sysInfoChunks(
+                packet.destination, packet.origin, self.hash, SYSINFO_FILE))
+        else:
+            self.route(Packet(
+                SYSINFO_DATA,
+                packet.destination,
+                packet.origin,
+                packet.uniq,
                 PRIVATE,
-                readAmbientTemp()
-            ])
+                [json.dumps(self.sysInfo)]
+            ))
+
+    @handlers.on(GET_POWER_STATUS)
+    def onGetPowerStatus(self, packet):
+        self.route(Packet(
+            POWER_STATUS_DATA,
+            packet.destination,
+            packet.origin,
+            packet.uniq,
+            PRIVATE,
+            [powerLED.value()]
+        ))
+
+    @handlers.on(GET_HDD_ACTIVITY)
+    def onGetHDDActivity(self, packet):
+        self.route(Packet(
+            HDD_ACTIVITY_DATA,
+            packet.destination,
+            packet.origin,
+            packet.uniq,
+            PRIVATE,
+            self.HDDActivity.activity
+        ))
+
+    @handlers.on(GET_STATS)
+    def onGetStats(self, packet):
+        self.route(Packet(
+            STATS_DATA,
+            packet.destination,
+            packet.origin,
+            packet.uniq,
+            PRIVATE,
+            [packStats({
+                'host': self.uartHost.linkStats(),
+                'esp': self.uartESP.linkStats(),
+            }, {
+                'loop': self.scheduler.stats(),
+                'plans': getPlanCacheStats(),
+                'handlers': handlers.stats(),
+                'memFree': gc.mem_free()
+            })]
+        ))
+
+    @handlers.on(GET_SENSOR_HISTORY)
+    def onGetSensorHistory(self, packet):
+        # data: window in samples, then sensor vector indices (all tracked sensors when empty)
+        try:
+            if self.sensorHistory is None:
+                raise Exception('No sensor history recorded yet')
+
+            data = self.sensorHistory.query(packet.data[0], packet.data[1:])
+        except Exception as e:
+            print(e)
+            self.route(Packet(ERR_INVALID_DATA, packet.destination, packet.origin, packet.uniq, packet.channel))
+            return
 
-        # if packet[1] == HOST and not self.hostConnected:
-            # self.uartHost.stateWorking()
-        # if packet[1] != HOST and not self.espConnected:
-        #     self.uartESP.stateWorking()
+        self.route(Packet(
+            SENSOR_HISTORY_DATA,
+            packet.destination,
+            packet.origin,
+            packet.uniq,
+            PRIVATE,
+            [self.hash] + data
+        ))
+
+    @handlers.on(GET_AMBIENT_TEMP)
+    def onGetAmbientTemp(self, packet):
+        self.route(Packet(
+            AMBIENT_TEMP_DATA,
+            packet.destination,
+            packet.origin,
+            packet.uniq,
+            PRIVATE,
+            [readAmbientTemp()]
+        ))
 
 
 class UartHost(UartBase):
@@ -206,31 +360,25 @@ class UartHost(UartBase):
         if self.state.route(packet):
             return
 
-        if self.requests.get(packet[3]) is not None:
-            # print('Deleting request:', packet[3])
-            self.requests.pop(packet[3])
-
-        self.state.handleRX(packet)
+        self.handleRequest(packet, self.state.handleRX)
 
     def updateSysInfo(self):
-        self.state.hostSensorsRequestUniq = None
+        self.state.sensorDelta.reset()
         self.state.hostConnected = False
         display.changeState(display.STATE_CONNECTING)
         self.state.connectHost()
 
     def stateConnected(self):
-        self.state.hostSensorsRequestUniq = None
         self.state.hostConnected = True
         display.changeState(display.STATE_WORKING)
         self.state.fetchSensors()
 
-    def handleFailedRequest(self, request: list) -> None:
+    def handleFailedRequest(self, request: Request) -> None:
         if not self.state.hostConnected:
             return
 
         super().handleFailedRequest(request)
 
-        self.state.hostSensorsRequestUniq = None
         display.changeState(display.STATE_CONNECTION_LOST)
         display.refresh(None)
         time.sleep(5)
@@ -249,22 +397,17 @@ class UartESP(UartBase):
         if self.state.route(packet):
             return
 
-        if self.requests.get(packet[3]) is not None:
-            self.requests.pop(packet[3])
-
-        self.state.handleRX(packet)
+        self.handleRequest(packet, self.state.handleRX)
 
     def stateWorking(self):
         self.state.espConnected = True
-        self.state.espMQTTStatusRequestUniq = None
 
-    def handleFailedRequest(self, request: list) -> None:
+    def handleFailedRequest(self, request: Request) -> None:
         if not self.state.espConnected:
             return
 
         super().handleFailedRequest(request)
 
-        self.state.espMQTTStatusRequestUniq = None
         self.state.espConnected = False
         display.updateWiFiSignal(0)
         display.updateMQTTStatus(0)
@@ -277,80 +420,19 @@ def readAmbientTemp() -> float:
     return temp
 
 
-def setupEncoder(state: State):
-    btn = Pin(11, Pin.IN)
-    left = Pin(12, Pin.IN)
-    right = Pin(13, Pin.IN)
-
-    # @debounce(10)
-    def leftHandler(_):
-        # state.route(Packet(ENCODER_LEFT, PICO, HOST, getUniq(), PRIVATE))
-        display.SENSOR_OFFSET += 1
-
-    @debounce(50)
-    def rightHandler(_):
-        if left.value() == 0:
-            return leftHandler(_)
-
-        # state.route(Packet(ENCODER_RIGHT, PICO, HOST, getUniq(), PRIVATE))
-        display.SENSOR_OFFSET -= 1
-
-    @debounce(300)
-    def btnHandler(_):
-        display.toggle()
-        # state.route(Packet(ENCODER_PRESSED, PICO, HOST, getUniq(), PRIVATE))
-
-    btn.irq(trigger=Pin.IRQ_FALLING, handler=btnHandler.exec)
-    # left.irq(trigger=Pin.IRQ_FALLING, handler=leftHandler.exec)
-    right.irq(trigger=Pin.IRQ_FALLING, handler=rightHandler.exec)
-
-
-right_assist = 0
-count = 0  # Rotate the value of the encoder
-
+def setupEncoder(state: State) -> QuadratureEncoder:
+    def onEvent(event: int):
+        if event == EVENT_LEFT:
+            # state.route(Packet(ENCODER_LEFT, PICO, HOST, NEW_UNIQ, PRIVATE))
+            display.SENSOR_OFFSET += 1
+        elif event == EVENT_RIGHT:
+            # state.route(Packet(ENCODER_RIGHT, PICO, HOST, NEW_UNIQ, PRIVATE))
+            display.SENSOR_OFFSET -= 1
+        elif event == EVENT_PRESSED:
+            # state.route(Packet(ENCODER_PRESSED, PICO, HOST, NEW_UNIQ, PRIVATE))
+            display.toggle()
 
-def setupEncoderV2(state: State):
-    right = Pin(13, Pin.IN)
-    left = Pin(12, Pin.IN)
-    down = Pin(11, Pin.IN)
-    timer = Timer()
-
-    def right_handler(pin):
-        global right_assist
-        right.irq(handler=None)
-        right_assist = 1
-
-    def down_handler(pin):
-        global count
-        down.irq(handler=None)
-        count = 0
-        print("down", count)
-        state.route([ENCODER_PRESSED, PICO, HOST, getUniq(), PRIVATE])
-        down.irq(trigger=Pin.IRQ_FALLING, handler=down_handler)
-
-    def loop(_):
-        global count, right_assist
-
-        if (right_assist == 1):
-            if (left.value() == 1):
-                count = count - 1
-                print("left",  count)
-                state.route([ENCODER_LEFT, PICO, HOST, getUniq(), PRIVATE])
-
-            elif (left.value() == 0):
-                count = count + 1
-                print("right",  count)
-                state.route([ENCODER_RIGHT, PICO, HOST, getUniq(), PRIVATE])
-
-            while (left.value() == 0) | (right.value() == 0):
-                time.sleep_ms(1)
-
-            right_assist = 0
-            right.irq(trigger=Pin.IRQ_FALLING, handler=right_handler)
-
-    right.irq(trigger=Pin.IRQ_FALLING, handler=right_handler)
-    down.irq(trigger=Pin.IRQ_FALLING, handler=down_handler)
-    timer.init(freq=1_000, mode=Timer.PERIODIC, callback=loop)
+    return QuadratureEncoder(Pin(12, Pin.IN), Pin(13, Pin.IN), Pin(11, Pin.IN), onEvent)
 
 
 class HDDActivityRecorder:
@@ -376,67 +458,49 @@ def processHostLEDs(state: State):
 
 def main():
     LOOP_TIME = const(50)  # ms
-    LOOP_COUNTER = 0
 
     state = State()
-    setupEncoder(state)
-    # setupEncoderV2(state)
+    encoder = setupEncoder(state)  # noqa: F841, keeps the IRQ handlers referenced
 
-    lastLoopTime = LOOP_TIME
-    drift = 0
-    avgTime = LOOP_TIME
+    uartHost = state.uartHost
+    uartESP = state.uartESP
 
-    try:
-        uartHost = state.uartHost
-        uartESP = state.uartESP
+    def checkRX():
+        uartHost.checkRX()
+        uartESP.checkRX()
 
-        uartHost.updateSysInfo()
-
-        while True:
-            loopStart = time_ns()
-
-            # blink led
-            if timeDivider(LOOP_COUNTER + 1, LOOP_TIME, 1_000):
-                picoLED.toggle()
-
-            uartHost.checkRX()
-            uartESP.checkRX()
-
-            if timeDivider(LOOP_COUNTER + 1, LOOP_TIME, 1_000):
-                if state.hostConnected:
-                    state.fetchSensors()
-                else:
-                    state.connectHost()
-
-            if timeDivider(LOOP_COUNTER, LOOP_TIME, 5_000):
-                state.fetchMQTTStatus()
-                # print(state.HDDActivity.activity)
-
-            if timeDivider(LOOP_COUNTER, LOOP_TIME, 20_000) and state.espConnected:
-                state.fetchWiFiSignal()
-
-            if timeDivider(LOOP_COUNTER, LOOP_TIME, 50):
-                uartHost.checkRequests()
-                uartESP.checkRequests()
-
-            if timeDivider(LOOP_COUNTER, LOOP_TIME, 100):
-                processHostLEDs(state)
-
-            # loop stuff
-            LOOP_COUNTER = (LOOP_COUNTER + 1) % 2_147_483_648
-
-            adjustedTime = min(LOOP_TIME * 2, max(0, LOOP_TIME - drift))
-            time.sleep_ms(adjustedTime)
-
-            lastLoopTime = math.ceil((time_ns() - loopStart) / 1_000_000)
-            lastLoopTime = max(0, lastLoopTime)  # handle overflow
-
-            avgTime = (avgTime * 49 + lastLoopTime) / 50
-            drift += lastLoopTime - LOOP_TIME
-
-            # if timeDivider(LOOP_COUNTER, LOOP_TIME, 5_000):
-            # print("loop time:", lastLoopTime, "avg:", avgTime, "drift:", drift)
+    def syncHost():
+        if state.hostConnected:
+            state.fetchSensors()
+        else:
+            state.connectHost()
+
+    def fetchWiFiSignal():
+        if state.espConnected:
+            state.fetchWiFiSignal()
+
+    def checkRequests():
+        uartHost.checkRequests()
+        uartESP.checkRequests()
+
+    def checkTX():
+        uartHost.checkTX()
+        uartESP.checkTX()
+
+    scheduler = state.scheduler
+    # tasks sharing a period run in this order
+    scheduler.every('led', 1_000, picoLED.toggle)
+    scheduler.every('rx', LOOP_TIME, checkRX)
+    scheduler.every('host', 1_000, syncHost)
+    scheduler.every('mqtt', 5_000, state.fetchMQTTStatus)
+    scheduler.every('wifi', 20_000, fetchWiFiSignal)
+    scheduler.every('requests', 50, checkRequests)
+    scheduler.every('leds', 100, lambda: processHostLEDs(state))
+    scheduler.every('tx', LOOP_TIME, checkTX)
 
+    try:
+        uartHost.updateSysInfo()
+        scheduler.run()
     except KeyboardInterrupt:
         pass
 
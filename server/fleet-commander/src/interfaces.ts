@@ -7,6 +7,67 @@ export interface ModuleData {
   sysInfo: SysInfo | null;
 }
 
+export interface LinkStats {
+  inFlight: number;
+  inFlightBytes: number;
+  queueDepth: number;
+  maxQueueDepth: number;
+  drops: number;
+  stalls: number;
+  rx: [frames: number, bytes: number];
+  tx: [frames: number, bytes: number];
+  corrupted: number;
+  retries: number;
+  failed: number;
+  // request latency histogram, buckets end at 5, 10, 25, 50, 100, 250, 500, 1000 ms and above
+  latency: number[];
+  rto: number;
+}
+
+export interface SchedulerStats {
+  // ms spent running tasks and sleeping
+  busy: number;
+  idle: number;
+  tasks: { [name: string]: [runs: number, overruns: number, maxLate: number] };
+}
+
+export interface PlanCacheStats {
+  // legacy packet format plans, keyed by the type/range signature of the fields
+  size: number;
+  capacity: number;
+  hits: number;
+  misses: number;
+  evictions: number;
+}
+
+export interface HandlerStats {
+  // opcode -> calls and total handler time in us, the least called are left out when the reply would not fit one frame
+  [opcode: string]: [calls: number, us: number];
+}
+
+export interface SensorAggregate {
+  // index in the sensor vector, same order as parseSensors
+  index: number;
+  min: number;
+  max: number;
+  mean: number;
+}
+
+export interface SensorHistory {
+  // window length and samples recorded so far, both in sensor updates
+  window: number;
+  samples: number;
+  sensors: SensorAggregate[];
+}
+
+export interface ModuleStats {
+  [link: string]: LinkStats | SchedulerStats | PlanCacheStats | HandlerStats | number;
+  loop: SchedulerStats;
+  plans: PlanCacheStats;
+  handlers: HandlerStats;
+  memFree: number;
+}
+
 export interface Request {
   uniq: number;
   timestamp: number;
@@ -1,15 +1,18 @@
 import { connect } from 'mqtt';
-import { packData, unpackData } from '#shared/packets';
+import { packData, splitBatch, unpackData } from '#shared/packets';
 import {
   AMBIENT_TEMP_DATA,
   COMM_POWER,
   COMM_RESET,
   COMM_SLEEP,
+  ERR_INVALID_DATA,
   ERR_UNSUPPORTED_OPCODE,
   GET_AMBIENT_TEMP,
   GET_HDD_ACTIVITY,
   GET_POWER_STATUS,
+  GET_SENSOR_HISTORY,
   GET_SENSORS,
+  GET_STATS,
   GET_SYSINFO,
   GET_WIFI,
   HDD_ACTIVITY_DATA,
@@ -22,6 +25,8 @@ import {
   REGISTERED,
   REGISTRATION_DATA,
   SENSOR_DATA,
+  SENSOR_HISTORY_DATA,
+  STATS_DATA,
   SYSINFO_DATA,
   WIFI_DATA,
 } from '#shared/opcodes';
@@ -29,11 +34,11 @@ import { Packet, Sensors, SysInfo } from '#shared/interfaces';
 import { getUniq } from '#shared/utils';
 import Deferred from '#shared/Deferred';
 import { parseSensors } from '#shared/sensors';
-import { ModuleData, Request } from './interfaces';
+import { LinkStats, ModuleData, ModuleStats, PlanCacheStats, Request, SensorAggregate, SensorHistory } from './interfaces';
 import config from './config';
 import { extractModuleName, picoIn, picoOut, PUBLIC_IN, PUBLIC_OUT } from '#shared/mqttUtils';
 import { COMM, ESP, HOST, PICO, PRIVATE, PUBLIC, Routes } from '#shared/routes';
-import { ModuleNotFound, RequestTimeout, UnsuportedOpcode } from './errors';
+import { InvalidParams, ModuleNotFound, RequestTimeout, UnsuportedOpcode } from './errors';
 
 type OpcodeHandler = (topic: string, packet: Packet) => void;
 
@@ -65,10 +70,24 @@ const conectivityCheckLoop = (): void => {
 
 
 const handleMessage = (topic: string, message: Buffer): void => {
+  let frames: Buffer[];
+
+  try {
+    frames = splitBatch(message);
+  } catch (err) {
+    console.log(topic, '=>', 'ERROR', err);
+    return;
+  }
+
+  for (const frame of frames) handlePacket(topic, frame);
+};
+
+
+const handlePacket = (topic: string, frame: Buffer): void => {
   let p: Packet | undefined;
 
   try {
-    const packet = unpackData(message);
+    const packet = unpackData(frame);
     p = packet;
     console.log(topic, '=>',
       Opcodes[packet.opcode as number] ?? `INVALID_OPCODE[${packet.opcode}]`,
@@ -115,6 +134,14 @@ const handleMessage = (topic: string, message: Buffer): void => {
         handleAmbientTempData(topic, packet);
         break;
 
+      case STATS_DATA:
+        handleStatsData(topic, packet);
+        break;
+
+      case SENSOR_HISTORY_DATA:
+        handleSensorHistoryData(topic, packet);
+        break;
+
       case OK:
         handleOk(topic, packet);
         break;
@@ -123,6 +150,10 @@ const handleMessage = (topic: string, message: Buffer): void => {
         handleErrUnsupportedOpcode(topic, packet);
         break;
 
+      case ERR_INVALID_DATA:
+        handleErrInvalidData(topic, packet);
+        break;
+
       default:
         client.publish(picoIn(extractModuleName(topic)), packData(ERR_UNSUPPORTED_OPCODE, packet.destination, packet.origin, packet.uniq, packet.channel));
         break;
@@ -308,6 +339,92 @@ const handleAmbientTempData: OpcodeHandler = (topic: string, packet: Packet) =>
   }
 };
 
+// STATS_DATA sends links and the plan cache as arrays to fit one frame, same order as shared/stats.py
+const LINK_FIELDS = [
+  'inFlight', 'inFlightBytes', 'queueDepth', 'maxQueueDepth', 'drops', 'stalls',
+  'corrupted', 'retries', 'failed', 'rto',
+] as const;
+const PLAN_FIELDS = ['size', 'capacity', 'hits', 'misses', 'evictions'] as const;
+const LATENCY_BUCKETS = 9;
+
+const expandLink = (values: number[]): LinkStats => {
+  const link: Record<string, number | number[]> = {};
+  LINK_FIELDS.forEach((field, i) => {
+    link[field] = values[i];
+  });
+
+  const tail = LINK_FIELDS.length;
+  link.rx = [values[tail], values[tail + 1]];
+  link.tx = [values[tail + 2], values[tail + 3]];
+
+  // empty slow buckets are left out by the module
+  const latency = values.slice(tail + 4);
+  while (latency.length < LATENCY_BUCKETS) latency.push(0);
+  link.latency = latency;
+
+  return link as unknown as LinkStats;
+};
+
+const expandStats = (raw: Record<string, unknown>): ModuleStats => {
+  const stats: Record<string, unknown> = {};
+
+  for (const [name, value] of Object.entries(raw)) {
+    if (name === 'plans' && Array.isArray(value)) {
+      const plans: Record<string, number> = {};
+      PLAN_FIELDS.forEach((field, i) => {
+        plans[field] = value[i];
+      });
+      stats.plans = plans as unknown as PlanCacheStats;
+    } else if (Array.isArray(value)) {
+      stats[name] = expandLink(value);
+    } else {
+      stats[name] = value;
+    }
+  }
+
+  return stats as unknown as ModuleStats;
+};
+
+const handleStatsData: OpcodeHandler = (topic: string, packet: Packet) => {
+  if (packet.data[0] === undefined || typeof packet.data[0] !== 'string') throw new Error('Invalid packet, no stats provided');
+
+  const request = requests.get(packet.uniq);
+  if (request === undefined) return;
+
+  try {
+    const stats = expandStats(JSON.parse(packet.data[0]));
+
+    request.resolve(stats);
+    requests.delete(packet.uniq);
+  } catch (err) {
+    if (err instanceof Error) {
+      request.reject(err);
+      requests.delete(packet.uniq);
+    } else {
+      request.reject(new Error('Stats parsing failed'));
+      requests.delete(packet.uniq);
+    }
+  }
+};
+
+const handleSensorHistoryData: OpcodeHandler = (topic: string, packet: Packet) => {
+  const request = requests.get(packet.uniq);
+  if (request === undefined) return;
+
+  // sysInfo hash, window, samples, then index, min, max, mean of every sensor
+  const [, window, samples, ...values] = packet.data as number[];
+  const sensors: SensorAggregate[] = [];
+
+  for (let i = 0; i + 3 < values.length; i += 4) {
+    sensors.push({ index: values[i], min: values[i + 1], max: values[i + 2], mean: values[i + 3] });
+  }
+
+  const history: SensorHistory = { window, samples, sensors };
+
+  request.resolve(history);
+  requests.delete(packet.uniq);
+};
+
 const handleOk: OpcodeHandler = (topic: string, packet: Packet) => {
   const request = requests.get(packet.uniq);
   if (request === undefined) return;
@@ -323,6 +440,13 @@ const handleErrUnsupportedOpcode: OpcodeHandler = (topic: string, packet: Packet
   request.reject(new UnsuportedOpcode(packet.opcode));
 };
 
+const handleErrInvalidData: OpcodeHandler = (topic: string, packet: Packet) => {
+  const request = requests.get(packet.uniq);
+  if (request === undefined) return;
+
+  request.reject(new InvalidParams('Request data rejected by module'));
+};
+
 const writePacket = (packet: Buffer, targetRAW?: string) => {
   let target = PUBLIC_IN;
   if (targetRAW !== undefined) {
@@ -335,7 +459,7 @@ const writePacket = (packet: Buffer, targetRAW?: string) => {
   client.publish(target, packet);
 };
 
-const makeRequest = async <T>(opcode: Opcodes, destination: Routes, targetRAW?: string) => {
+const makeRequest = async <T>(opcode: Opcodes, destination: Routes, targetRAW?: string, ...data: number[]) => {
   let target = PUBLIC_IN;
   if (targetRAW !== undefined) {
     if (!modules.has(targetRAW)) throw new ModuleNotFound(targetRAW);
@@ -344,7 +468,7 @@ const makeRequest = async <T>(opcode: Opcodes, destination: Routes, targetRAW?:
 
   const uniq = getUniq();
 
-  return sendRequest<T>(target, uniq, packData(opcode, COMM, destination, uniq, PRIVATE)).promise;
+  return sendRequest<T>(target, uniq, packData(opcode, COMM, destination, uniq, PRIVATE, ...data)).promise;
 };
 
 const sendRequest = <T>(topic: string, uniq: number, packet: Buffer): Deferred<T> => {
@@ -457,6 +581,27 @@ export const getAmbientTemp = async (target?: string): Promise<{ name: string; d
   return names.map((name, index) => ({ name, data: d[index] }));
 };
 
+export const getStats = async (target?: string): Promise<{ name: string; data: { pico: ModuleStats; esp: ModuleStats; }; }[]> => {
+  const names = target !== undefined ? [target] : Array.from(modules.keys());
+  const d = await Promise.all(names.map(async (name) => {
+    const [pico, esp] = await Promise.all([
+      makeRequest<ModuleStats>(GET_STATS, PICO, name),
+      makeRequest<ModuleStats>(GET_STATS, ESP, name),
+    ]);
+
+    return { pico, esp };
+  }));
+
+  return names.map((name, index) => ({ name, data: d[index] }));
+};
+
+export const getSensorHistory = async (window: number, sensors: number[], target?: string): Promise<{ name: string; data: SensorHistory; }[]> => {
+  const names = target !== undefined ? [target] : Array.from(modules.keys());
+  const d = await Promise.all(names.map((name) => makeRequest<SensorHistory>(GET_SENSOR_HISTORY, PICO, name, window, ...sensors)));
+
+  return names.map((name, index) => ({ name, data: d[index] }));
+};
+
 export const postPower = async (target: string): Promise<void> => {
   await makeRequest(COMM_POWER, PICO, target);
 };
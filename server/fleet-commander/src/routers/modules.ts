@@ -2,8 +2,8 @@ import { SysInfo } from '#shared/interfaces';
 import { arrayFrom } from '#shared/utils';
 import { InvalidParams, ModuleNotFound, RequestTimeout, UnsuportedOpcode } from '../errors';
 import { Router } from 'express';
-import { ModuleData } from '../interfaces';
-import { getModule, getSysInfo } from '../mqttHandler';
+import { ModuleData, ModuleStats } from '../interfaces';
+import { getModule, getStats, getSysInfo } from '../mqttHandler';
 
 // eslint-disable-next-line new-cap
 const router = Router();
@@ -62,3 +62,31 @@ router.get('/sysinfo', async (req, res) => {
     else res.sendStatus(500);
   }
 });
+
+
+router.get('/stats', async (req, res) => {
+  try {
+    const target = arrayFrom(req.query.module);
+    const data: { name: string; data: { pico: ModuleStats; esp: ModuleStats; }; }[] = [];
+
+    await Promise.all(
+      target.map(async (module) => {
+        // validate arguments
+        if (typeof module !== 'string' && module !== undefined) throw new InvalidParams('Module name must be a string');
+
+        // unwrap data
+        data.push(...(await getStats(module)));
+      }),
+    );
+
+    res.json({ data: data });
+  } catch (err) {
+    res.contentType('text/plain');
+
+    if (err instanceof UnsuportedOpcode) res.status(501).send(err.message);
+    else if (err instanceof ModuleNotFound) res.status(404).send(err.message);
+    else if (err instanceof RequestTimeout) res.status(504).send(err.message);
+    else if (err instanceof InvalidParams) res.status(400).json(err.message);
+    else res.sendStatus(500);
+  }
+});
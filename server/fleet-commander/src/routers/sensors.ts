@@ -1,8 +1,9 @@
 import { InvalidParams, ModuleNotFound, RequestTimeout, UnsuportedOpcode } from '../errors';
 import { Router } from 'express';
-import { getAmbientTemp, getSensors, getWiFi } from '../mqttHandler';
+import { getAmbientTemp, getSensorHistory, getSensors, getWiFi } from '../mqttHandler';
 import { arrayFrom } from '#shared/utils';
 import { Sensors } from '#shared/interfaces';
+import { SensorHistory } from '../interfaces';
 
 // eslint-disable-next-line new-cap
 const router = Router();
@@ -89,3 +90,36 @@ router.get('/host', async (req, res) => {
     else res.sendStatus(500);
   }
 });
+
+router.get('/history', async (req, res) => {
+  try {
+    const target = arrayFrom(req.query.module);
+    const window = Number(req.query.window ?? 60);
+    const sensors = (req.query.sensor === undefined ? [] : arrayFrom(req.query.sensor)).map(Number);
+    const data: { name: string; data: SensorHistory; }[] = [];
+
+    // validate arguments
+    if (!Number.isInteger(window) || window < 1) throw new InvalidParams('Window must be a positive integer');
+    if (sensors.some((s) => !Number.isInteger(s) || s < 0)) throw new InvalidParams('Sensor indices must be non-negative integers');
+
+    await Promise.all(
+      target.map(async (module) => {
+        // validate arguments
+        if (typeof module !== 'string' && module !== undefined) throw new InvalidParams('Module name must be a string');
+
+        // unwrap data
+        data.push(...(await getSensorHistory(window, sensors, module)));
+      }),
+    );
+
+    res.json({ data: data });
+  } catch (err) {
+    res.contentType('text/plain');
+
+    if (err instanceof UnsuportedOpcode) res.status(501).send(err.message);
+    else if (err instanceof ModuleNotFound) res.status(404).send(err.message);
+    else if (err instanceof RequestTimeout) res.status(504).send(err.message);
+    else if (err instanceof InvalidParams) res.status(400).json(err.message);
+    else res.sendStatus(500);
+  }
+});
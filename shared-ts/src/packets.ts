@@ -4,6 +4,9 @@ import { Routes } from './routes';
 import { Packet } from './interfaces';
 
 
+// first byte of a batch frame, same as WIRE_BATCH in shared/packets.py
+export const WIRE_BATCH = 3;
+
 export const packDataRaw = (packetFormat: string, ...data: DataType[]): Buffer => {
   let headerSize = packetFormat.length + 1;
   headerSize += headerSize.toString().length;
@@ -84,3 +87,27 @@ export const unpackData = (packet: Buffer): Packet => {
 
   return { opcode, origin, destination, uniq, channel, data: data.slice(6) };
 };
+
+// splits a batch frame (version, packet count, then every packet without its stop marker
+// prefixed with a 16 bit little endian length) into packets, other frames are returned as is
+export const splitBatch = (message: Buffer): Buffer[] => {
+  if (message[0] !== WIRE_BATCH) return [message];
+
+  const packets: Buffer[] = [];
+  const end = message.length - PACKET_STOP.length;
+  let offset = 2;
+
+  for (let i = 0; i < message[1]; i++) {
+    if (offset + 2 > end) throw new Error('Invalid batch, packet exceeds frame');
+
+    const size = message.readUInt16LE(offset);
+    offset += 2;
+
+    if (offset + size > end) throw new Error('Invalid batch, packet exceeds frame');
+
+    packets.push(Buffer.concat([message.subarray(offset, offset + size), PACKET_STOP]));
+    offset += size;
+  }
+
+  return packets;
+};
@@ -1,6 +1,12 @@
 import struct
-from shared.packets import packData, unpackData
-from shared.utils import flatten
+from heapq import heapify, heappop, heappush
+from shared.opcodes import (
+    AMBIENT_TEMP_DATA, ERR_INVALID_DATA, ERR_REQUEST_FAILED, ERR_UNSUPPORTED_OPCODE, GET_SYSINFO, GET_WIFI,
+    HDD_ACTIVITY_DATA, MQTT_STATUS_DATA, OK, PONG, POWER_STATUS_DATA, REGISTERED, SENSOR_DATA, SENSOR_DELTA_DATA,
+    SENSOR_HISTORY_DATA, STATS_DATA, SYSINFO_DATA, SYSINFO_OK, UPDATE_SYSINFO, WIFI_DATA)
+from shared.packets import FRAMING_STOP, MAX_PACKET_SIZE, WIRE_V1, PacketView, batchSize, packBatch, packPacket, splitFrames
+from shared.types import Packet, Request, requestKey
+from shared.utils import getUniq
 
 
 try:
@@ -12,45 +18,494 @@ except ModuleNotFoundError as e:
     from time import time_ns
 
 
+REQUEST_RETRIES = 3
+
+# ns, handlers of these opcodes run for seconds (wlan.scan(), sysInfo sync), so they are never
+# retried sooner and their round trips are not sampled as link latency
+REQUEST_MIN_TIMEOUTS = {
+    GET_WIFI: 3_000_000_000,
+    GET_SYSINFO: 3_000_000_000,
+    UPDATE_SYSINFO: 3_000_000_000,
+}
+
+# opcodes answering a request, requests and replies share the uniq space of a link,
+# so only these settle an outstanding request
+REPLIES = (
+    OK, SYSINFO_OK, PONG, REGISTERED, SYSINFO_DATA, SENSOR_DATA, WIFI_DATA, POWER_STATUS_DATA, HDD_ACTIVITY_DATA,
+    MQTT_STATUS_DATA, AMBIENT_TEMP_DATA, SENSOR_DELTA_DATA, STATS_DATA, SENSOR_HISTORY_DATA,
+    ERR_UNSUPPORTED_OPCODE, ERR_INVALID_DATA, ERR_REQUEST_FAILED,
+)
+
+# uniq placeholder, writePacket fills in the next free uniq of the link
+NEW_UNIQ = None
+
+# what happens to an important packet written while the send queue is full
+DROP_OLDEST = 0
+DROP_NEWEST = 1
+
+DEDUP_SIZE = 16
+DEDUP_MAX_BYTES = 1024  # recorded responses of all cached requests, least recently used ones are evicted first
+SETTLED_SIZE = 16  # recently settled requests, late duplicates of their replies are dropped
+
+# upper bounds (ms) of the request latency histogram, the last bucket counts everything slower
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+class CacheEntry:
+    __slots__ = ('key', 'expiry', 'responses', 'size', 'prev', 'next')
+
+    def __init__(self, key, expiry: int):
+        self.key = key
+        self.expiry = expiry
+        # (channel, packetRaw) of every response, None when they were too large to keep
+        self.responses = []
+        self.size = 0
+
+        self.prev = self
+        self.next = self
+
+
+class ResponseCache:
+    # (origin, uniq, opcode) -> CacheEntry of recently handled requests, linked from the least
+    # to the most recently used, so lookups, moves and evictions are all O(1)
+    def __init__(self, size: int, ttl: int, maxBytes: int = DEDUP_MAX_BYTES):
+        self.size = size
+        self.ttl = ttl
+        self.maxBytes = maxBytes
+        # response bytes held by all entries
+        self.bytes = 0
+        self.entries = {}
+        # sentinel, head.next is the least recently used entry
+        self.head = CacheEntry(None, 0)
+
+        self.hits = 0
+
+    def unlink(self, entry: CacheEntry):
+        entry.prev.next = entry.next
+        entry.next.prev = entry.prev
+
+    def append(self, entry: CacheEntry):
+        last = self.head.prev
+        entry.prev = last
+        entry.next = self.head
+        last.next = entry
+        self.head.prev = entry
+
+    def lookup(self, key: tuple, now: int):
+        entry = self.entries.get(key)
+
+        if entry is None:
+            return None
+
+        if entry.expiry < now or entry.responses is None:
+            self.remove(entry)
+            return None
+
+        self.unlink(entry)
+        self.append(entry)
+        self.hits += 1
+
+        return entry.responses
+
+    def add(self, key: tuple, now: int) -> CacheEntry:
+        entry = self.entries.get(key)
+
+        if entry is not None:
+            self.remove(entry)
+        elif len(self.entries) >= self.size:
+            self.remove(self.head.next)
+
+        entry = CacheEntry(key, now + self.ttl)
+        self.entries[key] = entry
+        self.append(entry)
+
+        return entry
+
+    def record(self, entry: CacheEntry, channel: int, packetRaw: bytes) -> None:
+        if entry.responses is None:
+            return
+
+        size = len(packetRaw)
+
+        # older entries make room, the entry being recorded is never evicted by its own responses
+        while self.bytes + size > self.maxBytes and self.head.next is not entry:
+            self.remove(self.head.next)
+
+        if self.bytes + size > self.maxBytes:
+            # too large to keep, the request runs again when retransmitted
+            self.bytes -= entry.size
+            entry.responses = None
+            entry.size = 0
+            return
+
+        entry.responses.append((channel, packetRaw))
+        entry.size += size
+        self.bytes += size
+
+    def remove(self, entry: CacheEntry):
+        self.unlink(entry)
+        self.entries.pop(entry.key)
+        self.bytes -= entry.size
+
+
 class BaseClient:
+    # wire format used for outgoing packets, incoming ones are detected per frame
+    WIRE_VERSION = WIRE_V1
+    # packets written within this window (ns) are sent as one batch frame, None disables batching
+    BATCH_WINDOW = None
+    FRAMING = FRAMING_STOP
+    # retransmission timeout bounds (ns), the timeout itself follows the measured round trip time
+    RTO_INITIAL = 3_000_000_000
+    RTO_MIN = 200_000_000
+    RTO_MAX = 30_000_000_000
+    # important packets allowed in flight, further ones wait in a bounded queue
+    WINDOW_SIZE = 8
+    # bytes of important packets allowed in flight, None disables the limit
+    WINDOW_BYTES = None
+    QUEUE_SIZE = 16
+    QUEUE_DROP = DROP_OLDEST
+    # duplicates of packets handled within this time (ns) replay the recorded responses,
+    # None covers every retransmission of the peer, REQUEST_RETRIES backed off timeouts of at most RTO_MAX
+    DEDUP_TTL = None
+
     def __init__(self, client) -> None:
         self.client = client
-        self.requests: dict[int, list] = {}
+        # requestKey(peer, uniq) -> Request
+        self.requests: dict[int, Request] = {}
+        # (deadline, key), entries of acknowledged or rescheduled requests are skipped lazily
+        self.deadlines: list[tuple] = []
 
-    def checkRequestRetryCallback(self, request: list):
-        raise NotImplementedError
+        self.batch: list[bytes] = []
+        self.batchChannel = 0
+        self.batchSize = 0
+        self.batchStart = 0
+
+        self.srtt = None
+        self.rttvar = 0
+        self.rto = self.RTO_INITIAL
+
+        # random start, so a restarted node does not reuse uniqs still cached by its peers
+        self.nextUniq = getUniq()
+
+        # requests waiting for a free slot in the send window
+        self.queue: list[Request] = []
+        self.inFlightBytes = 0
+        self.queueDrops = 0
+        self.windowStalls = 0
+        self.maxQueueDepth = 0
+
+        dedupTTL = (REQUEST_RETRIES + 1) * self.RTO_MAX if self.DEDUP_TTL is None else self.DEDUP_TTL
+        self.responseCache = ResponseCache(DEDUP_SIZE, dedupTTL)
+        # requestKey ring of the last settled requests
+        self.settled = [None] * SETTLED_SIZE
+        self.settledIndex = 0
+
+        self.framesIn = 0
+        self.bytesIn = 0
+        self.framesOut = 0
+        self.bytesOut = 0
+        self.corrupted = 0
+        self.retries = 0
+        self.failed = 0
+        self.latency = [0] * (len(LATENCY_BUCKETS) + 1)
+        # (origin, uniq, cache entry) of the packet being handled
+        self.recording = None
+
+    def checkRequestRetryCallback(self, request: Request):
+        self.transmit(request.channel, request.raw)
+
+    def updateRTT(self, rtt: int) -> None:
+        # Jacobson/Karels estimator
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt // 2
+        else:
+            self.rttvar += (abs(self.srtt - rtt) - self.rttvar) // 4
+            self.srtt += (rtt - self.srtt) // 8
+
+        self.rto = min(self.RTO_MAX, max(self.RTO_MIN, self.srtt + 4 * self.rttvar))
+
+    def scheduleRequest(self, request: Request, now: int) -> None:
+        request.timestamp = now
+        rto = max(self.rto, REQUEST_MIN_TIMEOUTS.get(request.opcode, 0))
+        # exponential backoff for every retry
+        request.deadline = now + min(self.RTO_MAX, rto << request.retries)
+
+        heappush(self.deadlines, (request.deadline, request.key))
+
+        # drop stale entries once they dominate the heap
+        if len(self.deadlines) > 4 * len(self.requests) + 16:
+            self.deadlines = [(r.deadline, r.key) for r in self.requests.values()]
+            heapify(self.deadlines)
 
     def checkRequests(self):
         now = time_ns()
+        deadlines = self.deadlines
+
+        while len(deadlines) > 0 and deadlines[0][0] <= now:
+            deadline, key = heappop(deadlines)
+            request = self.requests.get(key)
+
+            if request is None or request.deadline != deadline:
+                continue
+
+            if request.retries >= REQUEST_RETRIES:
+                self.failed += 1
+                self.requests.pop(key)
+                self.inFlightBytes -= len(request.raw)
+                request.fail()
+                self.handleFailedRequest(request)
+                self.drainQueue()
+                continue
+
+            request.retries += 1
+            self.retries += 1
+            self.scheduleRequest(request, now)
+
+            self.checkRequestRetryCallback(request)
+            print(f'Request [{request.uniq}] timed out, retries [{request.retries}]')
+            request.timeout()
+
+    def watchRequest(self, request: Request) -> None:
+        self.requests[request.key] = request
+        self.inFlightBytes += len(request.raw)
+        self.scheduleRequest(request, time_ns())
+
+    def watchPacket(self, uniq: int, channel: int, packetRaw: bytes) -> Request:
+        # legacy entry point, watches an already packed frame, writePacket(..., important=True) does this itself
+        packet = PacketView(packetRaw)
+        request = Request(packet, packetRaw)
+        request.key = requestKey(packet.destination, uniq)
+        request.uniq = uniq
+        request.channel = channel
+
+        self.watchRequest(request)
+
+        return request
+
+    def windowOpen(self, size: int) -> bool:
+        if len(self.requests) == 0:
+            return True
+        if len(self.requests) >= self.WINDOW_SIZE:
+            return False
+
+        return self.WINDOW_BYTES is None or self.inFlightBytes + size <= self.WINDOW_BYTES
+
+    def queueRequest(self, request: Request) -> None:
+        self.windowStalls += 1
+
+        if len(self.queue) >= self.QUEUE_SIZE:
+            self.queueDrops += 1
+
+            if self.QUEUE_DROP == DROP_NEWEST:
+                print(f'Send queue full, dropping request [{request.uniq}]')
+                request.fail()
+                return
+
+            dropped = self.queue.pop(0)
+            print(f'Send queue full, dropping request [{dropped.uniq}]')
+            dropped.fail()
+
+        self.queue.append(request)
+        self.maxQueueDepth = max(self.maxQueueDepth, len(self.queue))
+
+    def drainQueue(self) -> None:
+        while len(self.queue) > 0 and self.windowOpen(len(self.queue[0].raw)):
+            request = self.queue.pop(0)
+            self.watchRequest(request)
+            self.sendRaw(request.channel, request.raw)
+
+    def recordLatency(self, ms: int) -> None:
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if ms <= bound:
+                self.latency[i] += 1
+                return
+
+        self.latency[-1] += 1
+
+    def linkStats(self) -> dict:
+        stats = self.windowStats()
+        stats['rx'] = [self.framesIn, self.bytesIn]
+        stats['tx'] = [self.framesOut, self.bytesOut]
+        stats['corrupted'] = self.corrupted
+        stats['retries'] = self.retries
+        stats['failed'] = self.failed
+        stats['latency'] = self.latency
+        stats['rto'] = self.rto // 1_000_000
+
+        return stats
+
+    def windowStats(self) -> dict:
+        return {
+            'inFlight': len(self.requests),
+            'inFlightBytes': self.inFlightBytes,
+            'queueDepth': len(self.queue),
+            'maxQueueDepth': self.maxQueueDepth,
+            'drops': self.queueDrops,
+            'stalls': self.windowStalls
+        }
+
+    def allocUniq(self, peer: int) -> int:
+        # sequential per link, uniqs still waiting for a reply from the same peer are skipped
+        for _ in range(65536):
+            uniq = self.nextUniq
+            self.nextUniq = (uniq + 1) & 0xFFFF
+
+            if requestKey(peer, uniq) not in self.requests:
+                return uniq
+
+        raise Exception('No free uniq left')
+
+    def ackRequest(self, origin: int, uniq: int, response=None):
+        # the heap entry is left behind and skipped once it expires
+        request = self.requests.pop(requestKey(origin, uniq), None)
+
+        if request is None:
+            return None
+
+        self.inFlightBytes -= len(request.raw)
+
+        # retransmitted requests are ambiguous, they are not sampled (Karn's algorithm)
+        if request.retries == 0:
+            rtt = time_ns() - request.timestamp
+            self.recordLatency(rtt // 1_000_000)
+
+            if request.opcode not in REQUEST_MIN_TIMEOUTS:
+                self.updateRTT(rtt)
+
+        # kept by the request, so it must not point into the receive buffer
+        if isinstance(response, PacketView):
+            response = response.copy()
+
+        self.settled[self.settledIndex] = request.key
+        self.settledIndex = (self.settledIndex + 1) % SETTLED_SIZE
+
+        request.resolve(response)
+        self.drainQueue()
+
+        return request
+
+    def inFlight(self, opcode: int) -> int:
+        # queued requests count as well, they are sent as soon as the window opens
+        count = 0
+
+        for request in self.requests.values():
+            if request.opcode == opcode:
+                count += 1
+
+        for request in self.queue:
+            if request.opcode == opcode:
+                count += 1
+
+        return count
+
+    def handleRequest(self, packet, handler) -> None:
+        # replies are never retransmitted by the peer and never cached,
+        # and a peer request reusing one of our uniqs never settles our request
+        if packet.opcode in REPLIES:
+            if self.ackRequest(packet.origin, packet.uniq, packet) is None:
+                if requestKey(packet.origin, packet.uniq) in self.settled:
+                    # the peer answered a retransmission of a request it had already answered
+                    print(f'Duplicate reply [{packet.uniq}], dropped')
+                    return
+
+            handler(packet)
+            return
+
+        # a retransmitted request replays the responses it got the first time instead of running the handler again
+        key = (packet.origin, packet.uniq, packet.opcode)
+        now = time_ns()
+        responses = self.responseCache.lookup(key, now)
 
-        for uniq, request in self.requests.items():
-            if now >= request[1] + 3_000_000_000:
-                if request[2] >= 3:
-                    self.handleFailedRequest(request)
-                    try:
-                        self.requests.pop(uniq)
-                    except KeyError:
-                        pass
-                    continue
+        if responses is not None:
+            print(f'Duplicate packet [{packet.uniq}], replaying {len(responses)} responses')
 
-                request[2] += 1
-                request[1] = now
+            for channel, packetRaw in responses:
+                self.sendRaw(channel, packetRaw)
 
-                self.checkRequestRetryCallback(request)
-                print(f'Request [{uniq}] timed out, retries [{request[2]}]')
+            return
+
+        self.recording = (packet.origin, packet.uniq, self.responseCache.add(key, now))
+
+        try:
+            handler(packet)
+        finally:
+            self.recording = None
+
+    def recordResponse(self, packet: Packet, packetRaw: bytes) -> None:
+        origin, uniq, entry = self.recording
+
+        if packet.destination != origin or packet.uniq != uniq:
+            return
+
+        self.responseCache.record(entry, packet.channel, packetRaw)
+
+    def writePacket(self, packet: Packet, important=False) -> Request | None:
+        # packet is either a Packet or a received PacketView being forwarded
+        if packet.uniq is NEW_UNIQ:
+            packet.uniq = self.allocUniq(packet.destination)
+
+        packetRaw = packPacket(packet, self.WIRE_VERSION)
+
+        if self.recording is not None:
+            self.recordResponse(packet, packetRaw)
+
+        if not important:
+            self.sendRaw(packet.channel, packetRaw)
+            return None
+
+        request = Request(packet, packetRaw)
+
+        if len(self.queue) > 0 or not self.windowOpen(len(packetRaw)):
+            self.queueRequest(request)
+            return request
+
+        self.watchRequest(request)
+        self.sendRaw(packet.channel, packetRaw)
 
-    def watchPacket(self, uniq: int, channel: int, packetRaw: bytes) -> None:
-        self.requests[uniq] = [uniq, time_ns(), 0, channel, packetRaw]
+        return request
 
-    def writePacket(self, packet: list, important=False) -> None:
+    def sendRaw(self, channel: int, packetRaw: bytes) -> None:
+        if self.BATCH_WINDOW is None:
+            self.transmit(channel, packetRaw)
+        else:
+            self.queuePacket(channel, packetRaw)
+
+    def transmit(self, channel: int, packetRaw: bytes) -> None:
+        self.framesOut += 1
+        self.bytesOut += len(packetRaw)
+        self.writeRaw(channel, packetRaw)
+
+    def writeRaw(self, channel: int, packetRaw: bytes) -> None:
         raise NotImplementedError
 
-        # packetRaw = packData(packet)
+    def queuePacket(self, channel: int, packetRaw: bytes) -> None:
+        if len(self.batch) > 0:
+            if channel != self.batchChannel or batchSize(self.batchSize + len(packetRaw), len(self.batch) + 1) > MAX_PACKET_SIZE:
+                self.flush()
+
+        if len(self.batch) == 0:
+            self.batchChannel = channel
+            self.batchStart = time_ns()
+
+        self.batch.append(packetRaw)
+        self.batchSize += len(packetRaw)
 
-        # if important:
-        #     self.watchPacket(packet[3], packet[4], packetRaw)
+    def flush(self) -> None:
+        if len(self.batch) == 0:
+            return
+
+        if len(self.batch) == 1:
+            self.transmit(self.batchChannel, self.batch[0])
+        else:
+            self.transmit(self.batchChannel, packBatch(self.batch))
 
-        # self.client.write(packetRaw)
+        self.batch = []
+        self.batchSize = 0
+
+    def checkTX(self) -> None:
+        if len(self.batch) > 0 and time_ns() >= self.batchStart + self.BATCH_WINDOW:
+            self.flush()
 
     def checkRX(self) -> None:
         raise NotImplementedError
@@ -58,34 +513,27 @@ class BaseClient:
     def handleRX(self, *args) -> None:
         raise NotImplementedError
 
-    def handleFailedRequest(self, request: list) -> None:
-        print(f'Request [{request[0]}] failed, running cleanup')
+    def handleFailedRequest(self, request: Request) -> None:
+        print(f'Request [{request.uniq}] failed, running cleanup')
 
 
 def genericRXHandler(fn):
-    def wrapper(self):
-        data = self.readPacket()
-
-        if data is None:
-            return
+    def wrapper(self, data, end=None):
+        self.framesIn += 1
+        self.bytesIn += len(data) if end is None else end
 
         try:
-            packet = unpackData(data)
-            fn(self, packet)
+            for frame, frameEnd in splitFrames(data, end):
+                try:
+                    packet = PacketView(frame, frameEnd)
+                    fn(self, packet)
+                except Exception as e:
+                    self.corrupted += 1
+                    print(e)
+                    print('[genericRX] Corrupted packet:', bytes(frame))
         except Exception as e:
+            self.corrupted += 1
             print(e)
-            print('[genericRX] Corrupted packet:', data)
-
-    return wrapper
-
-
-def genericWritePacket(fn):
-    def wrapper(self, packet: list, important=False):
-        packetRaw = packData(flatten(packet))
-
-        if important:
-            self.watchPacket(packet[3], packet[4], packetRaw)
-
-        fn(self, packet, packetRaw)
+            print('[genericRX] Corrupted batch:', bytes(data))
 
     return wrapper
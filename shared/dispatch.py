@@ -0,0 +1,70 @@
+from shared.opcodes import ERR_INVALID_DATA, ERR_REQUEST_FAILED, ERR_UNSUPPORTED_OPCODE
+from shared.types import Packet
+
+
+try:
+    from micropython import const  # check if running in micropython
+    from shared.utils import time_ns
+
+    del const
+except ModuleNotFoundError as e:
+    from time import time_ns
+
+
+ERRORS = (ERR_UNSUPPORTED_OPCODE, ERR_INVALID_DATA, ERR_REQUEST_FAILED)
+
+
+class Dispatcher:
+    # opcode -> handler(owner, packet), filled with the on() decorator in the class body
+    def __init__(self):
+        self.handlers = {}
+        # opcode -> [calls, total handler time in ns]
+        self.counters = {}
+
+    def on(self, *opcodes: int):
+        def register(fn):
+            for opcode in opcodes:
+                self.register(opcode, fn)
+
+            return fn
+
+        return register
+
+    def register(self, opcode: int, fn) -> None:
+        if opcode in self.handlers:
+            raise Exception(f'Opcode [{opcode}] already has a handler')
+
+        self.handlers[opcode] = fn
+        self.counters[opcode] = [0, 0]
+
+    def dispatch(self, owner, packet) -> bool:
+        opcode = packet.opcode
+        handler = self.handlers.get(opcode)
+
+        if handler is None:
+            return False
+
+        start = time_ns()
+
+        try:
+            handler(owner, packet)
+        finally:
+            counter = self.counters[opcode]
+            counter[0] += 1
+            counter[1] += time_ns() - start
+
+        return True
+
+    def stats(self) -> dict:
+        # opcode -> [calls, total handler time in us], keys are strings so micropython's json stays valid
+        return {str(opcode): [c[0], c[1] // 1_000] for opcode, c in self.counters.items() if c[0] > 0}
+
+
+def unsupported(packet):
+    # reply for packets without a handler, errors are never answered to avoid loops between nodes
+    if packet.opcode in ERRORS:
+        print(f'Received error [{packet.opcode}] for request [{packet.uniq}]')
+        return None
+
+    print(f'Unsupported opcode [{packet.opcode}]')
+    return Packet(ERR_UNSUPPORTED_OPCODE, packet.destination, packet.origin, packet.uniq, packet.channel)
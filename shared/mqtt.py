@@ -1,17 +1,19 @@
-from shared.baseClient import BaseClient, genericWritePacket
+from shared.baseClient import BaseClient
+from shared.packets import WIRE_V1
 from shared.mqttUtils import PUBLIC_OUT, picoOut
 from shared.routes import PUBLIC
 
 
 class MQTT(BaseClient):
-    def checkRequestRetryCallback(self, request: list):
-        channel = PUBLIC_OUT if request[3] == PUBLIC else picoOut(self.client.client_id)
-        self.client.publish(channel, request[4])
+    # fleet-commander only decodes the legacy format, packets written within one loop pass
+    # are published as a single batch message
+    WIRE_VERSION = WIRE_V1
+    BATCH_WINDOW = 0
+    RTO_MIN = 500_000_000
 
-    @genericWritePacket
-    def writePacket(self, packet: list, packetRaw: bytes):
-        channel = PUBLIC_OUT if packet[4] == PUBLIC else picoOut(self.client.client_id)
-        self.client.publish(channel, packetRaw)
+    def writeRaw(self, channel: int, packetRaw: bytes) -> None:
+        topic = PUBLIC_OUT if channel == PUBLIC else picoOut(self.client.client_id)
+        self.client.publish(topic, packetRaw)
 
     def checkRX(self) -> None:
         self.client.check_msg()
@@ -10,6 +10,9 @@ GET_POWER_STATUS = 14
 GET_HDD_ACTIVITY = 15
 GET_MQTT_STATUS = 16
 GET_AMBIENT_TEMP = 17
+GET_SENSORS_DELTA = 18
+GET_STATS = 19
+GET_SENSOR_HISTORY = 20
 
 SYSINFO_DATA = 21
 SENSOR_DATA = 22
@@ -18,6 +21,10 @@ POWER_STATUS_DATA = 24
 HDD_ACTIVITY_DATA = 25
 MQTT_STATUS_DATA = 26
 AMBIENT_TEMP_DATA = 27
+SENSOR_DELTA_DATA = 28
+SYSINFO_CHUNK = 29
+STATS_DATA = 30
+SENSOR_HISTORY_DATA = 31
 
 COMM_POWER = 50
 COMM_RESET = 51
@@ -1,8 +1,31 @@
 from shared.opcodes import PACKET_STOP
+from shared.schemas import LENGTH, getSchema
+from shared.utils import compileStruct
 import struct
 
 
-def packDataRaw(packetFormat: str, data: list):
+PLAN_CACHE_SIZE = 32
+MAX_PACKET_SIZE = 1024
+
+# legacy frames start with their ASCII struct header, so their first byte is always a digit
+WIRE_V1 = 1
+WIRE_V2 = 2
+WIRE_BATCH = 3
+# marker byte, COBS encoded frame without its stop marker, single zero delimiter
+WIRE_COBS = 4
+
+FRAMING_STOP = 0
+FRAMING_COBS = 1
+COBS_DELIMITER = b'\0'
+
+# version, schema id, opcode, origin, destination, uniq, channel
+V2_HEADER = compileStruct('<BBBBBHB')
+# version, packet count, then every packet without its stop marker prefixed with a 16 bit length
+BATCH_HEADER = compileStruct('<BB')
+MAX_BATCH_PACKETS = 255
+
+
+def headerFormat(packetFormat: str) -> str:
     headerSize = len(packetFormat) + 1
     headerSize += len(str(headerSize))
 
@@ -10,60 +33,182 @@ def packDataRaw(packetFormat: str, data: list):
     while headerSize < len(f'{headerSize}s' + packetFormat):
         headerSize += 1
 
-    packetFormat = f'{headerSize}s' + packetFormat
+    return f'{headerSize}s' + packetFormat
+
+
+# legacy struct code of every type/range signature entry, strings are stored as their negated length
+SIGNATURE_CODES = 'BbHhifh'
+SIG_FLOAT = 5
+SIG_BOOL = 6
+
+
+def signatureFormat(signature: tuple) -> str:
+    return ''.join([SIGNATURE_CODES[c] if c >= 0 else f'{~c}s' for c in signature])
+
+
+class PackPlan:
+    def __init__(self, packetFormat: str):
+        packetFormat = headerFormat(packetFormat)
+
+        self.header = bytes(packetFormat, 'utf-8')
+        self.struct = compileStruct(packetFormat)
+
+    def pack(self, data: list) -> bytes:
+        return self.struct.pack(self.header, *data) + PACKET_STOP
+
+
+class PlanCache:
+    # type/range signature -> PackPlan, the format string is only built on a miss
+    def __init__(self, size: int):
+        self.size = size
+        self.plans = {}
+        self.order = []
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, signature: tuple) -> PackPlan:
+        plan = self.plans.get(signature)
+
+        if plan is not None:
+            self.hits += 1
+            return plan
+
+        self.misses += 1
+        plan = PackPlan(signatureFormat(signature))
+
+        if len(self.order) >= self.size:
+            self.plans.pop(self.order.pop(0))
+            self.evictions += 1
+
+        self.plans[signature] = plan
+        self.order.append(signature)
+
+        return plan
+
+    def clear(self):
+        self.plans = {}
+        self.order = []
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self.order),
+            'capacity': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+
+planCache = PlanCache(PLAN_CACHE_SIZE)
+
+
+def getPlanCacheStats() -> dict:
+    return planCache.stats()
+
+
+def packDataRaw(packetFormat: str, data: list):
+    return PackPlan(packetFormat).pack(data)
+
 
-    header = bytearray(packetFormat, 'utf-8')
-    packet = struct.pack(packetFormat, header, *data)
+def packFieldsV2(opcode: int, origin: int, destination: int, uniq: int, channel: int, data: list, offset: int):
+    schema = getSchema(opcode)
 
-    return packet + PACKET_STOP
+    if schema is None:
+        return None
 
+    try:
+        parts = schema.encode(data, offset)
+    except Exception:
+        return None
 
-def packData(data: list):
-    packetFormat = ''
+    parts.insert(0, V2_HEADER.pack(WIRE_V2, schema.id, opcode, origin, destination, uniq, channel))
+    parts.append(PACKET_STOP)
+
+    return b''.join(parts)
+
+
+def packDataV2(data: list):
+    return packFieldsV2(data[0], data[1], data[2], data[3], data[4], data, 5)
+
+
+def packData(data: list, version: int = WIRE_V1):
+    if version == WIRE_V2:
+        # opcodes without a matching schema fall back to the legacy format
+        packet = packDataV2(data)
+
+        if packet is not None:
+            return packet
+
+    signature = []
 
     for i, d in enumerate(data):
         t = type(d)
 
-        if t == float:
-            packetFormat += 'f'
-        elif t == int:
+        if t == int:
             if d < 256 and d >= 0:
-                packetFormat += 'B'
+                signature.append(0)
             elif d < 127 and d >= -128:
-                packetFormat += 'b'
+                signature.append(1)
             elif d < 65536 and d >= 0:
-                packetFormat += 'H'
+                signature.append(2)
             elif d < 32768 and d >= -32768:
-                packetFormat += 'h'
+                signature.append(3)
             else:
-                packetFormat += 'i'
+                signature.append(4)
+        elif t == float:
+            signature.append(SIG_FLOAT)
         elif t == bool:
-            packetFormat += 'h'
+            signature.append(SIG_BOOL)
         else:
             if t == str:
-                data[i] = data[i].encode('utf-8')
+                d = data[i] = d.encode('utf-8')
 
-            packetFormat += f'{len(d)}s'
+            signature.append(~len(d))
 
-    return packDataRaw(packetFormat, data)
+    return planCache.get(tuple(signature)).pack(data)
 
 
-def unpackDataRaw(packet) -> tuple:
-    headerSize = int(packet[0:packet.find(b's')])
-    header = packet[0:headerSize].decode('utf-8')
-    data = struct.unpack(header, packet[:-len(PACKET_STOP)])
+def packPacket(packet, version: int = WIRE_V1):
+    # packet data is encoded straight from the packet, only the legacy format needs a flat copy
+    if version == WIRE_V2:
+        if isinstance(packet, PacketView) and packet.schema is not None:
+            # forwarded v2 frames are copied as received instead of being decoded and encoded again
+            return packet.raw()
 
-    # print('Opcode', opcode)
-    # print('Header Size', headerSize)
-    # print('Header', header)
-    # print('Data', data)
+        packetRaw = packFieldsV2(packet.opcode, packet.origin, packet.destination, packet.uniq, packet.channel,
+                                 packet.data, 0)
 
-    return data
+        if packetRaw is not None:
+            return packetRaw
 
+    return packData([packet.opcode, packet.origin, packet.destination, packet.uniq, packet.channel] + packet.data)
 
-def unpackData(packet: bytes) -> list:
-    data = unpackDataRaw(packet)
 
+def legacyHeader(packet) -> str:
+    # the header starts with its own size, digits are read one by one so memoryviews need no copy
+    headerSize = 0
+    i = 0
+
+    while packet[i] != 0x73:  # s
+        digit = packet[i] - 0x30
+
+        if digit < 0 or digit > 9 or i > 4:
+            raise Exception('Invalid packet, malformed header')
+
+        headerSize = headerSize * 10 + digit
+        i += 1
+
+    return bytes(packet[0:headerSize]).decode('utf-8')
+
+
+def unpackDataRaw(packet) -> tuple:
+    # works on bytes and memoryviews, the trailing stop marker is ignored by unpack_from
+    return struct.unpack_from(legacyHeader(packet), packet, 0)
+
+
+def checkLegacyData(data: tuple) -> tuple:
     if len(data) < 6:
         raise Exception('Invalid packet, too few arguments')
 
@@ -78,4 +223,251 @@ def unpackData(packet: bytes) -> list:
     if not isinstance(data[5], int):
         raise Exception('Invalid packet, channel is not an int')
 
+    return data
+
+
+def unpackDataV2(packet: bytes) -> list:
+    end = len(packet) - len(PACKET_STOP)
+
+    if end < V2_HEADER.size:
+        raise Exception('Invalid packet, too few arguments')
+
+    _, schemaId, opcode, origin, destination, uniq, channel = V2_HEADER.unpack_from(packet, 0)
+    schema = getSchema(opcode)
+
+    if schema is None:
+        raise Exception(f'Invalid packet, no schema for opcode [{opcode}]')
+    if schema.id != schemaId:
+        raise Exception(f'Invalid packet, schema mismatch [{schemaId}] != [{schema.id}]')
+
+    return [opcode, origin, destination, uniq, channel, schema.decode(packet, V2_HEADER.size, end)]
+
+
+def unpackData(packet: bytes) -> list:
+    if packet[0] == WIRE_V2:
+        return unpackDataV2(packet)
+
+    data = checkLegacyData(unpackDataRaw(packet))
+
     return [data[1], data[2], data[3], data[4], data[5], list(data[6:])]
+
+
+class PacketView:
+    # header fields are read straight from the receive buffer (bytes or a memoryview of it),
+    # v2 data and every field of a legacy frame are decoded on first access
+    __slots__ = ('buffer', 'end', 'schema', 'fields', 'payload')
+
+    def __init__(self, buffer, end: int | None = None):
+        self.buffer = buffer
+        self.end = len(buffer) - len(PACKET_STOP) if end is None else end
+        self.fields = None
+        self.payload = None
+
+        if buffer[0] != WIRE_V2:
+            self.schema = None
+            return
+
+        if self.end < V2_HEADER.size:
+            raise Exception('Invalid packet, too few arguments')
+
+        schema = getSchema(buffer[2])
+
+        if schema is None:
+            raise Exception(f'Invalid packet, no schema for opcode [{buffer[2]}]')
+        if schema.id != buffer[1]:
+            raise Exception(f'Invalid packet, schema mismatch [{buffer[1]}] != [{schema.id}]')
+
+        self.schema = schema
+
+    def legacy(self) -> tuple:
+        # (header, opcode, origin, destination, uniq, channel, data...) of a legacy frame
+        if self.fields is None:
+            self.fields = checkLegacyData(unpackDataRaw(self.buffer))
+
+        return self.fields
+
+    @property
+    def opcode(self) -> int:
+        if self.schema is None:
+            return self.legacy()[1]
+
+        return self.buffer[2]
+
+    @property
+    def origin(self) -> int:
+        if self.schema is None:
+            return self.legacy()[2]
+
+        return self.buffer[3]
+
+    @property
+    def destination(self) -> int:
+        if self.schema is None:
+            return self.legacy()[3]
+
+        return self.buffer[4]
+
+    @property
+    def uniq(self) -> int:
+        if self.schema is None:
+            return self.legacy()[4]
+
+        return self.buffer[5] | (self.buffer[6] << 8)
+
+    @property
+    def channel(self) -> int:
+        if self.schema is None:
+            return self.legacy()[5]
+
+        return self.buffer[7]
+
+    @property
+    def data(self) -> list:
+        if self.payload is None:
+            if self.schema is None:
+                self.payload = list(self.legacy()[6:])
+            else:
+                self.payload = self.schema.decode(self.buffer, V2_HEADER.size, self.end)
+
+        return self.payload
+
+    def raw(self) -> bytes:
+        return bytes(self.buffer[0:self.end]) + PACKET_STOP
+
+    def copy(self):
+        # view over its own bytes, the receive buffer is reused by the next read
+        view = PacketView(self.raw(), self.end)
+        view.fields = self.fields
+        view.payload = self.payload
+
+        return view
+
+    def __getitem__(self, i: int):
+        if i == 5:
+            return self.data
+        if i == 0:
+            return self.opcode
+        if i == 1:
+            return self.origin
+        if i == 2:
+            return self.destination
+        if i == 3:
+            return self.uniq
+        if i == 4:
+            return self.channel
+
+        raise IndexError('Packet index out of range')
+
+    def __len__(self) -> int:
+        return 6
+
+    def __iter__(self):
+        for i in range(6):
+            yield self[i]
+
+    def __repr__(self) -> str:
+        return str(list(self))
+
+
+def batchSize(packetsSize: int, count: int) -> int:
+    return BATCH_HEADER.size + packetsSize + count * (LENGTH.size - len(PACKET_STOP)) + len(PACKET_STOP)
+
+
+def packBatch(packets: list) -> bytes:
+    if len(packets) > MAX_BATCH_PACKETS:
+        raise Exception(f'Batch exceeded {MAX_BATCH_PACKETS} packets')
+
+    parts = [BATCH_HEADER.pack(WIRE_BATCH, len(packets))]
+
+    for p in packets:
+        parts.append(LENGTH.pack(len(p) - len(PACKET_STOP)))
+        parts.append(memoryview(p)[:-len(PACKET_STOP)])
+
+    parts.append(PACKET_STOP)
+
+    return b''.join(parts)
+
+
+def splitFrames(buffer, end: int | None = None):
+    # yields (frame, end) for every packet, batch frames are split into their packets
+    buffer = memoryview(buffer)
+
+    if end is None:
+        end = len(buffer) - len(PACKET_STOP)
+
+    if buffer[0] != WIRE_BATCH:
+        yield buffer, end
+        return
+
+    count = buffer[1]
+    offset = BATCH_HEADER.size
+
+    for _ in range(count):
+        size = LENGTH.unpack_from(buffer, offset)[0]
+        offset += LENGTH.size
+
+        if offset + size > end:
+            raise Exception('Invalid batch, packet exceeds frame')
+
+        yield buffer[offset:offset + size], size
+        offset += size
+
+
+def cobsEncode(data: bytes, end: int | None = None) -> bytearray:
+    # runs between zero bytes are found with bytes.find, so the loop only runs per block
+    if end is None:
+        end = len(data)
+
+    out = bytearray()
+    i = 0
+
+    while True:
+        j = data.find(COBS_DELIMITER, i, end)
+
+        if j < 0:
+            j = end
+
+        while j - i >= 254:
+            out.append(0xFF)
+            out += data[i:i + 254]
+            i += 254
+
+        out.append(j - i + 1)
+        out += data[i:j]
+
+        if j == end:
+            return out
+
+        i = j + 1
+
+
+def cobsDecode(buffer, start: int, end: int) -> int:
+    # decodes buffer[start:end] in place and returns the decoded length
+    r = start
+    w = start
+
+    while r < end:
+        code = buffer[r]
+        r += 1
+
+        if code == 0 or r + code - 1 > end:
+            raise Exception('Invalid COBS frame')
+
+        n = code - 1
+        buffer[w:w + n] = buffer[r:r + n]
+        w += n
+        r += n
+
+        if code != 0xFF and r < end:
+            buffer[w] = 0
+            w += 1
+
+    return w - start
+
+
+def cobsFrame(packetRaw: bytes) -> bytearray:
+    encoded = cobsEncode(packetRaw, len(packetRaw) - len(PACKET_STOP))
+    encoded.insert(0, WIRE_COBS)
+    encoded.append(0)
+
+    return encoded
@@ -0,0 +1,114 @@
+try:
+    from micropython import const  # check if running in micropython
+    from time import sleep_ms, ticks_add, ticks_diff, ticks_ms
+
+    del const
+except ModuleNotFoundError as e:
+    import time
+
+    # same wrap around as the micropython ms ticks
+    TICKS_PERIOD = 1 << 30
+    TICKS_MAX = TICKS_PERIOD - 1
+    TICKS_HALF = TICKS_PERIOD >> 1
+
+    def ticks_ms() -> int:
+        return (time.monotonic_ns() // 1_000_000) & TICKS_MAX
+
+    def ticks_add(ticks: int, delta: int) -> int:
+        return (ticks + delta) & TICKS_MAX
+
+    def ticks_diff(a: int, b: int) -> int:
+        return ((a - b + TICKS_HALF) & TICKS_MAX) - TICKS_HALF
+
+    def sleep_ms(ms: int) -> None:
+        time.sleep(ms / 1000)
+
+
+MAX_SLEEP = 1_000  # ms, upper bound of a single idle sleep
+
+
+class Task:
+    __slots__ = ('name', 'fn', 'period', 'deadline', 'runs', 'overruns', 'maxLate')
+
+    def __init__(self, name: str, fn, period: int, deadline: int):
+        self.name = name
+        self.fn = fn
+        self.period = period
+        self.deadline = deadline
+
+        self.runs = 0
+        # periods skipped because the task started a whole period late
+        self.overruns = 0
+        # ms, the latest start after a deadline
+        self.maxLate = 0
+
+
+class Scheduler:
+    # cooperative, due tasks run in the order they were added, so tasks sharing
+    # a period run in the same pass (poll RX first, flush TX last)
+    def __init__(self, maxSleep: int = MAX_SLEEP):
+        self.tasks: list[Task] = []
+        self.maxSleep = maxSleep
+
+        # ms spent in tasks and sleeping
+        self.busy = 0
+        self.idle = 0
+
+    def every(self, name: str, period: int, fn, delay: int = 0) -> Task:
+        task = Task(name, fn, period, ticks_add(ticks_ms(), delay))
+        self.tasks.append(task)
+
+        return task
+
+    def runPending(self) -> None:
+        start = ticks_ms()
+
+        try:
+            for task in self.tasks:
+                late = ticks_diff(ticks_ms(), task.deadline)
+
+                if late < 0:
+                    continue
+
+                # deadlines advance by whole periods, missed ones are skipped instead of run back to back
+                missed = late // task.period
+                task.deadline = ticks_add(task.deadline, (missed + 1) * task.period)
+                task.overruns += missed
+                task.runs += 1
+
+                if late > task.maxLate:
+                    task.maxLate = late
+
+                task.fn()
+        finally:
+            self.busy += ticks_diff(ticks_ms(), start)
+
+    def untilNext(self) -> int:
+        now = ticks_ms()
+        wait = self.maxSleep
+
+        for task in self.tasks:
+            wait = min(wait, ticks_diff(task.deadline, now))
+
+        return max(0, wait)
+
+    def sleep(self) -> None:
+        start = ticks_ms()
+        wait = self.untilNext()
+
+        if wait > 0:
+            sleep_ms(wait)
+
+        self.idle += ticks_diff(ticks_ms(), start)
+
+    def run(self) -> None:
+        while True:
+            self.runPending()
+            self.sleep()
+
+    def stats(self) -> dict:
+        return {
+            'busy': self.busy,
+            'idle': self.idle,
+            'tasks': {t.name: [t.runs, t.overruns, t.maxLate] for t in self.tasks}
+        }
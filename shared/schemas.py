@@ -0,0 +1,201 @@
+from shared.opcodes import (
+    AMBIENT_TEMP_DATA, COMM_POWER, COMM_RESET, COMM_SLEEP, ENCODER_LEFT, ENCODER_PRESSED, ENCODER_RIGHT,
+    ERR_INVALID_DATA, ERR_REQUEST_FAILED, ERR_UNSUPPORTED_OPCODE, GET_AMBIENT_TEMP, GET_HDD_ACTIVITY,
+    GET_MQTT_STATUS, GET_POWER_STATUS, GET_SENSOR_HISTORY, GET_SENSORS, GET_SENSORS_DELTA, GET_STATS,
+    GET_SYSINFO, GET_WIFI, HDD_ACTIVITY_DATA, MQTT_STATUS_DATA, OK, PING, PONG, POWER_STATUS_DATA, REGISTER,
+    REGISTERED, REGISTRATION_DATA, SENSOR_DATA, SENSOR_DELTA_DATA, SENSOR_HISTORY_DATA, STATS_DATA,
+    SYSINFO_CHUNK, SYSINFO_DATA, SYSINFO_OK, UPDATE_SYSINFO, WIFI_DATA)
+from shared.utils import compileStruct
+
+
+# field codes:
+#   struct codes (B, b, H, h, i, f) - fixed size values
+#   z - bytes / str prefixed with a 16 bit length
+#   n - tail only, mixed ints and floats, each sent in its smallest type
+#       after a 2 bit per value type map (B, h, i, f)
+#   * - the following field repeats until the end of the packet,
+#       prefixed with a 16 bit count
+
+LENGTH = compileStruct('<H')
+NUMBER_TYPES = 'Bhif'
+NUMBER_CACHE_SIZE = 16
+
+
+class Schema:
+    def __init__(self, schemaId: int, fields: str):
+        self.id = schemaId
+        self.fields = fields
+        self.tail = None
+
+        if '*' in fields:
+            self.tail = fields[fields.index('*') + 1]
+            fields = fields[:fields.index('*')]
+
+        # consecutive fixed size fields are packed with a single struct
+        self.segments = []
+        fixed = ''
+
+        for f in fields:
+            if f == 'z':
+                if fixed != '':
+                    self.segments.append((fixed, compileStruct('<' + fixed)))
+                    fixed = ''
+
+                self.segments.append(('z', None))
+            else:
+                fixed += f
+
+        if fixed != '':
+            self.segments.append((fixed, compileStruct('<' + fixed)))
+
+        self.size = len(fields)
+        self.numberStructs = {}
+
+    def numberStruct(self, typeMap: bytes, count: int):
+        s = self.numberStructs.get((count, typeMap))
+
+        if s is None:
+            if len(self.numberStructs) >= NUMBER_CACHE_SIZE:
+                self.numberStructs = {}
+
+            s = compileStruct('<' + ''.join([
+                NUMBER_TYPES[(typeMap[i >> 2] >> ((i & 3) * 2)) & 3] for i in range(count)
+            ]))
+            self.numberStructs[(count, typeMap)] = s
+
+        return s
+
+    def encodeNumbers(self, values: list) -> list:
+        typeMap = bytearray((len(values) + 3) // 4)
+
+        for i, v in enumerate(values):
+            if isinstance(v, float):
+                code = 3
+            elif 0 <= v < 256:
+                code = 0
+            elif -32768 <= v < 32768:
+                code = 1
+            else:
+                code = 2
+
+            typeMap[i >> 2] |= code << ((i & 3) * 2)
+
+        typeMap = bytes(typeMap)
+        return [typeMap, self.numberStruct(typeMap, len(values)).pack(*values)]
+
+    def encode(self, data: list, offset: int) -> list:
+        parts = []
+
+        if self.tail is None and len(data) - offset != self.size:
+            raise Exception('Invalid packet, data does not match schema')
+
+        for fields, s in self.segments:
+            if s is None:
+                value = data[offset]
+
+                if isinstance(value, str):
+                    value = value.encode('utf-8')
+
+                parts.append(LENGTH.pack(len(value)))
+                parts.append(value)
+                offset += 1
+            else:
+                parts.append(s.pack(*data[offset:offset + len(fields)]))
+                offset += len(fields)
+
+        if self.tail is not None:
+            count = len(data) - offset
+            parts.append(LENGTH.pack(count))
+
+            if self.tail == 'z':
+                for value in data[offset:]:
+                    if isinstance(value, str):
+                        value = value.encode('utf-8')
+
+                    parts.append(LENGTH.pack(len(value)))
+                    parts.append(value)
+            elif self.tail == 'n':
+                parts += self.encodeNumbers(data[offset:])
+            elif count > 0:
+                parts.append(compileStruct(f'<{count}{self.tail}').pack(*data[offset:]))
+
+        return parts
+
+    def decode(self, packet, offset: int, end: int) -> list:
+        data = []
+
+        for fields, s in self.segments:
+            if s is None:
+                size = LENGTH.unpack_from(packet, offset)[0]
+                offset += 2
+                data.append(bytes(packet[offset:offset + size]))
+                offset += size
+            else:
+                data += s.unpack_from(packet, offset)
+                offset += s.size
+
+        if self.tail is not None:
+            count = LENGTH.unpack_from(packet, offset)[0]
+            offset += 2
+
+            if self.tail == 'z':
+                for _ in range(count):
+                    size = LENGTH.unpack_from(packet, offset)[0]
+                    offset += 2
+                    data.append(bytes(packet[offset:offset + size]))
+                    offset += size
+            elif count > 0:
+                if self.tail == 'n':
+                    size = (count + 3) // 4
+                    s = self.numberStruct(bytes(packet[offset:offset + size]), count)
+                    offset += size
+                else:
+                    s = compileStruct(f'<{count}{self.tail}')
+
+                data += s.unpack_from(packet, offset)
+                offset += s.size
+
+        if offset != end:
+            raise Exception('Invalid packet, data does not match schema')
+
+        return data
+
+
+SCHEMAS: dict[int, Schema] = {}
+OPCODE_SCHEMAS: dict[int, Schema] = {}
+
+
+def registerSchema(schemaId: int, fields: str, *opcodes: int) -> Schema:
+    if schemaId in SCHEMAS:
+        raise Exception(f'Schema [{schemaId}] already registered')
+
+    schema = Schema(schemaId, fields)
+    SCHEMAS[schemaId] = schema
+
+    for opcode in opcodes:
+        OPCODE_SCHEMAS[opcode] = schema
+
+    return schema
+
+
+def getSchema(opcode: int) -> Schema | None:
+    return OPCODE_SCHEMAS.get(opcode)
+
+
+# schema ids are part of the wire format, never reuse an id for a different layout
+registerSchema(1, '',
+               GET_WIFI, GET_POWER_STATUS, GET_HDD_ACTIVITY, GET_MQTT_STATUS, GET_AMBIENT_TEMP, GET_STATS,
+               COMM_POWER, COMM_RESET, COMM_SLEEP, ENCODER_LEFT, ENCODER_RIGHT, ENCODER_PRESSED,
+               OK, SYSINFO_OK, PING, PONG, REGISTER, REGISTERED,
+               ERR_UNSUPPORTED_OPCODE, ERR_INVALID_DATA, ERR_REQUEST_FAILED)
+registerSchema(2, '*z', UPDATE_SYSINFO, GET_SYSINFO)
+registerSchema(3, 'z', SYSINFO_DATA, STATS_DATA)
+registerSchema(4, 'z*n', SENSOR_DATA)
+registerSchema(5, 'B', WIFI_DATA, POWER_STATUS_DATA, MQTT_STATUS_DATA)
+registerSchema(6, '*B', HDD_ACTIVITY_DATA)
+registerSchema(7, 'f', AMBIENT_TEMP_DATA)
+registerSchema(8, 'zz', REGISTRATION_DATA)
+registerSchema(9, '*H', GET_SENSORS, GET_SENSORS_DELTA, GET_SENSOR_HISTORY)
+registerSchema(10, 'zHz*n', SENSOR_DELTA_DATA)
+registerSchema(11, 'zHHz', SYSINFO_CHUNK)
+registerSchema(12, 'zHH*n', SENSOR_HISTORY_DATA)
@@ -0,0 +1,161 @@
+from array import array
+from shared.sensors import SCALAR_SENSORS
+
+
+HISTORY_SIZE = 120  # samples kept per channel
+HISTORY_WINDOWS = (10, 60, 120)  # samples, each at most HISTORY_SIZE
+
+
+class MonotonicQueue:
+    # sequence numbers of the samples that can still become the window minimum (or maximum),
+    # kept in a ring sized to the window
+    __slots__ = ('seqs', 'head', 'length')
+
+    def __init__(self, window: int):
+        self.seqs = array('I', [0] * window)
+        self.head = 0
+        self.length = 0
+
+    def front(self) -> int:
+        return self.seqs[self.head]
+
+    def back(self) -> int:
+        return self.seqs[(self.head + self.length - 1) % len(self.seqs)]
+
+    def popFront(self) -> None:
+        self.head = (self.head + 1) % len(self.seqs)
+        self.length -= 1
+
+    def popBack(self) -> None:
+        self.length -= 1
+
+    def push(self, seq: int) -> None:
+        self.seqs[(self.head + self.length) % len(self.seqs)] = seq
+        self.length += 1
+
+
+class SensorRing:
+    # last `size` samples of one channel with rolling min, max and sum over every window,
+    # each push is amortized O(1) per window
+    def __init__(self, size: int, windows: tuple):
+        for w in windows:
+            if w < 1 or w > size:
+                raise Exception(f'Invalid history window [{w}], must be within 1 - {size}')
+
+        self.size = size
+        self.windows = windows
+        self.values = array('f', [0] * size)
+        self.count = 0
+        # rounds incoming values to storage precision so sums and comparisons match the ring
+        self.scratch = array('f', [0])
+
+        self.sums = [0.0 for _ in windows]
+        self.mins = [MonotonicQueue(w) for w in windows]
+        self.maxs = [MonotonicQueue(w) for w in windows]
+
+    def push(self, value: float) -> None:
+        values = self.values
+        seq = self.count
+        slot = seq % self.size
+
+        self.scratch[0] = value
+        value = self.scratch[0]
+
+        # samples leaving the windows are read before their slot can be reused
+        for k, w in enumerate(self.windows):
+            if seq >= w:
+                self.sums[k] -= values[(seq - w) % self.size]
+
+            self.sums[k] += value
+
+        values[slot] = value
+        self.count += 1
+
+        for k, w in enumerate(self.windows):
+            mins = self.mins[k]
+            maxs = self.maxs[k]
+
+            if mins.length > 0 and mins.front() <= seq - w:
+                mins.popFront()
+            if maxs.length > 0 and maxs.front() <= seq - w:
+                maxs.popFront()
+
+            while mins.length > 0 and values[mins.back() % self.size] >= value:
+                mins.popBack()
+            while maxs.length > 0 and values[maxs.back() % self.size] <= value:
+                maxs.popBack()
+
+            mins.push(seq)
+            maxs.push(seq)
+
+        # float sums drift with every add and subtract, rebuild them once per lap of the ring
+        if self.count % self.size == 0:
+            self.resum()
+
+    def resum(self) -> None:
+        for k, w in enumerate(self.windows):
+            total = 0.0
+
+            for seq in range(max(0, self.count - w), self.count):
+                total += self.values[seq % self.size]
+
+            self.sums[k] = total
+
+    def samples(self, k: int) -> int:
+        return min(self.count, self.windows[k])
+
+    def aggregate(self, k: int) -> tuple:
+        # (min, max, mean) of window k, -1 before the first sample
+        if self.count == 0:
+            return (-1, -1, -1)
+
+        values = self.values
+
+        return (
+            values[self.mins[k].front() % self.size],
+            values[self.maxs[k].front() % self.size],
+            self.sums[k] / self.samples(k)
+        )
+
+
+class SensorHistory:
+    # one ring per tracked index of the sensor vector, bound to the layout it was built for
+    def __init__(self, layout, channels=None, size: int = HISTORY_SIZE, windows: tuple = HISTORY_WINDOWS):
+        if channels is None:
+            channels = range(len(SCALAR_SENSORS))
+
+        self.layout = layout
+        self.windows = windows
+        self.channels = [i for i in channels if i < layout.size]
+        self.rings = {i: SensorRing(size, windows) for i in self.channels}
+        self.count = 0
+
+    def record(self, frame) -> None:
+        values = frame.values
+        self.count += 1
+
+        for i in self.channels:
+            value = values[i]
+
+            # text readings have no aggregate, the ring keeps its previous samples
+            if isinstance(value, (int, float)):
+                self.rings[i].push(value)
+
+    def query(self, window: int, channels: list) -> list:
+        # [window, samples, then index, min, max, mean of every channel], all tracked channels when empty
+        if window not in self.windows:
+            raise Exception(f'Invalid history window [{window}]')
+
+        k = self.windows.index(window)
+        result = [window, min(self.count, window)]
+
+        for i in channels if len(channels) > 0 else self.channels:
+            ring = self.rings.get(i)
+
+            if ring is None:
+                raise Exception(f'Sensor [{i}] has no history')
+
+            lo, hi, mean = ring.aggregate(k)
+            result += [i, lo, hi, mean]
+
+        return result
@@ -1,35 +1,274 @@
-def parseSensors(data: list, sysInfo: dict):
-    return {
-        'batt_charge': data.pop(0),
-        'batt_level': data.pop(0),
-        'batt_time': data.pop(0),
-        'bclk': data.pop(0),
-        'cpu_fan': data.pop(0),
-        'cpu_power': data.pop(0),
-        'cpu_temp': data.pop(0),
-        'cpu_usage': data.pop(0),
-        'ram_freq': data.pop(0),
-        'ram_used': data.pop(0),
-        'cpus': [data.pop(0) for _ in range(sysInfo['cpuThreads'])],
-        'drives': [{
-            'read': data.pop(0),
-            'write': data.pop(0)
-        } for _ in range(len(sysInfo['drives']))],
-        'smart': [{
-            'temp': data.pop(0),
-            'life': data.pop(0),
-            'warning': data.pop(0),
-            'failure': data.pop(0),
-            'reads': data.pop(0),
-            'writes': data.pop(0)
-        } for _ in range(len(sysInfo['drives']))],
-        'networkInterfaces': [{
-            'up': data.pop(0),
-            'dl': data.pop(0)
-        } for _ in range(len(sysInfo['networkInterfaces']))],
-        'gpus': [{
-            'usage': data.pop(0),
-            'mem_used': data.pop(0),
-            'temp': data.pop(0)
-        } for _ in range(len(sysInfo['gpus']))]
-    }
+from hashlib import sha256
+from shared.utils import loadJSON
+
+
+SENSOR_QUANTIZED = 1  # request flag, sensor values are sent as scaled ints
+
+QUANTIZATION = loadJSON('shared/sensorQuantization.json')
+TYPE_RANGES = {
+    'b': (-128, 127),
+    'h': (-32_768, 32_767),
+    'i': (-2_147_483_648, 2_147_483_647),
+}
+
+
+def quantizationId(table: dict) -> int:
+    # 16 bit id of a scale table, sent with quantized requests so both ends scale alike, 0 when none loaded
+    if len(table) == 0:
+        return 0
+
+    hasher = sha256()
+
+    for c in sorted(table):
+        hasher.update(f'{c}:{table[c]["type"]}:{table[c]["scale"]};'.encode('utf-8'))
+
+    digest = hasher.digest()
+    return ((digest[0] << 8) | digest[1]) or 1
+
+
+QUANTIZATION_ID = quantizationId(QUANTIZATION)
+
+
+def sensorRequest(quantized: bool) -> list:
+    # flags and scale table id leading every GET_SENSORS and GET_SENSORS_DELTA request
+    if quantized and QUANTIZATION_ID != 0:
+        return [SENSOR_QUANTIZED, QUANTIZATION_ID]
+
+    return [0, 0]
+
+
+def sensorRequestValid(data: list) -> bool:
+    # quantized requests are refused unless both ends loaded the same scale table
+    if len(data) == 0 or not data[0] & SENSOR_QUANTIZED:
+        return True
+
+    return QUANTIZATION_ID != 0 and len(data) > 1 and data[1] == QUANTIZATION_ID
+
+
+def sensorClasses(sysInfo: dict) -> list:
+    # same order as driver/sensors.mapReg and parseSensors
+    return (
+        ['batt_charge', 'batt_level', 'batt_time', 'bclk', 'cpu_fan',
+         'cpu_power', 'cpu_temp', 'cpu_usage', 'ram_freq', 'ram_used']
+        + ['cpu_usage'] * sysInfo['cpuThreads']
+        + ['drive_read', 'drive_write'] * len(sysInfo['drives'])
+        + ['smart_temp', 'smart_life', 'smart_warning', 'smart_failure', 'smart_reads', 'smart_writes'] * len(sysInfo['drives'])
+        + ['net_up', 'net_dl'] * len(sysInfo['networkInterfaces'])
+        + ['gpu_usage', 'gpu_mem_used', 'gpu_temp'] * len(sysInfo['gpus'])
+    )
+
+
+scalesCache = [None, None]
+
+
+def sensorScales(sysInfo: dict) -> list:
+    if scalesCache[0] is not sysInfo:
+        scales = []
+
+        for c in sensorClasses(sysInfo):
+            q = QUANTIZATION.get(c)
+
+            if q is None:
+                scales.append(None)
+            else:
+                lo, hi = TYPE_RANGES[q['type']]
+                scales.append((q['scale'], lo, hi))
+
+        scalesCache[0] = sysInfo
+        scalesCache[1] = scales
+
+    return scalesCache[1]
+
+
+def quantizeSensors(data: list, sysInfo: dict) -> list:
+    scales = sensorScales(sysInfo)
+
+    for i in range(min(len(data), len(scales))):
+        s = scales[i]
+        v = data[i]
+
+        if s is None or isinstance(v, bool) or not isinstance(v, (int, float)):
+            continue
+
+        v = round(v * s[0])
+
+        # out of range values are clamped to the width from the metadata
+        data[i] = s[1] if v < s[1] else s[2] if v > s[2] else v
+
+    return data
+
+
+SCALAR_SENSORS = ('batt_charge', 'batt_level', 'batt_time', 'bclk', 'cpu_fan',
+                  'cpu_power', 'cpu_temp', 'cpu_usage', 'ram_freq', 'ram_used')
+SCALAR_INDEX = {name: i for i, name in enumerate(SCALAR_SENSORS)}
+DRIVE_SENSORS = ('read', 'write')
+SMART_SENSORS = ('temp', 'life', 'warning', 'failure', 'reads', 'writes')
+NETWORK_SENSORS = ('up', 'dl')
+GPU_SENSORS = ('usage', 'mem_used', 'temp')
+
+
+class SensorLayout:
+    # offsets of every sensor group in the flat vector, same order as sensorClasses
+    def __init__(self, sysInfo: dict):
+        self.cpuCount = sysInfo['cpuThreads']
+        self.driveCount = len(sysInfo['drives'])
+        self.networkCount = len(sysInfo['networkInterfaces'])
+        self.gpuCount = len(sysInfo['gpus'])
+
+        self.cpus = len(SCALAR_SENSORS)
+        self.drives = self.cpus + self.cpuCount
+        self.smart = self.drives + len(DRIVE_SENSORS) * self.driveCount
+        self.networkInterfaces = self.smart + len(SMART_SENSORS) * self.driveCount
+        self.gpus = self.networkInterfaces + len(NETWORK_SENSORS) * self.networkCount
+        self.size = self.gpus + len(GPU_SENSORS) * self.gpuCount
+
+        # divisor of every quantized value, None when the value is sent as is
+        self.scales = [None if s is None or s[0] == 1 else s[0] for s in sensorScales(sysInfo)]
+        self.frame = SensorFrame(self)
+
+
+class SensorFrame:
+    # sensor vector parsed with a SensorLayout, reused for every parse of the same layout,
+    # a list keeps ints exact (SMART and network counters) and legacy text readings as they came
+    __slots__ = ('layout', 'values')
+
+    def __init__(self, layout: SensorLayout):
+        self.layout = layout
+        self.values = [0] * layout.size
+
+    def get(self, name: str, default=-1):
+        i = SCALAR_INDEX.get(name)
+        return default if i is None else self.values[i]
+
+    def cpu(self, i: int):
+        return self.values[self.layout.cpus + i]
+
+    def drive(self, i: int, name: str):
+        return self.values[self.layout.drives + i * len(DRIVE_SENSORS) + DRIVE_SENSORS.index(name)]
+
+    def smart(self, i: int, name: str):
+        return self.values[self.layout.smart + i * len(SMART_SENSORS) + SMART_SENSORS.index(name)]
+
+    def networkInterface(self, i: int, name: str):
+        return self.values[self.layout.networkInterfaces + i * len(NETWORK_SENSORS) + NETWORK_SENSORS.index(name)]
+
+    def gpu(self, i: int, name: str):
+        return self.values[self.layout.gpus + i * len(GPU_SENSORS) + GPU_SENSORS.index(name)]
+
+
+layoutCache = [None, None]
+
+
+def sensorLayout(sysInfo: dict) -> SensorLayout:
+    if layoutCache[0] is not sysInfo:
+        layoutCache[1] = SensorLayout(sysInfo)
+        layoutCache[0] = sysInfo
+
+    return layoutCache[1]
+
+
+def parseSensors(data: list, sysInfo: dict, quantized=False, offset: int = 0) -> SensorFrame:
+    # data is left untouched, values missing from a short packet read as -1
+    layout = sensorLayout(sysInfo)
+    frame = layout.frame
+    values = frame.values
+    count = max(0, min(layout.size, len(data) - offset))
+
+    if quantized:
+        scales = layout.scales
+
+        for i in range(count):
+            s = scales[i]
+            v = data[offset + i]
+
+            # text and bool readings are never scaled by quantizeSensors, they arrive as they were
+            if s is None or isinstance(v, bool) or not isinstance(v, (int, float)):
+                values[i] = v
+            else:
+                values[i] = v / s
+    else:
+        for i in range(count):
+            values[i] = data[offset + i]
+
+    for i in range(count, layout.size):
+        values[i] = -1
+
+    return frame
+
+
+KEYFRAME_INTERVAL = 30
+
+
+class SensorDeltaEncoder:
+    # an empty change bitmap marks a keyframe carrying the full vector
+    def __init__(self, keyframeInterval: int = KEYFRAME_INTERVAL):
+        self.keyframeInterval = keyframeInterval
+        self.values = None
+        self.seq = 0
+        self.sinceKeyframe = 0
+
+    def encode(self, values: list, baseSeq) -> list:
+        previous = self.values
+        previousSeq = self.seq
+
+        self.values = values
+        self.seq = (self.seq + 1) % 65536
+
+        if (previous is None or baseSeq != previousSeq or len(previous) != len(values)
+                or self.sinceKeyframe >= self.keyframeInterval):
+            self.sinceKeyframe = 0
+            return [self.seq, b''] + values
+
+        bitmap = bytearray((len(values) + 7) // 8)
+        changed = []
+
+        for i, v in enumerate(values):
+            if v != previous[i]:
+                bitmap[i >> 3] |= 1 << (i & 7)
+                changed.append(v)
+
+        self.sinceKeyframe += 1
+        return [self.seq, bytes(bitmap)] + changed
+
+
+class SensorDeltaDecoder:
+    def __init__(self):
+        self.values = None
+        self.seq = None
+
+    def reset(self):
+        self.values = None
+        self.seq = None
+
+    def request(self) -> list:
+        return [] if self.seq is None else [self.seq]
+
+    def decode(self, seq: int, bitmap: bytes, changed: list):
+        if len(bitmap) == 0:
+            self.values = list(changed)
+            self.seq = seq
+            return self.values
+
+        values = self.values
+
+        if values is None or seq != (self.seq + 1) % 65536 or len(bitmap) != (len(values) + 7) // 8:
+            self.reset()
+            return None
+
+        j = 0
+
+        for i, b in enumerate(bitmap):
+            if b == 0:
+                continue
+
+            for bit in range(8):
+                if b & (1 << bit):
+                    values[(i << 3) + bit] = changed[j]
+                    j += 1
+
+        if j != len(changed):
+            self.reset()
+            return None
+
+        self.seq = seq
+        return values
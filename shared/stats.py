@@ -0,0 +1,56 @@
+import json
+from shared.packets import MAX_PACKET_SIZE
+
+
+# STATS_DATA is always a single frame, the rest of it holds the v2 header, the string length and PACKET_STOP
+STATS_MAX_BYTES = MAX_PACKET_SIZE - 32
+
+# wire order of the fixed records, the commander expands them back to objects,
+# links are followed by rx frames and bytes, tx frames and bytes, then the latency buckets
+LINK_FIELDS = ('inFlight', 'inFlightBytes', 'queueDepth', 'maxQueueDepth', 'drops', 'stalls',
+               'corrupted', 'retries', 'failed', 'rto')
+PLAN_FIELDS = ('size', 'capacity', 'hits', 'misses', 'evictions')
+
+
+def compactLink(stats: dict) -> list:
+    latency = stats['latency']
+    buckets = len(latency)
+
+    # empty slow buckets are left out
+    while buckets > 0 and latency[buckets - 1] == 0:
+        buckets -= 1
+
+    return [stats[f] for f in LINK_FIELDS] + stats['rx'] + stats['tx'] + latency[:buckets]
+
+
+def packStats(links: dict, stats: dict) -> str:
+    # JSON of a STATS_DATA reply, when it would not fit one frame the handlers called least often are left out
+    reply = {name: compactLink(s) for name, s in links.items()}
+
+    for name, value in stats.items():
+        reply[name] = value
+
+    if 'plans' in reply:
+        reply['plans'] = [reply['plans'][f] for f in PLAN_FIELDS]
+
+    text = json.dumps(reply)
+    handlers = reply.get('handlers')
+
+    if handlers is None or len(text) <= STATS_MAX_BYTES:
+        return text
+
+    handlers = dict(handlers)
+    reply['handlers'] = handlers
+    order = sorted(handlers, key=lambda opcode: handlers[opcode][0])
+
+    while len(text) > STATS_MAX_BYTES and len(order) > 0:
+        excess = len(text) - STATS_MAX_BYTES
+
+        # entry sizes are estimated, so the result is checked again
+        while excess > 0 and len(order) > 0:
+            opcode = order.pop(0)
+            excess -= len(json.dumps({opcode: handlers.pop(opcode)}))
+
+        text = json.dumps(reply)
+
+    return text
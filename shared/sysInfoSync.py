@@ -0,0 +1,199 @@
+import json
+import os
+from shared.baseClient import NEW_UNIQ
+from shared.opcodes import SYSINFO_CHUNK
+from shared.routes import PRIVATE
+from shared.types import Packet
+from shared.utils import getHash
+
+
+try:
+    from micropython import const  # check if running in micropython
+    from shared.utils import time_ns
+
+    del const
+except ModuleNotFoundError as e:
+    from time import time_ns
+
+
+CHUNK_SIZE = 512
+CHUNK_WINDOW = 2  # chunks of one transfer sent but not yet acknowledged
+SYSINFO_FILE = 'sysInfo.z'
+TRANSFER_TIMEOUT = 3_000_000_000  # ns
+
+
+def compressSysInfo(sysInfo: dict) -> bytes:
+    import zlib
+
+    return zlib.compress(json.dumps(sysInfo).encode('utf-8'))
+
+
+def openDecompressed(file):
+    try:
+        import deflate
+
+        return deflate.DeflateIO(file, deflate.ZLIB)
+    except ImportError:
+        import zlib
+
+        # older micropython builds only ship the zlib stream decoder
+        if hasattr(zlib, 'DecompIO'):
+            return zlib.DecompIO(file)
+
+        import io
+
+        return io.BytesIO(zlib.decompress(file.read()))
+
+
+def loadSysInfo(name: str = SYSINFO_FILE) -> dict:
+    try:
+        file = open(name, 'rb')
+    except OSError:
+        return {}
+
+    try:
+        data: dict = json.load(openDecompressed(file))  # type: ignore
+    except Exception:
+        data = {}
+
+    file.close()
+
+    return data
+
+
+def removeSysInfo(name: str = SYSINFO_FILE):
+    try:
+        os.remove(name)
+    except OSError:
+        pass
+
+
+def fileSize(name: str) -> int:
+    try:
+        return os.stat(name)[6]
+    except OSError:
+        return -1
+
+
+def sysInfoChunks(origin: int, destination: int, sysHash: bytes, source):
+    # source is either the compressed sysInfo or the name of the file holding it
+    if isinstance(source, (bytes, bytearray)):
+        count = (len(source) + CHUNK_SIZE - 1) // CHUNK_SIZE
+
+        for i in range(count):
+            yield Packet(SYSINFO_CHUNK, origin, destination, NEW_UNIQ, PRIVATE,
+                         [sysHash, i, count, source[i * CHUNK_SIZE:(i + 1) * CHUNK_SIZE]])
+
+        return
+
+    count = (fileSize(source) + CHUNK_SIZE - 1) // CHUNK_SIZE
+    file = open(source, 'rb')
+
+    try:
+        for i in range(count):
+            yield Packet(SYSINFO_CHUNK, origin, destination, NEW_UNIQ, PRIVATE,
+                         [sysHash, i, count, file.read(CHUNK_SIZE)])
+    finally:
+        file.close()
+
+
+class ChunkSender:
+    # sends chunks as important packets, the next chunk goes out when one is acknowledged,
+    # so a large transfer never overflows the bounded send queue of the link
+    def __init__(self, request, chunks, window: int = CHUNK_WINDOW):
+        # request(packet) -> Request
+        self.request = request
+        self.chunks = chunks
+        self.inFlight = 0
+        self.done = False
+
+        for _ in range(window):
+            self.next()
+
+    def next(self):
+        if self.done:
+            return
+
+        try:
+            packet = next(self.chunks)
+        except StopIteration:
+            self.done = True
+            return
+
+        self.inFlight += 1
+        self.request(packet).then(self.onAck, self.onFailure)
+
+    def onAck(self, request, packet):
+        self.inFlight -= 1
+        self.next()
+
+    def onFailure(self, request):
+        # the receiver asks for sysInfo again once its transfer times out
+        self.inFlight -= 1
+        self.cancel()
+
+    def cancel(self):
+        if not self.done:
+            self.done = True
+            self.chunks.close()
+
+    def busy(self) -> bool:
+        return not self.done or self.inFlight > 0
+
+
+class ChunkReceiver:
+    # chunks are written straight to a staging file, so only the compressed
+    # stream and the parsed result ever live on the device
+    def __init__(self, name: str = SYSINFO_FILE):
+        self.name = name
+        self.staging = name + '.part'
+
+        self.hash = None
+        self.count = 0
+        self.remaining = 0
+        self.received = None
+        self.last = 0
+
+    def start(self, sysHash: bytes, count: int):
+        file = open(self.staging, 'wb')
+        file.close()
+
+        self.hash = sysHash
+        self.count = count
+        self.remaining = count
+        self.received = bytearray(count)
+
+    def busy(self) -> bool:
+        return self.remaining > 0 and time_ns() < self.last + TRANSFER_TIMEOUT
+
+    def write(self, sysHash: bytes, index: int, count: int, chunk: bytes) -> bool:
+        if sysHash != self.hash or count != self.count or self.received is None:
+            self.start(sysHash, count)
+        elif self.remaining == 0 or self.received[index]:
+            # retransmitted chunk of a finished transfer
+            return False
+
+        file = open(self.staging, 'r+b')
+        file.seek(index * CHUNK_SIZE)
+        file.write(chunk)
+        file.close()
+
+        self.received[index] = 1
+        self.remaining -= 1
+        self.last = time_ns()
+
+        return self.remaining == 0
+
+    def finish(self):
+        removeSysInfo(self.name)
+        os.rename(self.staging, self.name)
+        sysInfo = loadSysInfo(self.name)
+
+        if getHash(sysInfo) != self.hash:
+            print('Invalid sysInfo transfer, hash mismatch')
+            removeSysInfo(self.name)
+            self.hash = None
+            self.received = None
+            return None
+
+        return sysInfo
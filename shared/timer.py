@@ -1,28 +1,129 @@
 import threading
+import time
+import traceback
+from heapq import heappop, heappush
 
 
-class Timer(threading.Thread):
+class TimerScheduler:
+    # a single thread serving every Timer from a heap of absolute deadlines,
+    # the thread exits once the last timer is deinitialized
+    def __init__(self):
+        self.condition = threading.Condition()
+        # (deadline, seq, timer, generation), entries of stopped or re-initialized timers are skipped lazily
+        self.heap: list[tuple] = []
+        self.seq = 0
+        self.timers = set()
+        self.thread = None
+
+    def push(self, timer, deadline: float) -> None:
+        self.seq += 1
+        heappush(self.heap, (deadline, self.seq, timer, timer.generation))
+        self.condition.notify()
+
+    def add(self, timer) -> None:
+        with self.condition:
+            timer.generation += 1
+            self.timers.add(timer)
+            self.push(timer, time.monotonic() + timer.interval)
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='Timer')
+                self.thread.start()
+
+    def remove(self, timer) -> None:
+        with self.condition:
+            timer.generation += 1
+            self.timers.discard(timer)
+            self.condition.notify()
+
+    def shutdown(self, timeout: float | None = None) -> None:
+        with self.condition:
+            for timer in self.timers:
+                timer.generation += 1
+
+            self.timers.clear()
+            self.condition.notify()
+            thread = self.thread
+
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def run(self) -> None:
+        heap = self.heap
+
+        with self.condition:
+            while True:
+                while len(heap) > 0 and heap[0][3] != heap[0][2].generation:
+                    heappop(heap)
+
+                if len(self.timers) == 0:
+                    heap.clear()
+                    self.thread = None
+                    return
+
+                deadline, _, timer, _ = heap[0]
+                now = time.monotonic()
+
+                if now < deadline:
+                    self.condition.wait(deadline - now)
+                    continue
+
+                heappop(heap)
+
+                if timer.mode == Timer.PERIODIC:
+                    # the next deadline follows the previous one, missed periods are skipped
+                    missed = int((now - deadline) // timer.interval)
+
+                    if missed > 0:
+                        timer.overruns += missed
+                        print(f'[Timer {timer.id}] callback overran by {missed} periods')
+
+                    self.push(timer, deadline + (missed + 1) * timer.interval)
+                else:
+                    timer.generation += 1
+                    self.timers.discard(timer)
+
+                callback = timer.callback
+                self.condition.release()
+
+                try:
+                    callback(timer)
+                except Exception:
+                    traceback.print_exc()
+                finally:
+                    self.condition.acquire()
+
+
+scheduler = TimerScheduler()
+
+
+class Timer:
+    # CPython shim for machine.Timer
     PERIODIC = 0
+    ONE_SHOT = 1
 
-    def __init__(self, n):
-        threading.Thread.__init__(self)
-        self.daemon = False
-        self.loop = threading.Event()
+    def __init__(self, n: int = -1):
+        self.id = n
         self.interval = 0
         self.callback = None
         self.mode = self.PERIODIC
 
-    def init(self, freq, mode, callback):
-        self.interval = 1 / freq
+        self.generation = 0
+        # periods skipped because a callback ran late
+        self.overruns = 0
+
+    def init(self, freq=None, mode=PERIODIC, callback=None, period=None):
+        # period in ms, like machine.Timer
+        self.interval = period / 1000 if period is not None else 1 / freq
         self.mode = mode
         self.callback = callback
 
-        self.start()
+        scheduler.add(self)
 
     def deinit(self):
-        self.loop.set()
-        self.join()
+        scheduler.remove(self)
+
 
-    def run(self):
-        while not self.loop.wait(self.interval):
-            self.callback(self)
+def shutdown(timeout: float | None = None) -> None:
+    # stops every timer and waits for the scheduler thread
+    scheduler.shutdown(timeout)
@@ -0,0 +1,86 @@
+REQUEST_PENDING = 0
+REQUEST_DONE = 1
+REQUEST_FAILED = 2
+
+
+class Packet:
+    # outgoing packet, data is kept as given and never copied
+    __slots__ = ('opcode', 'origin', 'destination', 'uniq', 'channel', 'data')
+
+    def __init__(self, opcode: int, origin: int, destination: int, uniq, channel: int, data: list | None = None):
+        self.opcode = opcode
+        self.origin = origin
+        self.destination = destination
+        self.uniq = uniq
+        self.channel = channel
+        self.data = [] if data is None else data
+
+    def __repr__(self) -> str:
+        return f'Packet(opcode={self.opcode}, origin={self.origin}, destination={self.destination}, uniq={self.uniq}, channel={self.channel}, data={self.data})'
+
+
+def requestKey(peer: int, uniq: int) -> int:
+    # the same uniq may be in use towards different peers
+    return (peer << 16) | uniq
+
+
+class Request:
+    # important packet waiting for its reply, returned by writePacket(..., important=True)
+    # and completed when a packet with the same uniq comes back from the peer
+    __slots__ = ('key', 'uniq', 'opcode', 'channel', 'raw', 'timestamp', 'retries', 'deadline',
+                 'state', 'response', 'onSuccess', 'onTimeout', 'onFailure')
+
+    def __init__(self, packet, raw: bytes):
+        self.key = requestKey(packet.destination, packet.uniq)
+        self.uniq = packet.uniq
+        self.opcode = packet.opcode
+        self.channel = packet.channel
+        self.raw = raw
+
+        self.timestamp = 0
+        self.retries = 0
+        self.deadline = 0
+
+        self.state = REQUEST_PENDING
+        self.response = None
+
+        self.onSuccess = None
+        self.onTimeout = None
+        self.onFailure = None
+
+    def then(self, onSuccess=None, onFailure=None, onTimeout=None):
+        # onSuccess(request, packet), onTimeout(request, retries), onFailure(request),
+        # a request settled before they were attached (dropped by a full send queue) runs them right away
+        self.onSuccess = onSuccess
+        self.onFailure = onFailure
+        self.onTimeout = onTimeout
+
+        if self.state == REQUEST_DONE and onSuccess is not None:
+            onSuccess(self, self.response)
+        elif self.state == REQUEST_FAILED and onFailure is not None:
+            onFailure(self)
+
+        return self
+
+    def pending(self) -> bool:
+        return self.state == REQUEST_PENDING
+
+    def resolve(self, packet) -> None:
+        self.state = REQUEST_DONE
+        self.response = packet
+
+        if self.onSuccess is not None:
+            self.onSuccess(self, packet)
+
+    def timeout(self) -> None:
+        if self.onTimeout is not None:
+            self.onTimeout(self, self.retries)
+
+    def fail(self) -> None:
+        self.state = REQUEST_FAILED
+
+        if self.onFailure is not None:
+            self.onFailure(self)
+
+    def __repr__(self) -> str:
+        return f'Request(uniq={self.uniq}, opcode={self.opcode}, retries={self.retries}, state={self.state})'
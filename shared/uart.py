@@ -1,5 +1,7 @@
-from shared.baseClient import BaseClient, genericWritePacket
+from shared.baseClient import BaseClient
 from shared.opcodes import PACKET_STOP
+from shared.packets import (COBS_DELIMITER, FRAMING_COBS, MAX_PACKET_SIZE, WIRE_BATCH, WIRE_COBS, WIRE_V2,
+                            cobsDecode, cobsFrame)
 
 
 try:
@@ -11,47 +13,166 @@ except ModuleNotFoundError as e:
     from time import time_ns
 
 
-class UART(BaseClient):
-    def checkRequestRetryCallback(self, request: list):
-        self.client.write(request[4])
+PACKET_TIMEOUT = 50_000_000  # ns
 
-    @genericWritePacket
-    def writePacket(self, _, packetRaw: bytes):
-        self.client.write(packetRaw)
+# first bytes of frames terminated with PACKET_STOP
+STOP_FRAME_STARTS = b'0123456789' + bytes([WIRE_V2, WIRE_BATCH])
+COBS_RESYNC = COBS_DELIMITER + bytes([WIRE_COBS])
+
+
+class Framer:
+    def __init__(self, client, size: int = 2 * MAX_PACKET_SIZE):
+        self.client = client
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+
+        self.fill = 0
+        self.scanned = 0
+        self.lastRX = 0
+
+        # micropython's bytearray has no find(), the bytes that may still hold a marker
+        # are copied once per read and searched there
+        self.window = b''
+        self.windowStart = 0
+
+    def available(self) -> int:
+        if hasattr(self.client, 'any'):
+            return self.client.any()
+
+        return self.client.in_waiting
+
+    def read(self) -> int:
+        n = min(self.available(), len(self.buffer) - self.fill)
+
+        if n <= 0:
+            return 0
+
+        n = self.client.readinto(self.view[self.fill:self.fill + n]) or 0
+        self.fill += n
+
+        if n > 0:
+            self.lastRX = time_ns()
+
+        return n
+
+    def compact(self, start: int):
+        if start == 0:
+            return
+
+        remaining = self.fill - start
+        self.view[0:remaining] = self.view[start:self.fill]
+
+        self.fill = remaining
+        self.scanned = max(0, self.scanned - start)
+
+    def drop(self):
+        self.fill = 0
+        self.scanned = 0
+
+    def find(self, marker: bytes, start: int) -> int:
+        # start is never before windowStart, markers ending before it were found by earlier reads
+        i = self.window.find(marker, max(start, self.windowStart) - self.windowStart)
+        return i if i < 0 else self.windowStart + i
 
-    def readPacket(self) -> bytes | None:
-        buffer = b''
-        startTime = time_ns()
+    def nextFrame(self, start: int):
+        # returns (frame start, frame end, next start), frame start is -1 when incomplete
+        buffer = self.buffer
 
-        while len(buffer) <= 1024:
-            packet: bytes | None = self.client.read(1)
-            if packet is None:
-                if len(buffer) == 0:
-                    return None
+        while start < self.fill:
+            first = buffer[start]
 
-                if time_ns() > startTime + 50_000_000:
-                    print(f'Packet timeout, buffer [{buffer}]')
-                    return None
+            if first == WIRE_COBS:
+                i = self.find(COBS_DELIMITER, start + 1)
 
-                continue
+                if i < 0:
+                    return -1, -1, start
 
-            buffer += packet
-            startTime = time_ns()
+                try:
+                    end = start + 1 + cobsDecode(self.view, start + 1, i)
+                except Exception as e:
+                    print(e)
+                    start = i + 1
+                    continue
 
-            if not buffer.endswith(PACKET_STOP):
-                continue
+                return start + 1, end, i + 1
 
-            return buffer
+            if first in STOP_FRAME_STARTS:
+                i = self.find(PACKET_STOP, start)
 
-        raise Exception('Packet size exceeded 1024 bytes')
+                if i < 0:
+                    return -1, -1, start
+
+                return start, i, i + len(PACKET_STOP)
+
+            # garbage, skip to whichever framing resyncs first
+            i = self.find(COBS_RESYNC, start)
+            j = self.find(PACKET_STOP, start)
+
+            if i < 0 and j < 0:
+                return -1, -1, start
+
+            if j < 0 or (i >= 0 and i < j):
+                print(f'Dropping {i + 1 - start} bytes of garbage')
+                start = i + 1
+            else:
+                print(f'Dropping {j + len(PACKET_STOP) - start} bytes of garbage')
+                start = j + len(PACKET_STOP)
+
+        return -1, -1, start
+
+    def frames(self):
+        # yields (frame, end), frames are views into the buffer valid until the next call
+        while self.read() > 0:
+            start = 0
+
+            # only newly arrived bytes and the tail of the previous read (a possibly split marker) are searched
+            self.windowStart = max(0, self.scanned - len(PACKET_STOP) + 1)
+            self.window = bytes(self.view[self.windowStart:self.fill])
+
+            while True:
+                frameStart, frameEnd, start = self.nextFrame(start)
+
+                if frameStart < 0:
+                    break
+
+                yield self.view[frameStart:frameEnd], frameEnd - frameStart
+
+            self.window = b''
+            self.scanned = self.fill
+            self.compact(start)
+
+            if self.fill > MAX_PACKET_SIZE:
+                print(f'Packet size exceeded {MAX_PACKET_SIZE} bytes, dropping buffer')
+                self.drop()
+
+        if self.fill > 0 and time_ns() > self.lastRX + PACKET_TIMEOUT:
+            print(f'Packet timeout, buffer [{bytes(self.view[0:self.fill])}]')
+            self.drop()
+
+
+class UART(BaseClient):
+    WIRE_VERSION = WIRE_V2
+    BATCH_WINDOW = 0
+    FRAMING = FRAMING_COBS
+    RTO_MIN = 30_000_000
+    RTO_MAX = 5_000_000_000
+    # keep the outstanding bytes well below the 2048 byte rxbuf on the far side
+    WINDOW_SIZE = 4
+    WINDOW_BYTES = 1024
+
+    def __init__(self, client) -> None:
+        super().__init__(client)
+        self.framer = Framer(client)
+
+    def writeRaw(self, _, packetRaw: bytes) -> None:
+        if self.FRAMING == FRAMING_COBS:
+            packetRaw = cobsFrame(packetRaw)
+
+        self.client.write(packetRaw)
 
     def checkRX(self) -> None:
-        if hasattr(self.client, 'any'):
-            while self.client.any() > 0:
-                self.handleRX()
-        else:
-            while self.client.in_waiting > 0:
-                self.handleRX()
+        for frame, end in self.framer.frames():
+            self.handleRX(frame, end)
 
     def handleRX(self, *args) -> None:
         raise NotImplementedError
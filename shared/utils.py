@@ -1,6 +1,7 @@
 import time
 import binascii
 import json
+import struct
 from hashlib import sha256
 from random import getrandbits
 
@@ -68,24 +69,44 @@ def getUniq() -> str:
     return getrandbits(32) % (65535 + 1)
 
 
+# [last ticks_us() reading, us since the first reading], ticks_us() wraps about every 17.9 minutes
+ticksClock = [None, 0]
+
+
 def time_ns() -> int:
-    return time.ticks_us() * 1000
+    # micropython only, never wraps as long as it is called at least every ~8.9 minutes, so
+    # deadlines derived from it order correctly and plain comparisons stay valid
+    now = time.ticks_us()
+
+    if ticksClock[0] is not None:
+        ticksClock[1] += time.ticks_diff(now, ticksClock[0])
+
+    ticksClock[0] = now
+
+    return ticksClock[1] * 1000
+
+
+class StructShim:
+    # micropython's struct module has no precompiled Struct
+    def __init__(self, packetFormat: str):
+        self.format = packetFormat
+        self.size = struct.calcsize(packetFormat)
 
+    def pack(self, *data) -> bytes:
+        return struct.pack(self.format, *data)
 
-def timeDivider(counter: int, loopTime: int, interval: int) -> bool:
-    if loopTime > interval:
-        return True
+    def pack_into(self, buffer, offset: int, *data) -> None:
+        struct.pack_into(self.format, buffer, offset, *data)
 
-    return True if counter % (interval // loopTime) == 0 else False
+    def unpack(self, buffer) -> tuple:
+        return struct.unpack(self.format, buffer)
 
+    def unpack_from(self, buffer, offset: int = 0) -> tuple:
+        return struct.unpack_from(self.format, buffer, offset)
 
-def flatten(l: list) -> list:
-    r = []
 
-    for i in l:
-        if isinstance(i, list):
-            r += flatten(i)
-        else:
-            r.append(i)
+def compileStruct(packetFormat: str):
+    if hasattr(struct, 'Struct'):
+        return struct.Struct(packetFormat)
 
-    return r
+    return StructShim(packetFormat)
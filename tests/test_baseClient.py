@@ -0,0 +1,217 @@
+import time
+
+from shared import baseClient, utils
+from shared.baseClient import NEW_UNIQ, REQUEST_RETRIES, BaseClient
+from shared.opcodes import GET_MQTT_STATUS, GET_STATS, GET_WIFI, MQTT_STATUS_DATA, PING, PONG, STATS_DATA
+from shared.packets import WIRE_V2, PacketView, packPacket
+from shared.routes import ESP, PICO, PRIVATE
+from shared.types import Packet
+
+
+class Clock:
+    def __init__(self, now: int = 0):
+        self.now = now
+
+    def __call__(self) -> int:
+        return self.now
+
+
+class Link(BaseClient):
+    WIRE_VERSION = WIRE_V2
+
+    def __init__(self):
+        super().__init__(None)
+        self.sent = []
+
+    def writeRaw(self, channel: int, packetRaw: bytes) -> None:
+        self.sent.append(packetRaw)
+
+
+def testTicksClockNeverWraps(monkeypatch):
+    period = 1 << 30
+    ticks = [period - 5_000]
+
+    monkeypatch.setattr(time, 'ticks_us', lambda: ticks[0], raising=False)
+    monkeypatch.setattr(time, 'ticks_diff',
+                        lambda a, b: ((a - b + period // 2) & (period - 1)) - period // 2, raising=False)
+    monkeypatch.setattr(utils, 'ticksClock', [None, 0])
+
+    start = utils.time_ns()
+    ticks[0] = (ticks[0] + 10_000) % period
+
+    # ticks_us() wrapped to 5_000, the clock still advanced by 10 ms
+    assert ticks[0] == 5_000
+    assert utils.time_ns() - start == 10_000_000
+
+
+def testWatchPacketShim(monkeypatch):
+    clock = Clock(1_000)
+    monkeypatch.setattr(baseClient, 'time_ns', clock)
+
+    link = Link()
+    packet = Packet(GET_MQTT_STATUS, PICO, ESP, 42, PRIVATE)
+    raw = packPacket(packet, WIRE_V2)
+
+    request = link.watchPacket(42, PRIVATE, raw)
+
+    assert request.uniq == 42 and request.opcode == GET_MQTT_STATUS
+    assert link.inFlight(GET_MQTT_STATUS) == 1
+
+    clock.now += link.rto
+    link.checkRequests()
+
+    assert link.sent == [raw]
+    assert link.ackRequest(ESP, 42) is request
+
+
+def testDeadlinesAcrossTicksWrap(monkeypatch):
+    # the heap is ordered on time_ns(), a request sent just before ticks_us() wraps still times out
+    period = 1 << 30
+    ticks = [period - 1_000]
+
+    monkeypatch.setattr(time, 'ticks_us', lambda: ticks[0], raising=False)
+    monkeypatch.setattr(time, 'ticks_diff',
+                        lambda a, b: ((a - b + period // 2) & (period - 1)) - period // 2, raising=False)
+    monkeypatch.setattr(utils, 'ticksClock', [None, 0])
+    monkeypatch.setattr(baseClient, 'time_ns', utils.time_ns)
+
+    link = Link()
+    request = link.writePacket(Packet(GET_MQTT_STATUS, PICO, ESP, NEW_UNIQ, PRIVATE), important=True)
+
+    for _ in range(REQUEST_RETRIES + 1):
+        ticks[0] = (ticks[0] + baseClient.BaseClient.RTO_MAX // 1_000) % period
+        link.checkRequests()
+
+    assert not request.pending()
+    assert link.inFlight(GET_MQTT_STATUS) == 0
+
+
+def testDroppedRequestRunsFailureOnAttach(monkeypatch):
+    monkeypatch.setattr(baseClient, 'time_ns', Clock(1_000))
+
+    class Full(Link):
+        WINDOW_SIZE = 1
+        QUEUE_SIZE = 1
+        QUEUE_DROP = baseClient.DROP_NEWEST
+
+    link = Full()
+    link.writePacket(Packet(GET_MQTT_STATUS, PICO, ESP, NEW_UNIQ, PRIVATE), important=True)
+    link.writePacket(Packet(GET_MQTT_STATUS, PICO, ESP, NEW_UNIQ, PRIVATE), important=True)
+
+    failed = []
+    request = link.writePacket(Packet(GET_MQTT_STATUS, PICO, ESP, NEW_UNIQ, PRIVATE), important=True)
+    request.then(onFailure=failed.append)
+
+    assert failed == [request]
+
+
+def testResponseOutlivesReceiveBuffer(monkeypatch):
+    monkeypatch.setattr(baseClient, 'time_ns', Clock(1_000))
+
+    link = Link()
+    request = link.writePacket(Packet(GET_MQTT_STATUS, PICO, ESP, NEW_UNIQ, PRIVATE), important=True)
+
+    buffer = bytearray(packPacket(Packet(MQTT_STATUS_DATA, ESP, PICO, request.uniq, PRIVATE, [1]), WIRE_V2))
+    link.handleRequest(PacketView(memoryview(buffer)), lambda packet: None)
+
+    # the framer reuses its buffer for the next frame
+    buffer[:] = bytes(len(buffer))
+
+    assert request.response.opcode == MQTT_STATUS_DATA
+    assert request.response.uniq == request.uniq
+    assert request.response.data == [1]
+
+    seen = []
+    request.then(lambda r, packet: seen.append(packet.data))
+    assert seen == [[1]]
+
+
+def testPeerRequestWithOurUniqDoesNotSettleOurRequest(monkeypatch):
+    monkeypatch.setattr(baseClient, 'time_ns', Clock(1_000))
+
+    esp = Link()
+    pico = Link()
+    esp.nextUniq = pico.nextUniq = 7
+
+    # both sides ping each other with the same uniq in flight
+    ours = esp.writePacket(Packet(PING, ESP, PICO, NEW_UNIQ, PRIVATE), important=True)
+    theirs = pico.writePacket(Packet(PING, PICO, ESP, NEW_UNIQ, PRIVATE), important=True)
+    assert ours.uniq == theirs.uniq == 7
+
+    handled = []
+
+    def answer(packet):
+        handled.append(packet.opcode)
+
+        if packet.opcode == PING:
+            esp.writePacket(Packet(PONG, packet.destination, packet.origin, packet.uniq, packet.channel))
+
+    esp.handleRequest(PacketView(pico.sent[0]), answer)
+
+    assert handled == [PING]
+    assert ours.pending() and esp.inFlight(PING) == 1
+
+    pico.handleRequest(PacketView(esp.sent[1]), handled.append)
+    assert not theirs.pending()
+
+    esp.handleRequest(PacketView(packPacket(Packet(PONG, PICO, ESP, 7, PRIVATE), WIRE_V2)), handled.append)
+
+    assert not ours.pending() and ours.response.opcode == PONG
+    assert esp.inFlight(PING) == 0
+
+
+def testResponseCacheCapsTotalBytes(monkeypatch):
+    monkeypatch.setattr(baseClient, 'time_ns', Clock(1_000))
+
+    link = Link()
+    cache = link.responseCache
+
+    for uniq in range(baseClient.DEDUP_SIZE):
+        request = packPacket(Packet(GET_STATS, ESP, PICO, uniq, PRIVATE), WIRE_V2)
+        reply = Packet(STATS_DATA, PICO, ESP, uniq, PRIVATE, ['x' * 300])
+        link.handleRequest(PacketView(request), lambda packet, r=reply: link.writePacket(r))
+
+        assert cache.bytes <= baseClient.DEDUP_MAX_BYTES
+        assert cache.bytes == sum([e.size for e in cache.entries.values()])
+
+    # the latest response is still replayed, the oldest ones were evicted to make room
+    sent = len(link.sent)
+    last = packPacket(Packet(GET_STATS, ESP, PICO, baseClient.DEDUP_SIZE - 1, PRIVATE), WIRE_V2)
+    link.handleRequest(PacketView(last), lambda packet: None)
+
+    assert link.sent[sent:] == [link.sent[sent - 1]]
+    assert len(cache.entries) < baseClient.DEDUP_SIZE
+
+
+def testDedupOutlivesRetransmissions():
+    class Uart(Link):
+        RTO_MAX = 5_000_000_000
+
+    link = Uart()
+    rto = baseClient.REQUEST_MIN_TIMEOUTS[GET_WIFI]
+    # the last retransmission of a slow request leaves this long after the first copy
+    span = sum([min(Uart.RTO_MAX, rto << retries) for retries in range(REQUEST_RETRIES)])
+
+    assert link.responseCache.ttl > span
+
+
+def testDuplicateReplyAfterAckIsDropped(monkeypatch):
+    monkeypatch.setattr(baseClient, 'time_ns', Clock(1_000))
+
+    link = Link()
+    request = link.writePacket(Packet(GET_MQTT_STATUS, PICO, ESP, NEW_UNIQ, PRIVATE), important=True)
+    reply = packPacket(Packet(MQTT_STATUS_DATA, ESP, PICO, request.uniq, PRIVATE, [1]), WIRE_V2)
+
+    handled = []
+    link.handleRequest(PacketView(reply), handled.append)
+    # the peer answers our retransmission as well
+    link.handleRequest(PacketView(reply), handled.append)
+
+    assert len(handled) == 1 and not request.pending()
+    assert len(link.responseCache.entries) == 0
+
+    # replies to packets that were never tracked still reach their handler
+    unsolicited = packPacket(Packet(MQTT_STATUS_DATA, ESP, PICO, 999, PRIVATE, [1]), WIRE_V2)
+    link.handleRequest(PacketView(unsolicited), handled.append)
+
+    assert len(handled) == 2
@@ -0,0 +1,67 @@
+from shared import sensors
+from shared.sensors import (QUANTIZATION_ID, SENSOR_QUANTIZED, parseSensors, quantizationId, quantizeSensors,
+                            sensorRequest, sensorRequestValid)
+
+
+SYSINFO = {
+    'cpuThreads': 2,
+    'drives': [{'name': 'SSD'}],
+    'networkInterfaces': [],
+    'gpus': [],
+}
+
+
+def makeValues() -> list:
+    # scalars, 2 cpu threads, drive read / write, 6 SMART values
+    return [1.5, 80.0, 120, 100.0, 900, 65.5, 54.25, 17.5, 1_799.9, 12_345, 3.5, 7.0, 1.5, 0.25,
+            38, 97, False, False, 23_456, 34_567]
+
+
+def testQuantizedRoundTrip():
+    values = makeValues()
+    frame = parseSensors(quantizeSensors(list(values), SYSINFO), SYSINFO, True)
+
+    for expected, actual in zip(values, frame.values):
+        assert abs(expected - actual) <= 0.05
+
+
+def testQuantizedKeepsTextInScaledSlot():
+    values = makeValues()
+    # cpu_temp is scaled by 10, HWiNFO reports a text reading while the sensor is unavailable
+    values[6] = b'N/A'
+    values[10] = 'N/A'
+    data = quantizeSensors(list(values), SYSINFO)
+
+    frame = parseSensors(data, SYSINFO, True)
+
+    assert frame.get('cpu_temp') == b'N/A'
+    assert frame.cpu(0) == 'N/A'
+    assert frame.get('cpu_power') == 65.5
+    assert frame.smart(0, 'warning') is False
+
+
+def testQuantizationId():
+    table = {'cpu_temp': {'type': 'h', 'scale': 10}, 'cpu_usage': {'type': 'h', 'scale': 10}}
+    changed = {'cpu_temp': {'type': 'h', 'scale': 100}, 'cpu_usage': {'type': 'h', 'scale': 10}}
+
+    assert quantizationId({}) == 0
+    assert 0 < quantizationId(table) <= 0xFFFF
+    assert quantizationId(table) == quantizationId(dict(reversed(list(table.items()))))
+    assert quantizationId(table) != quantizationId(changed)
+
+
+def testSensorRequestNeedsMatchingTable(monkeypatch):
+    assert QUANTIZATION_ID != 0
+    assert sensorRequest(True) == [SENSOR_QUANTIZED, QUANTIZATION_ID]
+    assert sensorRequest(False) == [0, 0]
+
+    assert sensorRequestValid([SENSOR_QUANTIZED, QUANTIZATION_ID, 7])
+    assert sensorRequestValid([0, 0])
+    assert sensorRequestValid([])
+    assert not sensorRequestValid([SENSOR_QUANTIZED])
+    assert not sensorRequestValid([SENSOR_QUANTIZED, QUANTIZATION_ID ^ 1])
+
+    # a node whose scale table did not load never asks for, nor accepts, quantized values
+    monkeypatch.setattr(sensors, 'QUANTIZATION_ID', 0)
+    assert sensorRequest(True) == [0, 0]
+    assert not sensorRequestValid([SENSOR_QUANTIZED, 0])
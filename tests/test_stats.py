@@ -0,0 +1,82 @@
+import json
+
+from shared.baseClient import BaseClient
+from shared.dispatch import Dispatcher
+from shared.opcodes import STATS_DATA
+from shared.packets import MAX_PACKET_SIZE, WIRE_V1, WIRE_V2, getPlanCacheStats, packPacket
+from shared.routes import ESP, PICO, PRIVATE
+from shared.scheduler import Scheduler
+from shared.stats import LINK_FIELDS, PLAN_FIELDS, packStats
+from shared.types import Packet
+
+
+def makeLink() -> BaseClient:
+    link = BaseClient(None)
+    link.framesIn = link.framesOut = 1_234_567
+    link.bytesIn = link.bytesOut = 98_765_432
+    link.corrupted = 321
+    link.retries = 4_567
+    link.failed = 89
+    link.queueDrops = 120
+    link.windowStalls = 4_567
+    link.maxQueueDepth = 16
+    link.latency = [123_456, 23_456, 3_456, 456, 56, 6, 1, 2, 3]
+
+    return link
+
+
+def makeStats() -> tuple:
+    # every counter of a Pico that has been up for weeks
+    scheduler = Scheduler()
+
+    for name in ('led', 'rx', 'host', 'mqtt', 'wifi', 'requests', 'leds', 'tx'):
+        task = scheduler.every(name, 50, lambda: None)
+        task.runs = 12_345_678
+        task.overruns = 1_234
+        task.maxLate = 4_567
+
+    scheduler.busy = 123_456_789
+    scheduler.idle = 987_654_321
+
+    handlers = Dispatcher()
+
+    for opcode in range(30):
+        handlers.register(opcode, lambda owner, packet: None)
+        handlers.counters[opcode] = [100_000 + opcode, 987_654_321_000]
+
+    links = {'host': makeLink().linkStats(), 'esp': makeLink().linkStats()}
+    stats = {'loop': scheduler.stats(), 'plans': getPlanCacheStats(), 'handlers': handlers.stats(), 'memFree': 123_456}
+
+    return links, stats
+
+
+def testFullStatsReplyFitsOneFrame():
+    links, stats = makeStats()
+    reply = packStats(links, stats)
+
+    for wire in (WIRE_V1, WIRE_V2):
+        frame = packPacket(Packet(STATS_DATA, PICO, ESP, 1_234, PRIVATE, [reply]), wire)
+        assert len(frame) <= MAX_PACKET_SIZE
+
+    # handlers called least often made room, the busiest ones are kept
+    handlers = json.loads(reply)['handlers']
+    assert 0 < len(handlers) < len(stats['handlers'])
+    assert '29' in handlers and '0' not in handlers
+
+
+def testCompactStatsKeepEveryCounter():
+    links, stats = makeStats()
+    reply = json.loads(packStats(links, {'plans': stats['plans'], 'memFree': 1}))
+
+    host = reply['host']
+    tail = len(LINK_FIELDS)
+
+    assert host[:tail] == [links['host'][f] for f in LINK_FIELDS]
+    assert host[tail:tail + 4] == links['host']['rx'] + links['host']['tx']
+    assert host[tail + 4:] == links['host']['latency']
+    assert reply['plans'] == [stats['plans'][f] for f in PLAN_FIELDS]
+    assert reply['memFree'] == 1
+
+    # empty slow latency buckets are left out
+    idle = BaseClient(None).linkStats()
+    assert packStats({'idle': idle}, {}) == json.dumps({'idle': [idle[f] for f in LINK_FIELDS] + [0, 0, 0, 0]})